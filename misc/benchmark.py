@@ -0,0 +1,599 @@
+# coding=utf-8
+#
+# Copyright (C) 2010-2012 Platform Computing
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+'''
+Simple benchmarks for the OCCI service.
+
+Run with: python misc/benchmark.py <benchmark> [size...]
+
+Created on Oct 18, 2012
+
+@author: tmetsch
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from occi import workflow
+from occi.backend import KindBackend, MixinBackend
+from occi.core_model import Link, Mixin, Resource
+from occi.extensions.infrastructure import COMPUTE, NETWORK, \
+    NETWORKINTERFACE
+from occi.handlers import CollectionHandler, QueryHandler, ResourceHandler, \
+    RequestContext, ACCEPT, ETAG, IF_NONE_MATCH
+from occi.persistence import JournalRegistry, SqliteRegistry
+from occi.protocol.occi_rendering import TextOcciRendering, \
+    TextPlainRendering, TextUriListRendering
+from occi.registry import ConcurrentRegistry, NonePersistentRegistry
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+TENANTS = 100
+
+
+def _timed(name, func, *args):
+    '''
+    Run a function and print how long it took.
+
+    name -- Name of the measurement.
+    func -- The function to run.
+    args -- The arguments for the function.
+    '''
+    start = time.time()
+    result = func(*args)
+    print('    %-28s %10.3f s' % (name, time.time() - start))
+    return result
+
+
+class TenantRegistry(NonePersistentRegistry):
+    '''
+    In memory registry with one owner per tenant.
+    '''
+
+    def get_extras(self, extras):
+        return extras
+
+
+class TenantSqliteRegistry(SqliteRegistry):
+    '''
+    SQLite registry with one owner per tenant.
+    '''
+
+    def get_extras(self, extras):
+        return extras
+
+
+class TenantJournalRegistry(JournalRegistry):
+    '''
+    Journal registry with one owner per tenant.
+    '''
+
+    def get_extras(self, extras):
+        return extras
+
+
+def _fill(registry, size, mixin):
+    '''
+    Add compute resources - every tenth gets the mixin.
+
+    registry -- The registry.
+    size -- Number of resources.
+    mixin -- The mixin.
+    '''
+    for i in range(size):
+        mixins = [mixin] if i % 10 == 0 else []
+        key = '/compute/' + str(i)
+        registry.add_resource(key, Resource(key, COMPUTE, mixins, []),
+                              'tenant' + str(i % TENANTS))
+    if hasattr(registry, 'flush'):
+        registry.flush()
+
+
+def _lookup(registry, size):
+    '''
+    Retrieve some resources by key.
+
+    registry -- The registry.
+    size -- Number of resources in the registry.
+    '''
+    for i in range(0, size, max(size // 1000, 1)):
+        registry.get_resource('/compute/' + str(i), 'tenant' + str(i %
+                                                                  TENANTS))
+
+
+def registry_benchmark(sizes):
+    '''
+    Compare the in memory with the SQLite registry.
+
+    sizes -- Number of resources to test with.
+    '''
+    mixin = Mixin('http://example.com#', 'mine')
+    tmp_dir = tempfile.mkdtemp()
+    for size in sizes:
+        print('%d resources' % size)
+        path = os.path.join(tmp_dir, 'bench_%d.db' % size)
+        for name, registry in [('memory', TenantRegistry()),
+                               ('sqlite', TenantSqliteRegistry(path, 10000))]:
+            print('  ' + name)
+            _timed('add', _fill, registry, size, mixin)
+            _timed('1000 lookups', _lookup, registry, size)
+            _timed('list tenant', registry.get_resources, 'tenant1')
+            _timed('list tenant by kind', registry.get_resources_by_category,
+                   COMPUTE, 'tenant1')
+            _timed('list tenant by mixin', registry.get_resources_by_category,
+                   mixin, 'tenant1')
+            _timed('list path prefix', registry.get_resources_under_path,
+                   '/compute/1234', 'tenant34')
+            if name == 'sqlite':
+                registry.close()
+                registry = TenantSqliteRegistry(path)
+                _timed('reopen + lookups', _lookup, registry, size)
+                registry.close()
+            del registry
+        os.remove(path)
+    os.rmdir(tmp_dir)
+
+
+def _restart(path):
+    '''
+    Open a journal registry and restore its state.
+
+    path -- Directory of the journal.
+    '''
+    registry = TenantJournalRegistry(path, compact_after=None)
+    registry.set_backend(COMPUTE, KindBackend(), None)
+    registry.get_resource_keys(None)
+    return registry
+
+
+def journal_benchmark(sizes):
+    '''
+    Measure the journal registry: writes and restarts from the journal and
+    from a snapshot.
+
+    sizes -- Number of resources to test with.
+    '''
+    mixin = Mixin('http://example.com#', 'mine')
+    tmp_dir = tempfile.mkdtemp()
+    for size in sizes:
+        print('%d resources' % size)
+        path = os.path.join(tmp_dir, 'bench_%d' % size)
+        registry = TenantJournalRegistry(path, compact_after=None)
+        registry.set_backend(COMPUTE, KindBackend(), None)
+        _timed('add', _fill, registry, size, mixin)
+        registry.close()
+        registry = _timed('restart from journal', _restart, path)
+        _timed('compact', registry.compact)
+        registry.close()
+        registry = _timed('restart from snapshot', _restart, path)
+        _timed('1000 lookups', _lookup, registry, size)
+        registry.close()
+        del registry
+        shutil.rmtree(path)
+    os.rmdir(tmp_dir)
+
+
+class SlowBackend(MixinBackend):
+    '''
+    Backend which simulates a round trip to a hypervisor or SDN controller.
+    '''
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def create(self, entity, extras):
+        time.sleep(self.delay)
+
+    def retrieve(self, entity, extras):
+        time.sleep(self.delay)
+
+    def delete(self, entity, extras):
+        time.sleep(self.delay)
+
+
+def _lifecycle(registry, count, mixins, target):
+    '''
+    Create, retrieve and delete computes with mixins and two links each.
+
+    registry -- The registry.
+    count -- Number of computes.
+    mixins -- The mixins of each compute.
+    target -- Target of the links.
+    '''
+    for i in range(count):
+        res = Resource(None, COMPUTE, list(mixins), [])
+        res.links = [Link(None, NETWORKINTERFACE, [], res, target)
+                     for _ in range(2)]
+        workflow.create_entity('/compute/' + str(i), res, registry, None)
+        workflow.retrieve_entity(res, registry, None)
+        workflow.delete_entity(res, registry, None)
+
+
+def backend_benchmark(delays):
+    '''
+    Compare sequential with concurrent backend calls for computes with 3
+    mixins and 2 links.
+
+    delays -- Seconds each backend call takes.
+    '''
+    mixins = [Mixin('http://example.com#', str(i)) for i in range(3)]
+    for delay in delays:
+        print('%.3f s per backend call' % delay)
+        for name, executor in [('sequential', None),
+                               ('concurrent', ThreadPoolExecutor(8))]:
+            registry = NonePersistentRegistry()
+            registry.executor = executor
+            for category in [COMPUTE, NETWORKINTERFACE] + mixins:
+                registry.set_backend(category, SlowBackend(delay), None)
+            target = Resource('/network/1', COMPUTE, [], [])
+            registry.add_resource(target.identifier, target, None)
+            _timed(name + ' 10 lifecycles', _lifecycle, registry, 10, mixins,
+                   target)
+            if executor is not None:
+                executor.shutdown()
+
+
+def filter_benchmark(sizes):
+    '''
+    Compare filtering a collection by an attribute with and without the
+    attribute index.
+
+    sizes -- Number of resources to test with.
+    '''
+    for size in sizes:
+        print('%d resources' % size)
+        for name, registry in [('scan', NonePersistentRegistry()),
+                               ('index', NonePersistentRegistry(
+                                   ['occi.compute.state']))]:
+            print('  ' + name)
+            registry.set_backend(COMPUTE, KindBackend(), None)
+            for i in range(size):
+                key = '/compute/' + str(i)
+                res = Resource(key, COMPUTE, [], [])
+                res.attributes = {'occi.compute.state': 'active'
+                                  if i % 100 == 0 else 'inactive'}
+                registry.add_resource(key, res, None)
+            _timed('filter by state', workflow.filter_entities_under_path,
+                   '/compute/', [], {'occi.compute.state': 'active'},
+                   registry, None)
+
+
+def collection_benchmark(sizes):
+    '''
+    Replace a mixin collection - half of the members change.
+
+    sizes -- Number of members of the collection.
+    '''
+    for size in sizes:
+        print('%d members' % size)
+        registry = NonePersistentRegistry()
+        mixin = Mixin('http://example.com#', 'mine')
+        registry.set_backend(COMPUTE, KindBackend(), None)
+        registry.set_backend(mixin, MixinBackend(), None)
+        entities = []
+        for i in range(size + size // 2):
+            key = '/compute/' + str(i)
+            res = Resource(key, COMPUTE, [], [])
+            registry.add_resource(key, res, None)
+            entities.append(res)
+        workflow.update_collection(mixin, [], entities[:size], registry,
+                                   None)
+        old = registry.get_resources_by_category(mixin, None)
+        _timed('replace', workflow.replace_collection, mixin, old,
+               entities[size // 2:], registry, None)
+
+
+def _tenant(size, registry):
+    '''
+    Fill a registry with computes which have one link each.
+
+    size -- Number of computes.
+    registry -- The registry.
+    '''
+    registry.set_backend(COMPUTE, KindBackend(), None)
+    registry.set_backend(NETWORKINTERFACE, KindBackend(), None)
+    target = Resource('/network/1', NETWORK, [], [])
+    registry.add_resource(target.identifier, target, None)
+    for i in range(size):
+        res = Resource('/compute/' + str(i), COMPUTE, [], [])
+        link = Link('/link/' + str(i), NETWORKINTERFACE, [], res, target)
+        res.links = [link]
+        target.links.append(link)
+        registry.add_resource(res.identifier, res, None)
+        registry.add_resource(link.identifier, link, None)
+    return registry.get_resources_by_category(COMPUTE, None)
+
+
+def teardown_benchmark(sizes):
+    '''
+    Compare deleting computes (and their links) one by one with deleting
+    them as one collection.
+
+    sizes -- Number of computes.
+    '''
+    def delete_each(entities, registry):
+        '''
+        Delete the entities one by one.
+        '''
+        for entity in entities:
+            workflow.delete_entity(entity, registry, None)
+
+    for size in sizes:
+        print('%d computes' % size)
+        for name, registry in [('memory', NonePersistentRegistry()),
+                               ('concurrent', ConcurrentRegistry())]:
+            print('  ' + name)
+            count = min(size, 10000)
+            entities = _tenant(count, registry)
+            _timed('one by one (first %d)' % count, delete_each, entities,
+                   registry)
+            registry = registry.__class__()
+            entities = _tenant(size, registry)
+            _timed('collection', workflow.delete_entities, entities, registry,
+                   None)
+
+
+def listing_benchmark(sizes):
+    '''
+    Compare rendering a uri-list as one string with streaming it - time to
+    the first chunk and for the whole body.
+
+    sizes -- Number of resources.
+    '''
+    registry = NonePersistentRegistry()
+    rendering = TextUriListRendering(registry)
+    for size in sizes:
+        print('%d resources' % size)
+        entities = [Resource('/compute/' + str(i), COMPUTE, [], [])
+                    for i in range(size)]
+        _timed('whole body', rendering.from_entities, entities, '/compute/')
+        _, body = rendering.stream_entities(entities, '/compute/')
+        _timed('first chunk', next, body)
+        _timed('remaining chunks', list, body)
+
+
+def paging_benchmark(sizes):
+    '''
+    Compare getting a page of 100 computes from the start and from the middle
+    of the listing by cursor with slicing the whole listing.
+
+    sizes -- Number of resources.
+    '''
+    for size in sizes:
+        print('%d resources' % size)
+        registry = NonePersistentRegistry()
+        registry.set_backend(COMPUTE, KindBackend(), None)
+        _fill(registry, size, None)
+        middle = registry.get_resources_after(COMPUTE, '/compute/', None,
+                                              size // 2, 'tenant0')[-1][0]
+        cursor = workflow.encode_cursor(middle)
+        _timed('whole listing sliced',
+               lambda: workflow.filter_entities_under_path(
+                   '/compute/', [], {}, registry, 'tenant0')[size // 2:][:100])
+        _timed('first page', workflow.get_page, '/compute/', [], {}, 100,
+               None, registry, 'tenant0')
+        _timed('middle page', workflow.get_page, '/compute/', [], {}, 100,
+               cursor, registry, 'tenant0')
+
+
+def polling_benchmark(counts):
+    '''
+    Compare polling an unchanged resource (with 20 links) and the query
+    interface with and without If-None-Match - and with fresh entities.
+
+    counts -- Number of GETs.
+    '''
+    registry = NonePersistentRegistry()
+    registry.set_renderer('text/occi', TextOcciRendering(registry))
+    for category in [COMPUTE, NETWORK, NETWORKINTERFACE]:
+        registry.set_backend(category, KindBackend(), None)
+    network = Resource('/network/1', NETWORK, [], [])
+    registry.add_resource(network.identifier, network, None)
+    compute = Resource('/compute/1', COMPUTE, [], [])
+    compute.links = [Link('/link/' + str(i), NETWORKINTERFACE, [], compute,
+                          network) for i in range(20)]
+    for item in [compute] + compute.links:
+        registry.add_resource(item.identifier, item, None)
+
+    def poll(handler_class, key, count, headers):
+        '''
+        GET the key count times.
+        '''
+        for _ in range(count):
+            handler_class(registry, dict(headers), '', ()).get(key)
+
+    for count in counts:
+        print('%d GETs' % count)
+        for handler_class, key in [(ResourceHandler, '/compute/1'),
+                                   (QueryHandler, '/-/')]:
+            headers = {ACCEPT: 'text/occi'}
+            _, heads, _ = handler_class(registry, dict(headers), '',
+                                        ()).get(key)
+            _timed(key + ' rendered', poll, handler_class, key, count,
+                   headers)
+            headers[IF_NONE_MATCH] = heads[ETAG]
+            _timed(key + ' not modified', poll, handler_class, key, count,
+                   headers)
+            if handler_class is ResourceHandler:
+                # the backends are only called once the entities are stale.
+                registry.freshness = {COMPUTE: 60, NETWORKINTERFACE: 60}
+                _timed(key + ' fresh', poll, handler_class, key, count,
+                       headers)
+                registry.freshness = None
+
+
+def compression_benchmark(sizes):
+    '''
+    Compare sending a text/plain listing as it is with compressing it at
+    several levels - size of the body and CPU time spent compressing.
+
+    sizes -- Number of resources.
+    '''
+    from occi.wsgi import Compression
+    registry = NonePersistentRegistry()
+    rendering = TextPlainRendering(registry)
+    for size in sizes:
+        print('%d resources' % size)
+        entities = [Resource('/compute/' + str(i), COMPUTE, [], [])
+                    for i in range(size)]
+        _, body = rendering.from_entities(entities, '/compute/')
+        print('    %-28s %10d bytes' % ('uncompressed', len(body)))
+        for coding, level in [('gzip', 1), ('gzip', 6), ('gzip', 9),
+                              ('deflate', 6)]:
+            compression = Compression(1024, level)
+            _timed('%s level %d' % (coding, level), compression.encode,
+                   coding, {}, body)
+            print('    %-28s %10d bytes (%.3f, %.3f s CPU)' %
+                  ('', compression.bytes_out, compression.get_ratio(),
+                   compression.cpu_time))
+
+
+def context_benchmark(counts):
+    '''
+    Compare GETs of a listing (10 computes as text/uri-list) with the
+    hostname set on the shared registry - as the WSGI app used to - with
+    GETs carrying it in a request context. Also counts the listings with
+    the wrong hostname when 4 threads serve different hosts.
+
+    counts -- Number of GETs.
+    '''
+    registry = NonePersistentRegistry()
+    registry.set_renderer('text/uri-list', TextUriListRendering(registry))
+    registry.set_backend(COMPUTE, KindBackend(), None)
+    _fill(registry, 10, None)
+
+    def shared(count, host):
+        '''
+        GETs with the hostname set on the registry - returns the wrong ones.
+        '''
+        wrong = 0
+        for _ in range(count):
+            headers = {ACCEPT: 'text/uri-list'}
+            registry.set_hostname(host)
+            _, _, body = CollectionHandler(registry, headers, '',
+                                           ()).get('/compute/')
+            wrong += ''.join(body).count(host) != 10
+        return wrong
+
+    def bound(count, host):
+        '''
+        GETs with the hostname in a request context - returns the wrong ones.
+        '''
+        wrong = 0
+        for _ in range(count):
+            headers = {ACCEPT: 'text/uri-list'}
+            context = RequestContext(registry, host, headers)
+            _, _, body = CollectionHandler(registry, headers, '', (), None,
+                                           context).get('/compute/')
+            wrong += ''.join(body).count(host) != 10
+        return wrong
+
+    def threaded(func, count):
+        '''
+        Serve 4 hosts from 4 threads - returns the wrong listings.
+        '''
+        with ThreadPoolExecutor(4) as pool:
+            return sum(pool.map(func, [count // 4] * 4,
+                                ['http://host' + str(i) for i in range(4)]))
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        for count in counts:
+            print('%d GETs' % count)
+            _timed('hostname on registry', shared, count, 'http://host')
+            _timed('request context', bound, count, 'http://host')
+            for name, func in [('registry', shared), ('context', bound)]:
+                wrong = _timed(name + ', 4 threads', threaded, func, count)
+                print('    %-28s %10d' % ('  wrong hostname', wrong))
+    finally:
+        sys.setswitchinterval(interval)
+
+
+def async_benchmark(counts):
+    '''
+    Compare creating computes on slow backends through the workflow with
+    creating them as coroutines on one event loop (backend calls of 0.05 s).
+
+    counts -- Number of computes.
+    '''
+    import asyncio
+    from occi import asynchronous
+
+    class SleepyBackend(asynchronous.AsyncKindBackend):
+        '''
+        Async backend which simulates a slow round trip.
+        '''
+
+        async def create(self, entity, extras):
+            await asyncio.sleep(0.05)
+
+    def create_all(registry, count):
+        '''
+        Create the computes one after another.
+        '''
+        for i in range(count):
+            workflow.create_entity('/compute/' + str(i),
+                                   Resource(None, COMPUTE, [], []), registry,
+                                   None)
+
+    async def create_all_async(registry, count):
+        '''
+        Create the computes at the same time.
+        '''
+        await asyncio.gather(*[
+            asynchronous.create_entity('/compute/' + str(i),
+                                       Resource(None, COMPUTE, [], []),
+                                       registry, None)
+            for i in range(count)])
+
+    for count in counts:
+        print('%d computes' % count)
+        registry = NonePersistentRegistry()
+        registry.set_backend(COMPUTE, SlowBackend(0.05), None)
+        _timed('sequential (first %d)' % min(count, 100), create_all,
+               registry, min(count, 100))
+        registry = NonePersistentRegistry()
+        registry.set_backend(COMPUTE, SleepyBackend(), None)
+        loop = asyncio.new_event_loop()
+        _timed('asyncio', loop.run_until_complete,
+               create_all_async(registry, count))
+        loop.close()
+
+
+BENCHMARKS = {'registry': (registry_benchmark, [100000, 1000000]),
+              'journal': (journal_benchmark, [100000, 1000000]),
+              'backends': (backend_benchmark, [0.01, 0.05]),
+              'filter': (filter_benchmark, [20000, 200000]),
+              'collection': (collection_benchmark, [10000, 50000, 100000]),
+              'teardown': (teardown_benchmark, [10000, 100000]),
+              'listing': (listing_benchmark, [500000]),
+              'paging': (paging_benchmark, [100000, 1000000]),
+              'polling': (polling_benchmark, [10000]),
+              'compression': (compression_benchmark, [10000, 100000]),
+              'context': (context_benchmark, [10000, 100000]),
+              'async': (async_benchmark, [100, 1000, 10000])}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print('Usage: benchmark.py <' + '|'.join(BENCHMARKS.keys()) +
+              '> [size...]')
+        sys.exit(1)
+    BENCHMARK, DEFAULT_SIZES = BENCHMARKS[sys.argv[1]]
+    BENCHMARK([int(item) for item in sys.argv[2:]] or DEFAULT_SIZES)
@@ -0,0 +1,496 @@
+# coding=utf-8
+#
+# Copyright (C) 2010-2012 Platform Computing
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+'''
+Coroutine versions of the workflow routines and backends for asyncio.
+
+Backends deriving from AsyncKindBackend, AsyncMixinBackend or
+AsyncActionBackend implement coroutines. The routines of all other backends
+are run in the executor of the registry (the default executor of the event
+loop if None is set) - so existing backends keep working.
+
+The handlers use these routines when the registry provides an
+EventLoopWorkflow (see Registry.get_workflow).
+
+Needs Python 3.5 or later.
+
+Created on Oct 18, 2012
+
+@author: tmetsch
+'''
+
+from occi import workflow
+from occi.backend import ActionBackend, KindBackend, MixinBackend
+import asyncio
+import functools
+import threading
+
+#==============================================================================
+# Backends
+#==============================================================================
+
+
+class AsyncKindBackend(KindBackend):
+    '''
+    A prototype backend which essentially does nothing - all routines are
+    coroutines.
+
+    Use this Backend for your Resource and Link types.
+    '''
+
+    async def create(self, entity, extras):
+        '''
+        Call the Resource Management and create this entity.
+
+        entity -- The entity which is to be created.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        pass
+
+    async def retrieve(self, entity, extras):
+        '''
+        Call the Resource Management and refresh this entity so the client gets
+        up to date information.
+
+        entity -- The entity which is to be retrieved.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        pass
+
+    async def update(self, old, new, extras):
+        '''
+        Call the Resource Management and update this entity.
+
+        old -- The old entity which is to be updated.
+        new -- The new entity holding the updated information.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        pass
+
+    async def replace(self, old, new, extras):
+        '''
+        Call the Resource Management and replace this entity.
+
+        old -- The old entity which is to be updated.
+        new -- The new entity holding the updated information.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        pass
+
+    async def delete(self, entity, extras):
+        '''
+        Call the Resource Management and delete this entity.
+
+        entity -- The entity which is to be deleted.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        pass
+
+    async def create_many(self, entities, extras):
+        '''
+        Call the Resource Management and create these entities. By default
+        create is awaited for all entities at the same time.
+
+        entities -- The entities which are to be created.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        await gather([self.create(entity, extras) for entity in entities])
+
+    async def retrieve_many(self, entities, extras):
+        '''
+        Call the Resource Management and refresh these entities. By default
+        retrieve is awaited for all entities at the same time.
+
+        entities -- The entities which are to be retrieved.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        await gather([self.retrieve(entity, extras) for entity in entities])
+
+    async def delete_many(self, entities, extras):
+        '''
+        Call the Resource Management and delete these entities. By default
+        delete is awaited for all entities at the same time.
+
+        entities -- The entities which are to be deleted.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        await gather([self.delete(entity, extras) for entity in entities])
+
+
+class AsyncMixinBackend(AsyncKindBackend, MixinBackend):
+    '''
+    A prototype backend which essentially does nothing - all routines are
+    coroutines.
+
+    Use this Backend for Mixin types.
+    '''
+
+    pass
+
+
+class AsyncActionBackend(ActionBackend):
+    '''
+    A prototype backend which essentially does nothing - all routines are
+    coroutines.
+
+    Use this Backend for Action types.
+    '''
+
+    async def action(self, entity, action, attributes, extras):
+        '''
+        Call the Resource Management and perform this action.
+
+        entity -- The entity on which the action is going to be performed.
+        action -- The action category definition.
+        attributes -- The acctributes for this action.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        pass
+
+    async def action_many(self, entities, action, attributes, extras):
+        '''
+        Call the Resource Management and perform this action on several
+        entities. Returns a list with the error for each entity (None on
+        success) - by default action is awaited for all entities at the same
+        time.
+
+        entities -- The entities on which the action is going to be performed.
+        action -- The action category definition.
+        attributes -- The acctributes for this action.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        results = await asyncio.gather(*[self.action(entity, action,
+                                                     attributes, extras)
+                                         for entity in entities],
+                                       return_exceptions=True)
+        return [item if isinstance(item, Exception) else None
+                for item in results]
+
+#==============================================================================
+# Handling of Resources & Links
+#==============================================================================
+
+
+async def create_entity(key, entity, registry, extras):
+    '''
+    Coroutine version of workflow.create_entity.
+
+    key -- The key for the entity.
+    entity -- The entity itself - either Link or Resource instance.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    await run_steps(workflow.create_entity_steps(key, entity, registry,
+                                                 extras), registry)
+
+
+async def delete_entity(entity, registry, extras):
+    '''
+    Coroutine version of workflow.delete_entity.
+
+    entity -- The entity itself - either Link or Resource instance.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    await run_steps(workflow.delete_entity_steps(entity, registry, extras),
+                    registry)
+
+
+async def replace_entity(old, new, registry, extras):
+    '''
+    Coroutine version of workflow.replace_entity.
+
+    old -- The old entity.
+    new -- The new entity.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    await run_steps(workflow.replace_entity_steps(old, new, registry, extras),
+                    registry)
+
+
+async def update_entity(old, new, registry, extras):
+    '''
+    Coroutine version of workflow.update_entity.
+
+    old -- The old entity.
+    new -- The new entity.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    await run_steps(workflow.update_entity_steps(old, new, registry, extras),
+                    registry)
+
+
+async def delete_entities(entities, registry, extras):
+    '''
+    Coroutine version of workflow.delete_entities - returns the error for
+    each entity (None on success).
+
+    entities -- The entities which are to be deleted.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    return await run_steps(workflow.delete_entities_steps(entities, registry,
+                                                          extras), registry)
+
+
+async def retrieve_entity(entity, registry, extras, links=True):
+    '''
+    Coroutine version of workflow.retrieve_entity - shares the retrieve
+    cache (and the retrieves in flight) with it.
+
+    entity -- The entity which is to be retrieved.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    links -- If False the links of a resource are not retrieved.
+    '''
+    cache = workflow.get_retrieve_cache(registry)
+    flight = cache.take_off(entity, links)
+    if flight is not None:
+        loop = asyncio.get_event_loop()
+        done = loop.create_future()
+        flight.add_done_callback(
+            functools.partial(loop.call_soon_threadsafe, _resolve, done))
+        await done
+        if flight.error is not None:
+            raise flight.error
+        return
+    try:
+        await run_steps(workflow.retrieve_entity_steps(entity, links, cache,
+                                                       registry, extras),
+                        registry)
+    except Exception as err:
+        cache.land(entity, err, links)
+        raise
+    cache.land(entity, None, links)
+
+
+async def action_entity(entity, action, registry, attributes, extras):
+    '''
+    Coroutine version of workflow.action_entity.
+
+    entity -- The entity on which to perform the operation.
+    action -- The action definition.
+    registry -- The registry used for this process.
+    attributes -- The attributes fro the operation.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    await run_steps(workflow.action_entity_steps(entity, action, registry,
+                                                 attributes, extras),
+                    registry)
+
+#==============================================================================
+# Collections
+#==============================================================================
+
+
+async def action_collection(entities, action, registry, attributes, extras):
+    '''
+    Coroutine version of workflow.action_collection - the entities are
+    split into up to get_collection_action_limit() batches which are all
+    awaited at the same time.
+
+    Returns a list with the error raised for each entity (None on success)
+    in the order of the entities.
+
+    entities -- The entities on which to perform the operation.
+    action -- The action definition.
+    registry -- The registry used for this process.
+    attributes -- The attributes fro the operation.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    limit = registry.get_collection_action_limit()
+    return await run_steps(workflow.action_collection_steps(
+        entities, action, registry, attributes, extras, limit), registry)
+
+
+async def update_collection(mixin, old_entities, new_entities, registry,
+                            extras):
+    '''
+    Coroutine version of workflow.update_collection.
+
+    mixin -- The mixin which defines the collection.
+    old_entities -- The entities which are in the collection to date.
+    new_entities -- The entities which should be added to the collection.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    await run_steps(workflow.update_collection_steps(
+        mixin, old_entities, new_entities, registry, extras), registry)
+
+
+async def replace_collection(mixin, old_entities, new_entities, registry,
+                             extras):
+    '''
+    Coroutine version of workflow.replace_collection.
+
+    mixin -- The mixin which defines the collection.
+    old_entities -- The entities which are in the collection to date.
+    new_entities -- The new collection of entities.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    await run_steps(workflow.replace_collection_steps(
+        mixin, old_entities, new_entities, registry, extras), registry)
+
+
+async def delete_from_collection(mixin, entities, registry, extras):
+    '''
+    Coroutine version of workflow.delete_from_collection.
+
+    mixin -- The mixin which defines the collection.
+    entities -- The entities which are to be removed.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    await run_steps(workflow.delete_from_collection_steps(
+        mixin, entities, registry, extras), registry)
+
+#==============================================================================
+# Running on an event loop
+#==============================================================================
+
+OPERATIONS = {'create_entity': create_entity,
+              'delete_entity': delete_entity,
+              'replace_entity': replace_entity,
+              'update_entity': update_entity,
+              'delete_entities': delete_entities,
+              'retrieve_entity': retrieve_entity,
+              'action_entity': action_entity,
+              'action_collection': action_collection,
+              'update_collection': update_collection,
+              'replace_collection': replace_collection,
+              'delete_from_collection': delete_from_collection}
+
+
+class EventLoopWorkflow(object):
+    '''
+    Offers the routines of the workflow module to the (synchronous) handlers
+    - those which call backends run as coroutines on an event loop and the
+    calling thread waits for their result. All other routines are the ones
+    from the workflow module.
+
+    Set it as workflow of the registry:
+
+        registry.workflow = EventLoopWorkflow()
+
+    Without a loop a new one is started in a daemon thread. A given loop
+    must be running in another thread than the handlers.
+    '''
+
+    def __init__(self, loop=None):
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever)
+            thread.daemon = True
+            thread.start()
+        self.loop = loop
+
+    def __getattr__(self, name):
+        if name not in OPERATIONS:
+            return getattr(workflow, name)
+        operation = OPERATIONS[name]
+
+        def call(*args):
+            '''
+            Runs the coroutine on the loop and waits for its result.
+            '''
+            return asyncio.run_coroutine_threadsafe(operation(*args),
+                                                    self.loop).result()
+        return call
+
+    def close(self):
+        '''
+        Stops the event loop.
+        '''
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+#==============================================================================
+# Convenient stuff
+#==============================================================================
+
+
+async def run_steps(steps, registry):
+    '''
+    Coroutine version of workflow.run_steps - the backend routines of each
+    BackendCalls are awaited at the same time (see run).
+
+    steps -- The steps (generator) of the routine.
+    registry -- The registry used for this process.
+    '''
+    outcome = error = None
+    while True:
+        try:
+            if error is None:
+                request = steps.send(outcome)
+            else:
+                request = steps.throw(error)
+        except StopIteration:
+            return None
+        if not isinstance(request, workflow.BackendCalls):
+            steps.close()
+            return request
+        results = await asyncio.gather(*[run(registry, *call)
+                                         for call in request.calls],
+                                       return_exceptions=True)
+        try:
+            outcome, error = request.outcome(results), None
+        except Exception as err:  # pylint: disable=W0703
+            outcome, error = None, err
+
+
+async def run(registry, func, *args):
+    '''
+    Awaits a backend routine - routines which are no coroutine functions are
+    run in the executor of the registry (the default executor of the loop
+    if None is set).
+
+    registry -- The registry used for this process.
+    func -- The backend routine.
+    args -- The arguments for the routine.
+    '''
+    if asyncio.iscoroutinefunction(func):
+        return await func(*args)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(registry.get_executor(),
+                                      functools.partial(func, *args))
+
+
+async def gather(coroutines):
+    '''
+    Awaits all coroutines at the same time and raises the error of the
+    first one which failed (in the given order) after all finished.
+
+    coroutines -- The coroutines.
+    '''
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    for item in results:
+        if isinstance(item, Exception):
+            raise item
+    return results
+
+
+def _resolve(future):
+    '''
+    Completes a future unless it was cancelled.
+
+    future -- The future.
+    '''
+    if not future.done():
+        future.set_result(None)
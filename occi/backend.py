@@ -147,6 +147,42 @@ class KindBackend(object):
         '''
         pass
 
+    def create_many(self, entities, extras):
+        '''
+        Call the Resource Management and create these entities. Called by the
+        workflow whenever an operation covers several entities.
+
+        Overwrite this if the Resource Management supports bulk operations -
+        by default create is called for each entity.
+
+        entities -- The entities which are to be created.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        for entity in entities:
+            self.create(entity, extras)
+
+    def retrieve_many(self, entities, extras):
+        '''
+        Call the Resource Management and refresh these entities. By default
+        retrieve is called for each entity.
+
+        entities -- The entities which are to be retrieved.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        for entity in entities:
+            self.retrieve(entity, extras)
+
+    def delete_many(self, entities, extras):
+        '''
+        Call the Resource Management and delete these entities. By default
+        delete is called for each entity.
+
+        entities -- The entities which are to be deleted.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        for entity in entities:
+            self.delete(entity, extras)
+
 
 class ActionBackend(object):
     '''
@@ -169,6 +205,28 @@ class ActionBackend(object):
         '''
         pass
 
+    def action_many(self, entities, action, attributes, extras):
+        '''
+        Call the Resource Management and perform this action on several
+        entities. A failing entity should not stop the others.
+
+        Returns a list with the error for each entity (None on success) -
+        by default action is called for each entity.
+
+        entities -- The entities on which the action is going to be performed.
+        action -- The action category definition.
+        attributes -- The acctributes for this action.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        errors = []
+        for entity in entities:
+            try:
+                self.action(entity, action, attributes, extras)
+                errors.append(None)
+            except Exception as err:  # pylint: disable=W0703
+                errors.append(err)
+        return errors
+
 
 class MixinBackend(KindBackend):
     '''
@@ -28,6 +28,8 @@ Created on Jun 27, 2011
 # disabling 'Too many arguments' pylint check (It's more elegant this way...)
 # pylint: disable=R0903, R0913
 
+import collections
+
 #==============================================================================
 # Categories
 #==============================================================================
@@ -114,6 +116,85 @@ class Mixin(Category):
 #==============================================================================
 
 
+class MixinList(object):
+    '''
+    The mixins of an entity - an ordered set which behaves like a list (so
+    append, remove and membership tests cost O(1)). Appending a mixin which
+    is already present does nothing. Indexing uses a list of the mixins which
+    is rebuilt after each change.
+    '''
+
+    def __init__(self, mixins=None):
+        self._mixins = collections.OrderedDict()
+        self._sequence = None
+        for mixin in mixins or []:
+            self._mixins[mixin] = None
+
+    def append(self, mixin):
+        '''
+        Adds a mixin at the end.
+
+        mixin -- The mixin.
+        '''
+        if mixin not in self._mixins:
+            self._mixins[mixin] = None
+            self._sequence = None
+
+    def extend(self, mixins):
+        '''
+        Adds several mixins at the end.
+
+        mixins -- The mixins.
+        '''
+        for mixin in mixins:
+            self.append(mixin)
+
+    def remove(self, mixin):
+        '''
+        Removes a mixin - raises ValueError if it is not present.
+
+        mixin -- The mixin.
+        '''
+        try:
+            del self._mixins[mixin]
+        except KeyError:
+            raise ValueError('Mixin not present.')
+        self._sequence = None
+
+    def __contains__(self, mixin):
+        try:
+            return mixin in self._mixins
+        except TypeError:
+            return False
+
+    def __iter__(self):
+        return iter(self._mixins)
+
+    def __len__(self):
+        return len(self._mixins)
+
+    def __getitem__(self, index):
+        if self._sequence is None:
+            self._sequence = list(self._mixins)
+        return self._sequence[index]
+
+    def __eq__(self, other):
+        if not isinstance(other, (MixinList, list, tuple)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 class Entity(object):
     '''
     OCCI Entity.
@@ -130,6 +211,22 @@ class Entity(object):
         self.actions = []
         self.extras = None
 
+    def _get_mixins(self):
+        '''
+        Returns the mixins of the entity.
+        '''
+        return self._mixins
+
+    def _set_mixins(self, mixins):
+        '''
+        Sets the mixins of the entity.
+
+        mixins -- List of mixins.
+        '''
+        self._mixins = MixinList(mixins)
+
+    mixins = property(_get_mixins, _set_mixins)
+
 
 class Resource(Entity):
     '''
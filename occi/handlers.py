@@ -35,9 +35,65 @@ CONTENT_TYPE = 'Content-Type'
 ACCEPT = 'Accept'
 LINK = 'Link'
 LOCATION = 'X-OCCI-Location'
+NEXT = 'X-OCCI-Next'
 ATTRIBUTE = 'X-OCCI-Attribute'
 CATEGORY = 'Category'
 QUERY_STRING = 'Query_String'
+ETAG = 'ETag'
+IF_NONE_MATCH = 'If-None-Match'
+
+# query to skip retrieving the links of a resource.
+LAZY_LINKS = ('links', 'lazy')
+
+
+class RequestContext(object):
+    '''
+    Everything which belongs to a single request and nothing else: the
+    hostname the client used, the parsed headers, the extras and the
+    renderings negotiated for them.
+
+    The renderings are bound to the context (see Rendering.bind) so nothing
+    about the request is written to the shared registry.
+    '''
+
+    def __init__(self, registry, hostname=None, headers=None, extras=None):
+        '''
+        registry -- The OCCI registry.
+        hostname -- The hostname of the service as seen by the client
+                    (default: the one of the registry).
+        headers -- The parsed headers of the request.
+        extras -- Any extra arguments which are defined by the user.
+        '''
+        self.registry = registry
+        if hostname is None and registry is not None:
+            hostname = registry.get_hostname()
+        self.hostname = hostname
+        self.headers = headers
+        self.extras = extras
+        self._renderers = {}
+        self._bound = {}
+
+    def get_renderer(self, content_type):
+        '''
+        Returns the rendering for the Content-Type or Accept header of the
+        request - bound to this context.
+
+        Resolved once per request and header.
+
+        content_type -- String with either either Content-Type or Accept.
+        '''
+        if content_type not in self._renderers:
+            try:
+                rendering = self.registry.get_renderer(
+                    self.headers[content_type])
+            except KeyError:
+                # In case no Accept is defined in the request
+                rendering = self.registry.get_renderer(
+                    self.registry.get_default_type())
+            if rendering not in self._bound:
+                self._bound[rendering] = rendering.bind(self)
+            self._renderers[content_type] = self._bound[rendering]
+        return self._renderers[content_type]
 
 
 class BaseHandler(object):
@@ -48,13 +104,21 @@ class BaseHandler(object):
     # disabling 'Too many arguments' pylint check (only inst. within module)
     # pylint: disable=R0913
 
-    def __init__(self, registry, headers, body, query, extras=None):
+    def __init__(self, registry, headers, body, query, extras=None,
+                 context=None):
         self.registry = registry
         self.headers = headers
         self.body = body
         self.query = query
 
         self.extras = extras
+        if context is None:
+            context = RequestContext(registry, None, headers, extras)
+        self.context = context
+
+        self.workflow = workflow
+        if registry is not None and registry.get_workflow() is not None:
+            self.workflow = registry.get_workflow()
 
     def handle(self, method, key):
         '''
@@ -72,15 +136,11 @@ class BaseHandler(object):
 
     def get_renderer(self, content_type):
         '''
-        Returns the proper rendering parser.
+        Returns the proper rendering parser (see RequestContext).
 
         content_type -- String with either either Content-Type or Accept.
         '''
-        try:
-            return self.registry.get_renderer(self.headers[content_type])
-        except KeyError:
-            # In case no Accept is defined in the request
-            return self.registry.get_renderer(self.registry.get_default_type())
+        return self.context.get_renderer(content_type)
 
     def response(self, status, headers=None, body='OK'):
         '''
@@ -100,6 +160,50 @@ class BaseHandler(object):
 
         return status, headers, body
 
+    def check_etag(self, version):
+        '''
+        Returns the ETag for a version of what is about to be rendered (None
+        if there is no version) and True if the client already has it - so
+        a 304 can be returned without rendering anything.
+
+        version -- The version as returned by the registry.
+        '''
+        if version is None:
+            return None, False
+        # every rendering is a representation of its own.
+        etag = '"' + version + '-' + self.get_renderer(ACCEPT).mime_type + '"'
+        tags = [item.strip() for item in
+                self.headers.get(IF_NONE_MATCH, '').split(',')]
+        match = '*' in tags or etag in tags or 'W/' + etag in tags
+        return etag, match
+
+    def report(self, entities, errors):
+        '''
+        Returns a report with one line per entity stating if the operation
+        succeeded. The status is 200 if all succeeded - otherwise the status
+        of the first error.
+
+        entities -- The entities.
+        errors -- The error for each entity (None on success).
+        '''
+        status = 200
+        lines = []
+        for entity, error in zip(entities, errors):
+            location = self.context.hostname + entity.identifier
+            if error is None:
+                lines.append(location + ': OK')
+                continue
+            if isinstance(error, HTTPError):
+                code, msg = error.code, error.message
+            elif isinstance(error, AttributeError):
+                code, msg = 400, str(error)
+            else:
+                code, msg = 500, str(error)
+            if status == 200:
+                status = code
+            lines.append(location + ': ' + str(code) + ' - ' + msg)
+        return self.response(status, body='\n'.join(lines) or 'OK')
+
     def parse_action(self):
         '''
         Retrieves the Action which was given in the request.
@@ -130,6 +234,27 @@ class BaseHandler(object):
 
         return categories, attributes
 
+    def parse_page(self):
+        '''
+        Retrieve the limit and the cursor which where provided in the query
+        string of the request for paging (None if not given).
+        '''
+        params = {}
+        for item in (self.headers.get(QUERY_STRING) or '').split('&'):
+            name, _, value = item.partition('=')
+            params[name] = value
+
+        limit = params.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = 0
+            if limit < 1:
+                raise AttributeError('The limit needs to be a positive'
+                                     ' number.')
+        return limit, params.get('cursor')
+
     def parse_entity(self, def_kind=None):
         '''
         Retrieves the entity which was rendered within the request.
@@ -174,15 +299,22 @@ class BaseHandler(object):
 
         return 200, headers, body
 
-    def render_entities(self, entities, key):
+    def render_entities(self, entities, key, next_page=None):
         '''
-        Renders a list of entities to the client.
+        Renders a list of entities to the client. The body is a string or an
+        iterable of chunks (see Rendering.stream_entities).
 
         entities -- The entities which should be rendered.
+        key -- The path of the listing.
+        next_page -- URL of the next page of a paged listing (if any).
         '''
         rendering = self.get_renderer(ACCEPT)
 
-        headers, body = rendering.from_entities(entities, key)
+        if next_page is None:
+            headers, body = rendering.stream_entities(entities, key)
+        else:
+            headers, body = rendering.stream_entities(entities, key,
+                                                      next_page)
 
         return 200, headers, body
 
@@ -213,9 +345,21 @@ class ResourceHandler(BaseHandler):
         try:
             entity = self.registry.get_resource(key, self.extras)
 
-            workflow.retrieve_entity(entity, self.registry, self.extras)
-
-            return self.render_entity(entity)
+            links = self.get_renderer(ACCEPT).fresh_links and \
+                self.query != LAZY_LINKS and \
+                not self.registry.get_lazy_links(entity.kind)
+            self.workflow.retrieve_entity(entity, self.registry, self.extras,
+                                          links)
+
+            etag, match = self.check_etag(self.registry.get_version(
+                key, self.extras))
+            if match:
+                return 304, {ETAG: etag}, ''
+
+            status, headers, body = self.render_entity(entity)
+            if etag is not None:
+                headers[ETAG] = etag
+            return status, headers, body
         except KeyError as key_error:
             raise HTTPError(404, 'Resource not found: ' + str(key_error))
 
@@ -231,8 +375,8 @@ class ResourceHandler(BaseHandler):
                 entity = self.registry.get_resource(key, self.extras)
                 action, attr = self.parse_action()
 
-                workflow.action_entity(entity, action, self.registry, attr,
-                                       self.extras)
+                self.workflow.action_entity(entity, action, self.registry,
+                                            attr, self.extras)
 
                 return self.render_entity(entity)
             except AttributeError as attr:
@@ -245,7 +389,8 @@ class ResourceHandler(BaseHandler):
                 old = self.registry.get_resource(key, self.extras)
                 new = self.parse_entity(def_kind=old.kind)
 
-                workflow.update_entity(old, new, self.registry, self.extras)
+                self.workflow.update_entity(old, new, self.registry,
+                                            self.extras)
 
                 return self.render_entity(old)
             except AttributeError as attr:
@@ -259,13 +404,14 @@ class ResourceHandler(BaseHandler):
 
         key -- The resource id.
         '''
-        if key in self.registry.get_resource_keys(self.extras):
+        if self.registry.has_resource(key, self.extras):
             # replace...
             try:
                 old = self.registry.get_resource(key, self.extras)
                 new = self.parse_entity()
 
-                workflow.replace_entity(old, new, self.registry, self.extras)
+                self.workflow.replace_entity(old, new, self.registry,
+                                             self.extras)
 
                 return self.render_entity(old)
             except AttributeError as attr:
@@ -275,9 +421,10 @@ class ResourceHandler(BaseHandler):
             try:
                 entity = self.parse_entity()
 
-                workflow.create_entity(key, entity, self.registry, self.extras)
+                self.workflow.create_entity(key, entity, self.registry,
+                                            self.extras)
 
-                heads = {'Location': self.registry.get_hostname() +
+                heads = {'Location': self.context.hostname +
                          entity.identifier}
                 return self.response(201, heads)
             except AttributeError as attr:
@@ -293,7 +440,7 @@ class ResourceHandler(BaseHandler):
         try:
             entity = self.registry.get_resource(key, self.extras)
 
-            workflow.delete_entity(entity, self.registry, self.extras)
+            self.workflow.delete_entity(entity, self.registry, self.extras)
 
             return self.response(200)
         except AttributeError as attr:
@@ -313,14 +460,29 @@ class CollectionHandler(BaseHandler):
 
         key -- The resource id.
         '''
+        # unknown paths - neither a location nor anything living under it
+        if key != '/' and \
+                self.registry.get_category(key, self.extras) is None and \
+                not self.registry.has_resources_under_path(key, self.extras):
+            raise HTTPError(404, 'Nothing found under path: ' + key)
+
         # retrieve (filter)
         try:
             categories, attributes = self.parse_filter()
-            entities = workflow.get_entities_under_path(key, self.registry,
-                                                        self.extras)
-            result = workflow.filter_entities(entities, categories, attributes)
-
-            return self.render_entities(result, key)
+            limit, cursor = self.parse_page()
+            if limit is None and cursor is None:
+                result = self.workflow.filter_entities_under_path(
+                    key, categories, attributes, self.registry, self.extras)
+                return self.render_entities(result, key)
+
+            result, cursor = self.workflow.get_page(key, categories,
+                                                    attributes, limit, cursor,
+                                                    self.registry, self.extras)
+            next_page = None
+            if cursor is not None:
+                next_page = self.context.hostname + key + \
+                    '?limit=' + str(limit) + '&cursor=' + cursor
+            return self.render_entities(result, key, next_page)
         except AttributeError as attr:
             raise HTTPError(400, str(attr))
 
@@ -334,23 +496,23 @@ class CollectionHandler(BaseHandler):
             # action
             try:
                 action, attr = self.parse_action()
-                entities = workflow.get_entities_under_path(key, self.registry,
-                                                            self.extras)
-                for entity in entities:
-                    workflow.action_entity(entity, action, self.registry, attr,
-                                           self.extras)
-
-                return self.response(200)
+                entities = self.workflow.get_entities_under_path(
+                    key, self.registry, self.extras)
+                errors = self.workflow.action_collection(entities, action,
+                                                         self.registry, attr,
+                                                         self.extras)
             except AttributeError as attr:
                 raise HTTPError(400, str(attr))
+            return self.report(entities, errors)
         elif not len(self.parse_entities()):
             # create resource (&links)
             try:
                 entity = self.parse_entity()
-                workflow.create_entity(workflow.create_id(entity.kind),
-                                       entity, self.registry, self.extras)
+                self.workflow.create_entity(
+                    self.workflow.create_id(entity.kind), entity,
+                    self.registry, self.extras)
 
-                heads = {'Location': self.registry.get_hostname() +
+                heads = {'Location': self.context.hostname +
                          entity.identifier}
                 return self.response(201, heads)
             except AttributeError as attr:
@@ -360,12 +522,11 @@ class CollectionHandler(BaseHandler):
             try:
                 mixin = self.registry.get_category(key, self.extras)
                 new_entities = self.parse_entities()
-                old_entities = workflow.get_entities_under_path(key,
-                                                                self.registry,
-                                                                self.extras)
-                workflow.update_collection(mixin, old_entities,
-                                           new_entities, self.registry,
-                                           self.extras)
+                old_entities = self.workflow.get_entities_under_path(
+                    key, self.registry, self.extras)
+                self.workflow.update_collection(mixin, old_entities,
+                                                new_entities, self.registry,
+                                                self.extras)
 
                 return self.response(200)
             except AttributeError as attr:
@@ -381,10 +542,10 @@ class CollectionHandler(BaseHandler):
         try:
             mixin = self.registry.get_category(key, self.extras)
             new_entities = self.parse_entities()
-            old_entities = workflow.get_entities_under_path(key, self.registry,
-                                                            self.extras)
-            workflow.replace_collection(mixin, old_entities, new_entities,
-                                        self.registry, self.extras)
+            old_entities = self.workflow.get_entities_under_path(
+                key, self.registry, self.extras)
+            self.workflow.replace_collection(mixin, old_entities, new_entities,
+                                             self.registry, self.extras)
 
             return self.response(200)
         except AttributeError as attr:
@@ -398,19 +559,20 @@ class CollectionHandler(BaseHandler):
         '''
         if not len(self.parse_entities()):
             # delete entities
-            entities = workflow.get_entities_under_path(key, self.registry,
-                                                        self.extras)
-            for entity in entities:
-                workflow.delete_entity(entity, self.registry, self.extras)
+            entities = self.workflow.get_entities_under_path(
+                key, self.registry, self.extras)
+            errors = self.workflow.delete_entities(entities, self.registry,
+                                                   self.extras)
 
-            return self.response(200)
+            return self.report(entities, errors)
         elif len(self.parse_entities()) > 0:
             # remove from collection
             try:
                 mixin = self.registry.get_category(key, self.extras)
                 entities = self.parse_entities()
-                workflow.delete_from_collection(mixin, entities, self.registry,
-                                                self.extras)
+                self.workflow.delete_from_collection(mixin, entities,
+                                                     self.registry,
+                                                     self.extras)
 
                 return self.response(200)
             except AttributeError as attr:
@@ -436,10 +598,21 @@ class QueryHandler(BaseHandler):
         try:
             categories, attributes = self.parse_filter()
 
-            result = workflow.filter_categories(categories, self.registry,
-                                                self.extras)
-
-            return self.render_categories(result)
+            # only the unfiltered interface is versioned.
+            etag = None
+            if not categories and not attributes:
+                etag, match = self.check_etag(
+                    self.registry.get_categories_version(self.extras))
+                if match:
+                    return 304, {ETAG: etag}, ''
+
+            result = self.workflow.filter_categories(categories, self.registry,
+                                                     self.extras)
+
+            status, headers, body = self.render_categories(result)
+            if etag is not None:
+                headers[ETAG] = etag
+            return status, headers, body
         except AttributeError as attr:
             raise HTTPError(400, str(attr))
 
@@ -453,7 +626,7 @@ class QueryHandler(BaseHandler):
         try:
             mixins = self.parse_mixins()
 
-            workflow.append_mixins(mixins, self.registry, self.extras)
+            self.workflow.append_mixins(mixins, self.registry, self.extras)
 
             return self.render_categories(mixins)
         except AttributeError as attr:
@@ -469,7 +642,7 @@ class QueryHandler(BaseHandler):
         try:
             categories, attributes = self.parse_filter()
 
-            workflow.remove_mixins(categories, self.registry, self.extras)
+            self.workflow.remove_mixins(categories, self.registry, self.extras)
 
             return self.response(200)
         except AttributeError as attr:
@@ -0,0 +1,1164 @@
+# coding=utf-8
+#
+# Copyright (C) 2010-2012 Platform Computing
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+'''
+Registries which persist the resources and user defined mixins of the
+service - either in a SQLite database or in a journal with snapshots.
+
+Renderings and backends are Python objects and are not persisted - register
+them on every start as usual. User defined mixins are restored on first use,
+so make sure all backends are registered before the first request comes in.
+
+Created on Oct 18, 2012
+
+@author: tmetsch
+'''
+
+# disabling 'Too many instance attributes' pylint check (it's a registry)
+# disabling 'Too many public methods' pylint check (see above)
+# pylint: disable=R0902,R0904
+
+from occi.backend import UserDefinedMixinBackend
+from occi.core_model import Action, Entity, Kind, Link, Mixin, Resource
+from occi.registry import NonePersistentRegistry
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+import weakref
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+#==============================================================================
+# Conversion of the OCCI model to records
+#==============================================================================
+
+
+def get_category_ref(category):
+    '''
+    Returns a string which identifies a category - scheme, term and owner.
+
+    category -- The category.
+    '''
+    owner = None
+    if category.extras is not None:
+        owner = str(category.extras)
+    return json.dumps([category.scheme, category.term, owner])
+
+
+def get_owner_key(owner):
+    '''
+    Returns the string used to look up resources of an owner (the same
+    representation the category hash uses).
+
+    owner -- The owner as returned by get_extras.
+    '''
+    if owner is None:
+        return None
+    return str(owner)
+
+
+def get_entity_type(entity):
+    '''
+    Returns the name of the type of the entity.
+
+    entity -- The entity.
+    '''
+    if isinstance(entity, Link):
+        return 'link'
+    elif isinstance(entity, Resource):
+        return 'resource'
+    return 'entity'
+
+
+def dump_value(value):
+    '''
+    Serializes a Python object for storage.
+
+    value -- The object.
+    '''
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def load_value(value):
+    '''
+    Deserializes a Python object from storage.
+
+    value -- The stored value.
+    '''
+    return pickle.loads(bytes(value))
+
+
+def create_category(ref, cls):
+    '''
+    Creates a bare category from a reference - used when the category is not
+    registered (anymore).
+
+    ref -- The category reference.
+    cls -- The class of the category.
+    '''
+    scheme, term, owner = json.loads(ref)
+    category = cls(str(scheme), str(term))
+    category.extras = owner
+    return category
+
+#==============================================================================
+# SQLite
+#==============================================================================
+
+SCHEMA = ['CREATE TABLE IF NOT EXISTS resources (identifier TEXT PRIMARY KEY,'
+          ' owner_key TEXT, owner BLOB, type TEXT, kind TEXT, title BLOB,'
+          ' summary BLOB, attributes BLOB, actions TEXT, source TEXT,'
+          ' target TEXT)',
+          'CREATE INDEX IF NOT EXISTS resources_owner ON'
+          ' resources (owner_key)',
+          'CREATE INDEX IF NOT EXISTS resources_kind ON'
+          ' resources (kind, owner_key)',
+          'CREATE INDEX IF NOT EXISTS resources_source ON resources (source)',
+          'CREATE TABLE IF NOT EXISTS mixins (category TEXT, identifier TEXT,'
+          ' position INTEGER, PRIMARY KEY (category, identifier))',
+          'CREATE INDEX IF NOT EXISTS mixins_identifier ON'
+          ' mixins (identifier)',
+          'CREATE TABLE IF NOT EXISTS categories (ref TEXT PRIMARY KEY,'
+          ' scheme TEXT, term TEXT, title TEXT, location TEXT, owner BLOB,'
+          ' related TEXT)']
+
+RESOURCE_COLUMNS = 'identifier, owner, type, kind, title, summary,' \
+                   ' attributes, actions, source, target'
+
+INSERT_RESOURCE = 'INSERT OR REPLACE INTO resources (identifier, owner_key,' \
+                  ' owner, type, kind, title, summary, attributes, actions,' \
+                  ' source, target) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+DELETE_RESOURCE = 'DELETE FROM resources WHERE identifier = ?'
+INSERT_MIXIN = 'INSERT OR REPLACE INTO mixins (category, identifier,' \
+               ' position) VALUES (?, ?, ?)'
+DELETE_MIXIN = 'DELETE FROM mixins WHERE category = ? AND identifier = ?'
+DELETE_MIXINS = 'DELETE FROM mixins WHERE identifier = ?'
+INSERT_CATEGORY = 'INSERT OR REPLACE INTO categories (ref, scheme, term,' \
+                  ' title, location, owner, related) VALUES' \
+                  ' (?, ?, ?, ?, ?, ?, ?)'
+DELETE_CATEGORY = 'DELETE FROM categories WHERE ref = ?'
+
+VISIBLE = '(owner_key IS NULL OR owner_key = ?)'
+SELECT_RESOURCE = 'SELECT ' + RESOURCE_COLUMNS + ' FROM resources' \
+                  ' WHERE identifier = ?'
+SELECT_RESOURCES = 'SELECT ' + RESOURCE_COLUMNS + ' FROM resources' \
+                   ' WHERE ' + VISIBLE
+SELECT_KEYS = 'SELECT identifier, owner FROM resources WHERE ' + VISIBLE
+SELECT_BY_KIND = 'SELECT ' + RESOURCE_COLUMNS + ' FROM resources' \
+                 ' WHERE kind = ? AND ' + VISIBLE
+SELECT_BY_MIXIN = 'SELECT ' + RESOURCE_COLUMNS + ' FROM resources' \
+                  ' WHERE ' + VISIBLE + ' AND identifier IN (SELECT' \
+                  ' identifier FROM mixins WHERE category = ?)'
+SELECT_BY_PREFIX = 'SELECT ' + RESOURCE_COLUMNS + ' FROM resources' \
+                   ' WHERE identifier >= ? AND identifier < ? AND ' + VISIBLE
+SELECT_OWNERS_BY_PREFIX = 'SELECT owner FROM resources WHERE' \
+                          ' identifier >= ? AND identifier < ? AND ' + VISIBLE
+AFTER = ' AND identifier > ? ORDER BY identifier LIMIT ?'
+SELECT_ALL_AFTER = 'SELECT ' + RESOURCE_COLUMNS + ' FROM resources' \
+                   ' WHERE ' + VISIBLE + AFTER
+SELECT_BY_KIND_AFTER = SELECT_BY_KIND + AFTER
+SELECT_BY_MIXIN_AFTER = SELECT_BY_MIXIN + AFTER
+SELECT_BY_PREFIX_AFTER = SELECT_BY_PREFIX + AFTER
+SELECT_RESOURCES_IN = 'SELECT ' + RESOURCE_COLUMNS + ' FROM resources' \
+                      ' WHERE identifier IN (%s)'
+SELECT_LINKS_IN = 'SELECT source, identifier FROM resources' \
+                  ' WHERE source IN (%s) ORDER BY rowid'
+SELECT_MIXINS_IN = 'SELECT identifier, category FROM mixins' \
+                   ' WHERE identifier IN (%s) ORDER BY position'
+
+# max. number of keys per IN (...) query - SQLite limits the parameters.
+IN_SIZE = 500
+SELECT_CATEGORIES = 'SELECT scheme, term, title, location, owner, related' \
+                    ' FROM categories'
+
+
+class SqliteRegistry(NonePersistentRegistry):
+    '''
+    Registry which stores resources and user defined mixins in a SQLite
+    database (in WAL mode).
+
+    Identifier, owner, kind and mixin membership are indexed columns so
+    lookups and listings are done by the database. Writes are queued and
+    flushed in batches within one transaction - either when batch_size
+    writes are pending, before the database is queried or when flush() is
+    called.
+
+    Loaded entities are kept in an identity map (as long as they are in use)
+    so the workflow and the backends always work on the same objects.
+    Changes to an entity done by the backends are written when the workflow
+    calls update_resource.
+    '''
+
+    def __init__(self, path=':memory:', batch_size=1000):
+        '''
+        Constructor.
+
+        path -- Path to the database file (default: in memory).
+        batch_size -- Number of writes which are queued before flushing.
+        '''
+        super(SqliteRegistry, self).__init__()
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(path, check_same_thread=False,
+                                          cached_statements=len(SCHEMA) + 32)
+        self.connection.text_factory = str
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+        self._lock = threading.RLock()
+        self._pending = []
+        self._loaded = weakref.WeakValueDictionary()
+        self._by_ref = None
+        self._restored = False
+
+    #==========================================================================
+    # Writes
+    #==========================================================================
+
+    def _queue(self, statement, params):
+        '''
+        Queues a write and flushes if the batch is full.
+
+        statement -- The SQL statement.
+        params -- The parameters for the statement.
+        '''
+        with self._lock:
+            self._pending.append((statement, params))
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        '''
+        Writes all queued changes within one transaction. Consecutive writes
+        of the same kind are executed as one batch.
+        '''
+        with self._lock:
+            if not self._pending:
+                return
+            pending = self._pending
+            self._pending = []
+            with self.connection:
+                batch = []
+                for statement, params in pending:
+                    if batch and batch[0][0] != statement:
+                        self.connection.executemany(batch[0][0],
+                                                    [i[1] for i in batch])
+                        batch = []
+                    batch.append((statement, params))
+                self.connection.executemany(batch[0][0],
+                                            [i[1] for i in batch])
+
+    def close(self):
+        '''
+        Flushes all queued changes and closes the database.
+        '''
+        self.flush()
+        self.connection.close()
+
+    def _query(self, statement, params):
+        '''
+        Flushes the queued writes and runs a query.
+
+        statement -- The SQL statement.
+        params -- The parameters for the statement.
+        '''
+        with self._lock:
+            self.flush()
+            return self.connection.execute(statement, params).fetchall()
+
+    def _query_in(self, statement, keys):
+        '''
+        Runs a query with an IN (...) clause for a list of keys - in slices
+        of IN_SIZE keys.
+
+        statement -- The SQL statement with a %s for the placeholders.
+        keys -- The keys.
+        '''
+        rows = []
+        for i in range(0, len(keys), IN_SIZE):
+            part = keys[i:i + IN_SIZE]
+            rows.extend(self._query(statement % ', '.join('?' * len(part)),
+                                    part))
+        return rows
+
+    def _write_resource(self, key, entity):
+        '''
+        Queues the writes for an entity and its mixins.
+
+        key -- Unique identifier of the entity.
+        entity -- The entity.
+        '''
+        kind = None
+        if entity.kind is not None:
+            kind = get_category_ref(entity.kind)
+        source = target = None
+        if isinstance(entity, Link):
+            source = entity.source.identifier
+            # FUTURE_IMPROVEMENT: string links
+            target = entity.target.identifier
+        actions = json.dumps([get_category_ref(item)
+                              for item in entity.actions])
+        self._queue(INSERT_RESOURCE,
+                    (key, get_owner_key(entity.extras),
+                     sqlite3.Binary(dump_value(entity.extras)),
+                     get_entity_type(entity), kind,
+                     sqlite3.Binary(dump_value(entity.title)),
+                     sqlite3.Binary(dump_value(getattr(entity, 'summary',
+                                                       None))),
+                     sqlite3.Binary(dump_value(entity.attributes)), actions,
+                     source, target))
+        self._queue(DELETE_MIXINS, (key,))
+        for position, mixin in enumerate(entity.mixins or []):
+            self._queue(INSERT_MIXIN, (get_category_ref(mixin), key,
+                                       position))
+
+    #==========================================================================
+    # Reads
+    #==========================================================================
+
+    def _get_by_ref(self, ref, cls):
+        '''
+        Returns the registered category for a reference. If it is not
+        registered (anymore) a bare category is created.
+
+        ref -- The category reference.
+        cls -- The class used for unregistered categories.
+        '''
+        if self._by_ref is None or self._by_ref[0] != self.get_generation():
+            lookup = {}
+            for category in self.backends.keys():
+                lookup[get_category_ref(category)] = category
+            self._by_ref = (self.get_generation(), lookup)
+        try:
+            return self._by_ref[1][ref]
+        except KeyError:
+            return create_category(ref, cls)
+
+    def _build(self, rows):
+        '''
+        Returns the entities for a set of rows. Already loaded entities are
+        taken from the identity map; links, sources and targets are loaded
+        as needed.
+
+        The mixins, the links and the related entities of all rows are
+        queried at once - not row by row.
+
+        rows -- The rows as returned by the resource queries.
+        '''
+        result = []
+        built = []
+        with self._lock:
+            self._restore_categories()
+            mixins = {}
+            for key, ref in self._query_in(SELECT_MIXINS_IN,
+                                           [row[0] for row in rows
+                                            if row[0] not in self._loaded]):
+                mixins.setdefault(key, []).append(ref)
+            for row in rows:
+                key = row[0]
+                entity = self._loaded.get(key)
+                if entity is None:
+                    entity = self._create(row, mixins.get(key, []))
+                    self._loaded[key] = entity
+                    built.append((entity, row))
+                result.append(entity)
+
+            links = {}
+            for source, key in self._query_in(
+                    SELECT_LINKS_IN, [entity.identifier for entity, _ in built
+                                      if isinstance(entity, Resource)]):
+                links.setdefault(source, []).append(key)
+            related = set()
+            for keys in links.values():
+                related.update(keys)
+            for entity, row in built:
+                if isinstance(entity, Link):
+                    related.update([row[8], row[9]])
+            related = self._load_many(related)
+
+            for entity, row in built:
+                if isinstance(entity, Link):
+                    entity.source = related.get(row[8])
+                    # FUTURE_IMPROVEMENT: string links
+                    entity.target = related.get(row[9])
+                if isinstance(entity, Resource):
+                    for key in links.get(entity.identifier, []):
+                        if key in related:
+                            entity.links.append(related[key])
+        return result
+
+    def _create(self, row, mixins):
+        '''
+        Creates an entity (without links, source and target) from a row.
+
+        row -- The row as returned by the resource queries.
+        mixins -- The references of the entity's mixins.
+        '''
+        key, owner, entity_type, kind, title, summary, attributes, actions, \
+            _, _ = row
+        kind = self._get_by_ref(kind, Kind) if kind is not None else None
+        mixins = [self._get_by_ref(item, Mixin) for item in mixins]
+        if entity_type == 'link':
+            entity = Link(key, kind, mixins, None, None,
+                          title=load_value(title))
+        elif entity_type == 'resource':
+            entity = Resource(key, kind, mixins, [],
+                              summary=load_value(summary),
+                              title=load_value(title))
+        else:
+            entity = Entity(key, load_value(title), kind, mixins)
+        entity.attributes = load_value(attributes)
+        entity.actions = [self._get_by_ref(item, Action)
+                          for item in json.loads(actions)]
+        entity.extras = load_value(owner)
+        return entity
+
+    def _load(self, key):
+        '''
+        Returns an entity from the identity map or the database. None if it
+        does not exist.
+
+        key -- Unique identifier of the entity.
+        '''
+        entity = self._loaded.get(key)
+        if entity is None:
+            rows = self._query(SELECT_RESOURCE, (key,))
+            if rows:
+                entity = self._build(rows)[0]
+        return entity
+
+    def _load_many(self, keys):
+        '''
+        Returns a dictionary with the entities for the keys which exist -
+        from the identity map or loaded with one query.
+
+        keys -- Unique identifiers of the entities.
+        '''
+        result = {}
+        missing = []
+        for key in keys:
+            entity = self._loaded.get(key)
+            if entity is None:
+                missing.append(key)
+            else:
+                result[key] = entity
+        if missing:
+            for entity in self._build(self._query_in(SELECT_RESOURCES_IN,
+                                                     missing)):
+                result[entity.identifier] = entity
+        return result
+
+    def _restore_categories(self):
+        '''
+        Restores the user defined mixins on first use.
+        '''
+        if self._restored:
+            return
+        self._restored = True
+        for scheme, term, title, location, owner, related in \
+                self._query(SELECT_CATEGORIES, ()):
+            mixin = Mixin(scheme, term, title=title, location=location)
+            mixin.related = [self._get_by_ref(item, Kind)
+                             for item in json.loads(related)]
+            mixin.extras = load_value(owner)
+            super(SqliteRegistry, self).set_backend(mixin,
+                                                    UserDefinedMixinBackend(),
+                                                    None)
+
+    def _filter(self, entities, extras):
+        '''
+        Removes all entities which are not visible to the owner - the
+        database only compares the string representation of the owners.
+
+        entities -- The entities.
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        owner = self._get_owner(extras)
+        return [item for item in entities if self._is_visible(item, owner)]
+
+    #==========================================================================
+    # Categories
+    #==========================================================================
+
+    def get_backend(self, category, extras):
+        self._restore_categories()
+        return super(SqliteRegistry, self).get_backend(category, extras)
+
+    def set_backend(self, category, backend, extras):
+        self._restore_categories()
+        super(SqliteRegistry, self).set_backend(category, backend, extras)
+        if isinstance(backend, UserDefinedMixinBackend):
+            related = json.dumps([get_category_ref(item)
+                                  for item in category.related])
+            self._queue(INSERT_CATEGORY,
+                        (get_category_ref(category), category.scheme,
+                         category.term, category.title, category.location,
+                         sqlite3.Binary(dump_value(category.extras)),
+                         related))
+
+    def delete_mixin(self, mixin, extras):
+        self._restore_categories()
+        super(SqliteRegistry, self).delete_mixin(mixin, extras)
+        self._queue(DELETE_CATEGORY, (get_category_ref(mixin),))
+
+    def get_category(self, path, extras):
+        self._restore_categories()
+        return super(SqliteRegistry, self).get_category(path, extras)
+
+    def get_categories(self, extras):
+        self._restore_categories()
+        return super(SqliteRegistry, self).get_categories(extras)
+
+    #==========================================================================
+    # Resources
+    #==========================================================================
+
+    def get_resource(self, key, extras):
+        entity = self._load(key)
+        if entity is None or \
+                not self._is_visible(entity, self._get_owner(extras)):
+            raise KeyError(key)
+        return entity
+
+    def has_resource(self, key, extras):
+        try:
+            self.get_resource(key, extras)
+        except KeyError:
+            return False
+        return True
+
+    def add_resource(self, key, resource, extras):
+        if extras is not None:
+            resource.extras = self.get_extras(extras)
+        with self._lock:
+            self._loaded[key] = resource
+            self._versions.pop(key, None)
+            self._touch(key, resource)
+            self._write_resource(key, resource)
+
+    def update_resource(self, key, entity, extras):
+        with self._lock:
+            if self._loaded.get(key) is entity:
+                self._touch(key, entity)
+                self._write_resource(key, entity)
+
+    def delete_resource(self, key, extras):
+        with self._lock:
+            entity = self._load(key)
+            if entity is None:
+                raise KeyError(key)
+            self._loaded.pop(key, None)
+            self._versions.pop(key, None)
+            self._touch_source(entity)
+            self._queue(DELETE_RESOURCE, (key,))
+            self._queue(DELETE_MIXINS, (key,))
+
+    def get_version(self, key, extras):
+        # versions are kept in memory - resources loaded from the database
+        # get one on first use.
+        with self._lock:
+            if key not in self._versions:
+                entity = self._load(key)
+                if entity is None:
+                    return None
+                self._touch(key, entity)
+            return super(SqliteRegistry, self).get_version(key, extras)
+
+    def get_resource_keys(self, extras):
+        owner = self._get_owner(extras)
+        result = []
+        for key, item_owner in self._query(SELECT_KEYS,
+                                           (get_owner_key(owner),)):
+            item_owner = load_value(item_owner)
+            if item_owner is None or item_owner == owner:
+                result.append(key)
+        return result
+
+    def get_resources(self, extras):
+        owner = self._get_owner(extras)
+        rows = self._query(SELECT_RESOURCES, (get_owner_key(owner),))
+        return self._filter(self._build(rows), extras)
+
+    def get_resources_by_category(self, category, extras):
+        owner_key = get_owner_key(self._get_owner(extras))
+        if repr(category) == 'kind':
+            rows = self._query(SELECT_BY_KIND,
+                               (get_category_ref(category), owner_key))
+        else:
+            rows = self._query(SELECT_BY_MIXIN,
+                               (owner_key, get_category_ref(category)))
+        return self._filter(self._build(rows), extras)
+
+    def get_resources_under_path(self, path, extras):
+        if path == '':
+            return self.get_resources(extras)
+        owner_key = get_owner_key(self._get_owner(extras))
+        upper = path[:-1] + chr(ord(path[-1]) + 1)
+        rows = self._query(SELECT_BY_PREFIX, (path, upper, owner_key))
+        return self._filter(self._build(rows), extras)
+
+    def has_resources_under_path(self, path, extras):
+        if path == '':
+            return len(self.get_resource_keys(extras)) > 0
+        owner = self._get_owner(extras)
+        upper = path[:-1] + chr(ord(path[-1]) + 1)
+        for item in self._query(SELECT_OWNERS_BY_PREFIX,
+                                (path, upper, get_owner_key(owner))):
+            item_owner = load_value(item[0])
+            if item_owner is None or item_owner == owner:
+                return True
+        return False
+
+    def get_resources_after(self, category, path, position, limit, extras):
+        # the identifier is the position - the primary key lets the database
+        # seek to it.
+        owner_key = get_owner_key(self._get_owner(extras))
+        if category is None and path == '':
+            statement, params = SELECT_ALL_AFTER, (owner_key,)
+        elif category is None:
+            upper = path[:-1] + chr(ord(path[-1]) + 1)
+            statement, params = SELECT_BY_PREFIX_AFTER, (path, upper,
+                                                         owner_key)
+        elif repr(category) == 'kind':
+            statement, params = SELECT_BY_KIND_AFTER, \
+                (get_category_ref(category), owner_key)
+        else:
+            statement, params = SELECT_BY_MIXIN_AFTER, \
+                (owner_key, get_category_ref(category))
+        count = -1 if limit is None else limit
+        position = '' if position is None else position
+        result = []
+        while count:
+            rows = self._query(statement, params + (position, count))
+            for entity in self._filter(self._build(rows), extras):
+                result.append((entity.identifier, entity))
+            if len(rows) < count or count < 0 or len(result) >= limit:
+                break
+            # owners sharing a string representation were filtered out.
+            position = rows[-1][0]
+            count = limit - len(result)
+        return result
+
+    def add_to_category(self, category, entity, extras):
+        with self._lock:
+            key = entity.identifier
+            if self._loaded.get(key) is entity:
+                self._queue(INSERT_MIXIN, (get_category_ref(category), key,
+                                           len(entity.mixins)))
+                self._touch(key, entity)
+
+    def remove_from_category(self, category, entity, extras):
+        with self._lock:
+            key = entity.identifier
+            if self._loaded.get(key) is entity:
+                self._queue(DELETE_MIXIN, (get_category_ref(category), key))
+                self._touch(key, entity)
+
+#==============================================================================
+# Journal & snapshot
+#==============================================================================
+
+# operations in the journal.
+OP_ADD = 'add'
+OP_DELETE = 'delete'
+OP_ADD_MIXIN = 'add_mixin'
+OP_REMOVE_MIXIN = 'remove_mixin'
+OP_SET_CATEGORY = 'set_category'
+OP_DELETE_CATEGORY = 'delete_category'
+
+# each frame starts with the length and the checksum of the payload.
+FRAME = struct.Struct('>II')
+
+SNAPSHOT_FRAME_SIZE = 10000
+
+
+def get_entity_record(key, entity):
+    '''
+    Returns the record which describes an entity (links, sources and targets
+    are stored by their identifier).
+
+    key -- Unique identifier of the entity.
+    entity -- The entity.
+    '''
+    kind = None
+    if entity.kind is not None:
+        kind = get_category_ref(entity.kind)
+    source = target = None
+    if isinstance(entity, Link):
+        source = entity.source.identifier
+        # FUTURE_IMPROVEMENT: string links
+        target = entity.target.identifier
+    return [key, get_entity_type(entity), kind,
+            [get_category_ref(item) for item in entity.mixins or []],
+            entity.title, getattr(entity, 'summary', None),
+            dict(entity.attributes),
+            [get_category_ref(item) for item in entity.actions],
+            entity.extras, source, target]
+
+
+def get_category_record(category):
+    '''
+    Returns the record which describes a user defined mixin.
+
+    category -- The mixin.
+    '''
+    return [get_category_ref(category), category.scheme, category.term,
+            category.title, category.location, category.extras,
+            [get_category_ref(item) for item in category.related]]
+
+
+def write_frame(target, operations):
+    '''
+    Writes a list of operations as one frame to a file.
+
+    target -- The file.
+    operations -- The operations.
+    '''
+    payload = dump_value(operations)
+    target.write(FRAME.pack(len(payload), zlib.crc32(payload) & 0xffffffff))
+    target.write(payload)
+
+
+def read_frames(path):
+    '''
+    Memory maps a file and yields the operations of each frame together with
+    the offset after the frame. Stops at the first incomplete or corrupt
+    frame (e.g. the tail of a write which was interrupted by a crash).
+
+    path -- Path to the file.
+    '''
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as source:
+        data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offset = 0
+            while offset + FRAME.size <= len(data):
+                length, checksum = FRAME.unpack_from(data, offset)
+                start = offset + FRAME.size
+                payload = data[start:start + length]
+                if len(payload) < length or \
+                        zlib.crc32(payload) & 0xffffffff != checksum:
+                    break
+                offset = start + length
+                yield load_value(payload), offset
+        finally:
+            data.close()
+
+
+def replay(operations, entities, categories):
+    '''
+    Applies journaled operations to the records of entities and categories.
+    Operations are idempotent so replaying a journal on top of a snapshot
+    which already contains it is harmless.
+
+    operations -- The operations.
+    entities -- Dictionary of identifiers and entity records.
+    categories -- Dictionary of references and category records.
+    '''
+    for operation in operations:
+        action = operation[0]
+        if action == OP_ADD:
+            entities[operation[1][0]] = operation[1]
+        elif action == OP_DELETE:
+            entities.pop(operation[1], None)
+        elif action in (OP_ADD_MIXIN, OP_REMOVE_MIXIN):
+            record = entities.get(operation[1])
+            if record is None:
+                continue
+            if action == OP_ADD_MIXIN and operation[2] not in record[3]:
+                record[3].append(operation[2])
+            elif action == OP_REMOVE_MIXIN and operation[2] in record[3]:
+                record[3].remove(operation[2])
+        elif action == OP_SET_CATEGORY:
+            categories[operation[1][0]] = operation[1]
+        elif action == OP_DELETE_CATEGORY:
+            categories.pop(operation[1], None)
+
+
+class JournalRegistry(NonePersistentRegistry):
+    '''
+    Registry which keeps everything in memory and appends every change to a
+    journal - the cost per write is appending a record to a buffer.
+
+    The buffer is written and synced to disk as one frame (group commit) as
+    soon as group_size changes are pending, group_interval seconds after the
+    first pending change or when flush() is called. The interval is kept by
+    one daemon thread - so call close() before exiting, changes which are
+    not committed yet are lost on exit or a crash.
+
+    Once compact_after changes are journaled the state is written to a
+    snapshot and the journal is truncated. On start the snapshot is memory
+    mapped and the journal is replayed on top of it - the backends are not
+    involved. This happens on first use, so make sure all backends are
+    registered before the first request comes in.
+    '''
+
+    def __init__(self, path, group_size=1000, group_interval=0.05,
+                 compact_after=100000):
+        '''
+        Constructor.
+
+        path -- Directory for the snapshot and the journal.
+        group_size -- Number of changes which are committed together.
+        group_interval -- Max. seconds a change waits to be committed.
+        compact_after -- Number of journaled changes which trigger a new
+                         snapshot (None to only compact on demand).
+        '''
+        super(JournalRegistry, self).__init__()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.compact_after = compact_after
+        self.snapshot_path = os.path.join(path, 'snapshot')
+        self.journal_path = os.path.join(path, 'journal')
+
+        self._lock = threading.RLock()
+        self._condition = threading.Condition(self._lock)
+        self._journal = None
+        self._pending = []
+        self._since = None
+        self._flusher = None
+        self._journaled = 0
+        self._restored = False
+
+    #==========================================================================
+    # Journal
+    #==========================================================================
+
+    def _append(self, operation):
+        '''
+        Queues an operation for the next group commit.
+
+        operation -- The operation.
+        '''
+        with self._lock:
+            self._pending.append(operation)
+            if len(self._pending) >= self.group_size:
+                self.flush()
+            elif len(self._pending) == 1 and self.group_interval:
+                self._since = time.time()
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._run_flusher)
+                    self._flusher.daemon = True
+                    self._flusher.start()
+                self._condition.notify()
+
+    def _run_flusher(self):
+        '''
+        Commits the pending changes group_interval seconds after the first
+        one - runs until the registry is closed.
+        '''
+        with self._lock:
+            while self._flusher is threading.current_thread():
+                if not self._pending or self._journal is None:
+                    self._condition.wait()
+                    continue
+                delay = self._since + self.group_interval - time.time()
+                if delay > 0:
+                    self._condition.wait(delay)
+                else:
+                    self.flush()
+
+    def flush(self):
+        '''
+        Writes all pending changes as one frame and syncs the journal.
+        '''
+        with self._lock:
+            if not self._pending or self._journal is None:
+                return
+            pending = self._pending
+            self._pending = []
+            write_frame(self._journal, pending)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journaled += len(pending)
+            if self.compact_after is not None and \
+                    self._journaled >= self.compact_after:
+                self.compact()
+
+    def compact(self):
+        '''
+        Writes the current state to a new snapshot and truncates the
+        journal.
+        '''
+        with self._lock:
+            self._restore()
+            self.flush()
+            operations = [(OP_SET_CATEGORY, get_category_record(category))
+                          for category, backend in self.backends.items()
+                          if isinstance(backend, UserDefinedMixinBackend)]
+            operations.extend((OP_ADD, get_entity_record(key, entity))
+                              for key, entity in self.resources.items())
+
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'wb') as target:
+                for i in range(0, len(operations), SNAPSHOT_FRAME_SIZE):
+                    write_frame(target,
+                                operations[i:i + SNAPSHOT_FRAME_SIZE])
+                target.flush()
+                os.fsync(target.fileno())
+            os.rename(tmp_path, self.snapshot_path)
+
+            # a crash before the truncate only means replaying again.
+            self._journal.seek(0)
+            self._journal.truncate()
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journaled = 0
+
+    def close(self):
+        '''
+        Commits all pending changes, stops the thread which commits them in
+        the background and closes the journal.
+        '''
+        with self._lock:
+            flusher, self._flusher = self._flusher, None
+            self._condition.notify_all()
+            self.flush()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+        if flusher is not None and flusher is not threading.current_thread():
+            flusher.join()
+
+    #==========================================================================
+    # Recovery
+    #==========================================================================
+
+    def _restore(self):
+        '''
+        Restores the state from the snapshot and the journal on first use.
+        '''
+        if self._restored:
+            return
+        with self._lock:
+            if self._restored:
+                return
+            self._restored = True
+
+            entities = {}
+            categories = {}
+            for operations, _ in read_frames(self.snapshot_path):
+                replay(operations, entities, categories)
+            valid = 0
+            for operations, valid in read_frames(self.journal_path):
+                replay(operations, entities, categories)
+                self._journaled += len(operations)
+
+            lookup = {}
+            for category in self.backends.keys():
+                lookup[get_category_ref(category)] = category
+            for record in categories.values():
+                mixin = self._create_mixin(record, lookup)
+                lookup[record[0]] = mixin
+                super(JournalRegistry, self).set_backend(
+                    mixin, UserDefinedMixinBackend(), None)
+            self.resources = self._create_entities(entities, lookup)
+
+            # drop the tail of an interrupted write.
+            self._journal = open(self.journal_path, 'ab')
+            self._journal.truncate(valid)
+
+    def _create_mixin(self, record, lookup):
+        '''
+        Creates a user defined mixin from a record.
+
+        record -- The category record.
+        lookup -- Dictionary of references and registered categories.
+        '''
+        _, scheme, term, title, location, owner, related = record
+        mixin = Mixin(scheme, term, title=title, location=location)
+        mixin.related = [lookup.get(item) or create_category(item, Kind)
+                         for item in related]
+        mixin.extras = owner
+        return mixin
+
+    def _create_entities(self, records, lookup):
+        '''
+        Creates the entities from their records and wires up the links.
+
+        records -- Dictionary of identifiers and entity records.
+        lookup -- Dictionary of references and registered categories.
+        '''
+        def get_category(ref, cls):
+            '''
+            Returns the registered category or a bare one.
+            '''
+            if ref not in lookup:
+                lookup[ref] = create_category(ref, cls)
+            return lookup[ref]
+
+        entities = {}
+        for key, entity_type, kind, mixins, title, summary, attributes, \
+                actions, owner, _, _ in records.values():
+            kind = get_category(kind, Kind) if kind is not None else None
+            mixins = [get_category(item, Mixin) for item in mixins]
+            if entity_type == 'link':
+                entity = Link(key, kind, mixins, None, None, title=title)
+            elif entity_type == 'resource':
+                entity = Resource(key, kind, mixins, [], summary=summary,
+                                  title=title)
+            else:
+                entity = Entity(key, title, kind, mixins)
+            entity.attributes = attributes
+            entity.actions = [get_category(item, Action) for item in actions]
+            entity.extras = owner
+            entities[key] = entity
+
+        for record in records.values():
+            if record[1] == 'link':
+                link = entities[record[0]]
+                link.source = entities.get(record[9])
+                # FUTURE_IMPROVEMENT: string links
+                link.target = entities.get(record[10])
+                if link.source is not None:
+                    link.source.links.append(link)
+        return entities
+
+    #==========================================================================
+    # Categories
+    #==========================================================================
+
+    def get_backend(self, category, extras):
+        self._restore()
+        return super(JournalRegistry, self).get_backend(category, extras)
+
+    def get_all_backends(self, entity, extras):
+        self._restore()
+        return super(JournalRegistry, self).get_all_backends(entity, extras)
+
+    def set_backend(self, category, backend, extras):
+        # backends registered on start are not restored.
+        if not isinstance(backend, UserDefinedMixinBackend):
+            super(JournalRegistry, self).set_backend(category, backend,
+                                                     extras)
+            return
+        with self._lock:
+            self._restore()
+            super(JournalRegistry, self).set_backend(category, backend,
+                                                     extras)
+            self._append((OP_SET_CATEGORY, get_category_record(category)))
+
+    def delete_mixin(self, mixin, extras):
+        with self._lock:
+            self._restore()
+            super(JournalRegistry, self).delete_mixin(mixin, extras)
+            self._append((OP_DELETE_CATEGORY, get_category_ref(mixin)))
+
+    def get_category(self, path, extras):
+        self._restore()
+        return super(JournalRegistry, self).get_category(path, extras)
+
+    def get_categories(self, extras):
+        self._restore()
+        return super(JournalRegistry, self).get_categories(extras)
+
+    #==========================================================================
+    # Resources
+    #==========================================================================
+
+    def get_resource(self, key, extras):
+        self._restore()
+        return super(JournalRegistry, self).get_resource(key, extras)
+
+    def has_resource(self, key, extras):
+        self._restore()
+        return super(JournalRegistry, self).has_resource(key, extras)
+
+    def add_resource(self, key, resource, extras):
+        with self._lock:
+            self._restore()
+            super(JournalRegistry, self).add_resource(key, resource, extras)
+            self._append((OP_ADD, get_entity_record(key, resource)))
+
+    def update_resource(self, key, entity, extras):
+        with self._lock:
+            self._restore()
+            super(JournalRegistry, self).update_resource(key, entity, extras)
+            if self.resources.get(key) is entity:
+                self._append((OP_ADD, get_entity_record(key, entity)))
+
+    def delete_resource(self, key, extras):
+        with self._lock:
+            self._restore()
+            super(JournalRegistry, self).delete_resource(key, extras)
+            self._append((OP_DELETE, key))
+
+    def get_version(self, key, extras):
+        self._restore()
+        return super(JournalRegistry, self).get_version(key, extras)
+
+    def get_resource_keys(self, extras):
+        self._restore()
+        return super(JournalRegistry, self).get_resource_keys(extras)
+
+    def get_resources(self, extras):
+        self._restore()
+        return super(JournalRegistry, self).get_resources(extras)
+
+    def get_resources_by_category(self, category, extras):
+        self._restore()
+        return super(JournalRegistry,
+                     self).get_resources_by_category(category, extras)
+
+    def get_resources_under_path(self, path, extras):
+        self._restore()
+        return super(JournalRegistry,
+                     self).get_resources_under_path(path, extras)
+
+    def has_resources_under_path(self, path, extras):
+        self._restore()
+        return super(JournalRegistry,
+                     self).has_resources_under_path(path, extras)
+
+    def get_resources_after(self, category, path, position, limit, extras):
+        self._restore()
+        return super(JournalRegistry,
+                     self).get_resources_after(category, path, position,
+                                               limit, extras)
+
+    def add_to_category(self, category, entity, extras):
+        with self._lock:
+            self._restore()
+            super(JournalRegistry, self).add_to_category(category, entity,
+                                                         extras)
+            if self.resources.get(entity.identifier) is entity:
+                self._append((OP_ADD_MIXIN, entity.identifier,
+                              get_category_ref(category)))
+
+    def remove_from_category(self, category, entity, extras):
+        with self._lock:
+            self._restore()
+            super(JournalRegistry, self).remove_from_category(category,
+                                                              entity, extras)
+            if self.resources.get(entity.identifier) is entity:
+                self._append((OP_REMOVE_MIXIN, entity.identifier,
+                              get_category_ref(category)))
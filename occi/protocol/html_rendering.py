@@ -30,7 +30,7 @@ Created on Jul 15, 2011
 from occi.core_model import Category
 from occi.core_model import Resource, Link
 from occi.handlers import QUERY_STRING
-from occi.protocol.rendering import Rendering
+from occi.protocol.rendering import Rendering, chunk
 
 
 class HTMLRendering(Rendering):
@@ -214,7 +214,22 @@ class HTMLRendering(Rendering):
             tmp += '\t\t\t<h2>Title</h2><p>' + str(entity.title) + '</p>\n'
         return tmp
 
-    def from_entities(self, entities, key):
+    def from_entities(self, entities, key, next_page=None):
+        headers, body = self.stream_entities(entities, key, next_page)
+        return headers, ''.join(body)
+
+    def stream_entities(self, entities, key, next_page=None):
+        return {'Content-Type': self.mime_type}, \
+            chunk(self._iter_entities(entities, key, next_page))
+
+    def _iter_entities(self, entities, key, next_page=None):
+        '''
+        Yields the HTML listing of the entities piece by piece.
+
+        entities -- The entities.
+        key -- The path of the listing.
+        next_page -- URL of the next page if the listing is paged.
+        '''
         tmp = '<html>\n\t<head>\n'
         tmp += '\t\t<title>Resource listing: ' + key + '</title>\n'
         tmp += '\t\t<style type="text/css"><!-- ' + self.css + ' --></style>\n'
@@ -235,14 +250,16 @@ class HTMLRendering(Rendering):
 
         # body
         tmp += '\t\t<div id="entity"><ul>\n'
+        yield tmp
         if not len(entities):
-            tmp += '\t\t\t<li>No resources found</li>\n'
+            yield '\t\t\t<li>No resources found</li>\n'
         for item in entities:
-            tmp += '\t\t\t<li><a href="' + item.identifier + '">'
-            tmp += item.identifier + '</a></li>\n'
-        tmp += '\t\t</ul></div>\n'
-        tmp += '\t</body>\n</html>'
-        return {'Content-Type': self.mime_type}, tmp
+            yield '\t\t\t<li><a href="' + item.identifier + '">' + \
+                item.identifier + '</a></li>\n'
+        yield '\t\t</ul>'
+        if next_page is not None:
+            yield '<a href="' + next_page + '" rel="next">Next page</a>'
+        yield '</div>\n\t</body>\n</html>'
 
     def from_categories(self, categories):
         tmp = '<html>\n\t<head>\n'
@@ -32,8 +32,8 @@ Created on 01.02.2012
 # pylint: disable=W0223
 
 from occi.core_model import Resource
-from occi.handlers import CONTENT_TYPE
-from occi.protocol.rendering import Rendering
+from occi.handlers import CONTENT_TYPE, LINK
+from occi.protocol.rendering import Rendering, chunk, next_link
 import json
 
 
@@ -110,6 +110,22 @@ def _from_entity(entity):
     return data
 
 
+def _iter_entities(entities):
+    '''
+    Yields a JSON list of the entities piece by piece - the same text
+    json.dumps renders for the whole list.
+
+    entities -- The entities.
+    '''
+    encoder = json.JSONEncoder(sort_keys=True, indent=2)
+    separator = '['
+    for item in entities:
+        yield separator + '\n  ' + \
+            encoder.encode(_from_entity(item)).replace('\n', '\n  ')
+        separator = encoder.item_separator
+    yield '[]' if separator == '[' else '\n]'
+
+
 class JsonRendering(Rendering):
     '''
     This is a rendering which will use the HTTP header to place the information
@@ -124,13 +140,16 @@ class JsonRendering(Rendering):
         body = json.dumps(data, sort_keys=True, indent=2)
         return {CONTENT_TYPE: self.mime_type}, body
 
-    def from_entities(self, entities, key):
-        data = []
-        for item in entities:
-            data.append(_from_entity(item))
+    def from_entities(self, entities, key, next_page=None):
+        headers, body = self.stream_entities(entities, key, next_page)
+        return headers, ''.join(body)
 
-        body = json.dumps(data, sort_keys=True, indent=2)
-        return {CONTENT_TYPE: self.mime_type}, body
+    def stream_entities(self, entities, key, next_page=None):
+        # the body stays a plain list - the next page goes into the header.
+        headers = {CONTENT_TYPE: self.mime_type}
+        if next_page is not None:
+            headers[LINK] = next_link(next_page)
+        return headers, chunk(_iter_entities(entities))
 
     def from_categories(self, categories):
         data = []
@@ -29,6 +29,10 @@ Created on Jun 28, 2011
 # pylint: disable=R0914,R0912
 
 from occi.core_model import Category, Link, Mixin, Kind
+import weakref
+
+# per registry: generation of the categories and the resolved categories.
+_CATEGORY_CACHE = weakref.WeakKeyDictionary()
 
 #==============================================================================
 # Following are text/occi and text/plain related parsing functions.
@@ -49,7 +53,6 @@ def get_category(category_string, registry, extras, is_mixin=False):
     extras -- The passed on extras argument
     is_mixin -- Mixin will be created and no matching will be done.
     '''
-    categories = registry.get_categories(extras)
     # find term
     term = category_string[:category_string.find(';')].strip()
 
@@ -71,38 +74,75 @@ def get_category(category_string, registry, extras, is_mixin=False):
         except AttributeError:
             return mixin
         else:
-            for item in categories:
+            for item in registry.get_categories(extras):
                 if str(item) == related:
                     mixin.related = [item]
                     return mixin
             raise AttributeError('Related category cannot be found.')
 
-    # return the category from registry...
-    tmp = Category(scheme, term, '', {}, '')
+    # return the category from cache or registry...
+    owner = None
     if extras is not None:
-        tmp.extras = registry.get_extras(extras)
-    for item in categories:
+        owner = registry.get_extras(extras)
+    cache = _get_category_cache(registry)
+    key = (scheme, term, owner)
+    try:
+        if cache is not None and key in cache:
+            return cache[key]
+    except TypeError:
+        # unhashable extras - no caching.
+        cache = None
+
+    tmp = Category(scheme, term, '', {}, '')
+    tmp.extras = owner
+    for item in registry.get_categories(extras):
         if item.extras is None:
             tmp.extras = None
             if tmp == item:
                 del tmp
+                if cache is not None:
+                    cache[key] = item
                 return item
-            tmp.extras = registry.get_extras(extras)
+            tmp.extras = owner
         elif item.extras is not None:
             if tmp == item:
                 del tmp
+                if cache is not None:
+                    cache[key] = item
                 return item
     raise AttributeError('The following category is not registered within'
                          + ' this service (See Query interfaces): '
                          + str(scheme) + str(term))
 
 
-def get_category_str(category, registry):
+def _get_category_cache(registry):
+    '''
+    Returns the cache of resolved categories for a registry. The cache is
+    dropped whenever the generation of the registry's categories changes.
+    Returns None if the registry does not support this.
+
+    registry -- The registry.
+    '''
+    generation = registry.get_generation()
+    if generation is None:
+        return None
+    try:
+        cached_generation, cache = _CATEGORY_CACHE[registry]
+    except KeyError:
+        cached_generation, cache = None, None
+    if cached_generation != generation:
+        cache = {}
+        _CATEGORY_CACHE[registry] = (generation, cache)
+    return cache
+
+
+def get_category_str(category, registry, hostname=None):
     '''
     Create a string rendering for a Category.
 
     category -- A category.
     registry -- registry to retrieve hostname.
+    hostname -- The hostname of the service (default: the registry's).
     '''
 
     tmp = ''
@@ -119,7 +159,9 @@ def get_category_str(category, registry):
     if hasattr(category, 'location') and category.location is not None:
         tmp += '; location="'
         if category.location.find('http') == -1:
-            tmp += registry.get_hostname()
+            if hostname is None:
+                hostname = registry.get_hostname()
+            tmp += hostname
         tmp += category.location + '"'
     if hasattr(category, 'attributes') and len(category.attributes) > 0:
         attr_list = []
@@ -162,7 +204,7 @@ def _get_link_categories(categories, registry, extras):
     return tmp_kind, tmp_mixins
 
 
-def get_link(link_string, source, registry, extras):
+def get_link(link_string, source, registry, extras, hostname=None):
     '''
     Create a Link from a string rendering.
 
@@ -172,7 +214,11 @@ def get_link(link_string, source, registry, extras):
     source -- The source entity.
     registry -- Registry used for this call.
     extras -- Passed on extra object.
+    hostname -- The hostname of the service (default: the registry's).
     '''
+    if hostname is None:
+        hostname = registry.get_hostname()
+
     tmp = link_string.find('<') + 1
     target_id = link_string[tmp:link_string.rfind('>', tmp)].strip()
 
@@ -200,8 +246,8 @@ def get_link(link_string, source, registry, extras):
             attributes[tmp[0].strip()] = tmp[1].rstrip('"').lstrip('"').strip()
 
     try:
-        if not target_id.find(registry.get_hostname()):
-            target_id = target_id.replace(registry.get_hostname(), '')
+        if not target_id.find(hostname):
+            target_id = target_id.replace(hostname, '')
         target = registry.get_resource(target_id, extras)
     except KeyError:
         # FUTURE_IMPROVEMENT: string links
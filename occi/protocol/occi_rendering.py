@@ -25,9 +25,11 @@ Created on Jun 28, 2011
 '''
 
 from occi.core_model import Resource, Link
-from occi.handlers import CATEGORY, ATTRIBUTE, LOCATION, LINK, CONTENT_TYPE
-from occi.protocol.rendering import Rendering
+from occi.handlers import CATEGORY, ATTRIBUTE, LOCATION, LINK, NEXT, \
+    CONTENT_TYPE
+from occi.protocol.rendering import Rendering, chunk
 import occi.protocol.occi_parser as parser
+import itertools
 import shlex
 
 
@@ -45,13 +47,14 @@ class HTTPData(object):
         self.links = []
         self.attributes = []
         self.locations = []
+        self.next_page = None
 
 #==============================================================================
 # text/occi rendering
 #==============================================================================
 
 
-def _to_entity(data, def_kind, registry, extras):
+def _to_entity(data, def_kind, registry, extras, hostname):
     '''
     Extract an entity from the HTTP data object.
 
@@ -59,6 +62,7 @@ def _to_entity(data, def_kind, registry, extras):
     def_kind -- A given kind definition.
     registry -- The registry.
     extras -- Passed on extra object.
+    hostname -- The hostname of the service.
     '''
 
     # disable 'Too many local vars' pylint check (It's a bit ugly but will do)
@@ -97,16 +101,17 @@ def _to_entity(data, def_kind, registry, extras):
         for link_string in data.links:
             entity.links.append(parser.get_link(link_string.strip(),
                                                 entity,
-                                                registry, extras))
+                                                registry, extras,
+                                                hostname))
     elif Link.kind in kind.related:
         try:
             source_attr = attributes['occi.core.source']
             target_attr = attributes['occi.core.target']
 
-            if not source_attr.find(registry.get_hostname()):
-                source_attr = source_attr.replace(registry.get_hostname(), '')
-            if not target_attr.find(registry.get_hostname()):
-                target_attr = target_attr.replace(registry.get_hostname(), '')
+            if not source_attr.find(hostname):
+                source_attr = source_attr.replace(hostname, '')
+            if not target_attr.find(hostname):
+                target_attr = target_attr.replace(hostname, '')
 
             source = registry.get_resource(source_attr, extras)
             # FUTURE_IMPROVEMENT: string links
@@ -123,20 +128,22 @@ def _to_entity(data, def_kind, registry, extras):
     return entity
 
 
-def _from_entity(entity, registry):
+def _from_entity(entity, registry, hostname):
     '''
     Create a HTTP data object from an entity.
 
     entity -- The entity to render.
     registry -- Registry.
+    hostname -- The hostname of the service.
     '''
     data = HTTPData()
 
     # categories
-    cat_str_list = [parser.get_category_str(entity.kind, registry)]
+    cat_str_list = [parser.get_category_str(entity.kind, registry, hostname)]
 
     for category in entity.mixins:
-        cat_str_list.append(parser.get_category_str(category, registry))
+        cat_str_list.append(parser.get_category_str(category, registry,
+                                                    hostname))
 
     data.categories = cat_str_list
 
@@ -174,19 +181,20 @@ def _from_entity(entity, registry):
     return data
 
 
-def _to_entities(data, registry, extras):
+def _to_entities(data, registry, extras, hostname):
     '''
     Extract a set of (in the service existing) entities from a request.
 
     data -- the HTTP data.
     registry -- The registry used for this call.
     extras -- Passed on extra object.
+    hostname -- The hostname of the service.
     '''
     result = []
     for item in data.locations:
         try:
-            if not item.find(registry.get_hostname()):
-                item = item.replace(registry.get_hostname(), '')
+            if not item.find(hostname):
+                item = item.replace(hostname, '')
 
             result.append(registry.get_resource(item.strip(), extras))
         except KeyError:
@@ -196,31 +204,33 @@ def _to_entities(data, registry, extras):
     return result
 
 
-def _from_entities(entity_list, registry):
+def _from_entities(entity_list, hostname):
     '''
     Return a list of entities using the X-OCCI-Location attribute.
 
     entity_list -- list of entities.
-    registry -- The registry used for this call.registry
+    hostname -- The hostname of the service.
     '''
     data = HTTPData()
     for entity in entity_list:
-        data.locations.append(registry.get_hostname() + entity.identifier)
+        data.locations.append(hostname + entity.identifier)
 
     return data
 
 
-def _from_categories(categories, registry):
+def _from_categories(categories, registry, hostname):
     '''
     Create a HTTP data object from a set of categories.
 
     categories -- list of categories.
-    registry -- needed to retrieve hostname info.
+    registry -- The registry used for this call.
+    hostname -- The hostname of the service.
     '''
     data = HTTPData()
 
     for cat in categories:
-        data.categories.append(parser.get_category_str(cat, registry))
+        data.categories.append(parser.get_category_str(cat, registry,
+                                                       hostname))
 
     return data
 
@@ -322,6 +332,8 @@ def _set_data_to_headers(data, mime_type):
         headers[LOCATION] = ', '.join(data.locations)
     if len(data.attributes) > 0:
         headers[ATTRIBUTE] = ', '.join(data.attributes)
+    if data.next_page is not None:
+        headers[NEXT] = data.next_page
     headers[CONTENT_TYPE] = mime_type
 
     return headers, body
@@ -358,26 +370,30 @@ class TextOcciRendering(Rendering):
 
     def to_entity(self, headers, body, def_kind, extras):
         data = self.get_data(headers, body)
-        entity = _to_entity(data, def_kind, self.registry, extras)
+        entity = _to_entity(data, def_kind, self.registry, extras,
+                            self.get_hostname())
         return entity
 
     def from_entity(self, entity):
-        data = _from_entity(entity, self.registry)
+        data = _from_entity(entity, self.registry, self.get_hostname())
         headers, body = self.set_data(data)
         return headers, body
 
     def to_entities(self, headers, body, extras):
         data = self.get_data(headers, body)
-        entities = _to_entities(data, self.registry, extras)
+        entities = _to_entities(data, self.registry, extras,
+                                self.get_hostname())
         return entities
 
-    def from_entities(self, entities, key):
-        data = _from_entities(entities, self.registry)
+    def from_entities(self, entities, key, next_page=None):
+        data = _from_entities(entities, self.get_hostname())
+        data.next_page = next_page
         headers, body = self.set_data(data)
         return headers, body
 
     def from_categories(self, categories):
-        data = _from_categories(categories, self.registry)
+        data = _from_categories(categories, self.registry,
+                                self.get_hostname())
         headers, body = self.set_data(data)
         return headers, body
 
@@ -451,6 +467,9 @@ def _set_data_to_body(data, mime_type):
         for link in data.links:
             body += '\n' + LINK + ': ' + link
 
+    if data.next_page is not None:
+        body += '\n' + NEXT + ': ' + data.next_page
+
     if len(data.attributes) > 0:
         for attr in data.attributes:
             body += '\n' + ATTRIBUTE + ': ' + attr
@@ -462,6 +481,33 @@ def _set_data_to_body(data, mime_type):
     return {CONTENT_TYPE: mime_type}, body
 
 
+def _iter_locations(entities, hostname):
+    '''
+    Yields the locations of the entities as they are rendered in the body.
+
+    entities -- The entities.
+    hostname -- The hostname of the service.
+    '''
+    for entity in entities:
+        yield '\n' + LOCATION + ': ' + hostname + entity.identifier
+
+
+def _iter_uris(entities, key, hostname, next_page=None):
+    '''
+    Yields the lines of an uri-list.
+
+    entities -- The entities.
+    key -- The path of the listing.
+    hostname -- The hostname of the service.
+    next_page -- URL of the next page if the listing is paged.
+    '''
+    yield '# uri:' + str(key)
+    if next_page is not None:
+        yield '\n# next:' + next_page
+    for entity in entities:
+        yield '\n' + hostname + entity.identifier
+
+
 class TextPlainRendering(TextOcciRendering):
     '''
     This is a rendering which will use the HTTP body to place the information
@@ -476,6 +522,14 @@ class TextPlainRendering(TextOcciRendering):
     def get_data(self, headers, body):
         return _extract_data_from_body(body)
 
+    def stream_entities(self, entities, key, next_page=None):
+        # same order as in _set_data_to_body - next page before locations.
+        pieces = _iter_locations(entities, self.get_hostname())
+        if next_page is not None:
+            pieces = itertools.chain(['\n' + NEXT + ': ' + next_page],
+                                     pieces)
+        return {CONTENT_TYPE: self.mime_type}, chunk(pieces)
+
 
 class TextUriListRendering(Rendering):
     '''
@@ -495,11 +549,13 @@ class TextUriListRendering(Rendering):
     def to_entities(self, headers, body, extras):
         raise AttributeError(self.error)
 
-    def from_entities(self, entities, key):
-        body = '# uri:' + str(key)
-        for entity in entities:
-            body += '\n' + self.registry.get_hostname() + entity.identifier
-        return {CONTENT_TYPE: self.mime_type}, body
+    def from_entities(self, entities, key, next_page=None):
+        headers, body = self.stream_entities(entities, key, next_page)
+        return headers, ''.join(body)
+
+    def stream_entities(self, entities, key, next_page=None):
+        return {CONTENT_TYPE: self.mime_type}, \
+            chunk(_iter_uris(entities, key, self.get_hostname(), next_page))
 
     def from_categories(self, categories):
         raise AttributeError(self.error)
@@ -24,12 +24,55 @@ Created on Feb 2, 2012
 @author: tmetsch
 '''
 
+import copy
+
+# size (in characters) of the chunks of streamed bodies.
+CHUNK_SIZE = 64 * 1024
+
+
+def chunk(pieces, size=CHUNK_SIZE):
+    '''
+    Joins small strings into chunks of about the given size - so streamed
+    bodies are not written piece by piece.
+
+    pieces -- Iterable of strings.
+    size -- Minimal size of a chunk (but the last one).
+    '''
+    items = []
+    length = 0
+    for piece in pieces:
+        items.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(items)
+            items = []
+            length = 0
+    if items:
+        yield ''.join(items)
+
+
+def next_link(next_page):
+    '''
+    Returns a link (as used in the Link header) to the next page of a paged
+    listing.
+
+    next_page -- URL of the next page.
+    '''
+    return '<' + next_page + '>; rel="next"'
+
 
 class Rendering(object):
     '''
     All renderings should derive from this class.
     '''
 
+    # if from_entity renders the state of the links of a resource - if not
+    # the links are not retrieved before rendering.
+    fresh_links = True
+
+    # the request this rendering is bound to (see bind).
+    context = None
+
     def __init__(self, registry):
         '''
         Constructor.
@@ -38,6 +81,27 @@ class Rendering(object):
         '''
         self.registry = registry
 
+    def bind(self, context):
+        '''
+        Returns a copy of this rendering bound to the context of a request
+        (see handlers.RequestContext) - the registry is shared, the
+        hostname comes from the request.
+
+        context -- The request context.
+        '''
+        rendering = copy.copy(self)
+        rendering.context = context
+        return rendering
+
+    def get_hostname(self):
+        '''
+        Returns the hostname of the service as seen by the client - the one
+        of the registry if the rendering is not bound to a request.
+        '''
+        if self.context is None:
+            return self.registry.get_hostname()
+        return self.context.hostname
+
     def to_entity(self, headers, body, def_kind, extras):
         '''
         Given the HTTP headers and the body this method will convert the HTTP
@@ -74,15 +138,35 @@ class Rendering(object):
         '''
         raise NotImplementedError()
 
-    def from_entities(self, entities, key):
+    def from_entities(self, entities, key, next_page=None):
         '''
         Given an set of entities it will return a HTTP body an header.
 
         entities -- The entities which will be rendered.
         key -- Needed for uri-list (see RFC) and html rendering.
+        next_page -- URL of the next page if the listing is paged.
         '''
         raise NotImplementedError()
 
+    def stream_entities(self, entities, key, next_page=None):
+        '''
+        Given an set of entities it will return a HTTP header and an iterable
+        of chunks of the HTTP body - so large listings can be sent without
+        holding the whole body in memory.
+
+        By default the body from from_entities is returned as it is - so it
+        is sent in one piece with a Content-Length.
+
+        entities -- The entities which will be rendered.
+        key -- Needed for uri-list (see RFC) and html rendering.
+        next_page -- URL of the next page if the listing is paged.
+        '''
+        if next_page is None:
+            headers, body = self.from_entities(entities, key)
+        else:
+            headers, body = self.from_entities(entities, key, next_page)
+        return headers, body
+
     def from_categories(self, categories):
         '''
         Given an set of categories it will return a HTTP body an header.
@@ -17,8 +17,8 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 #
 '''
-Module which holds a abstract registry definition class and one simple
-implementation.
+Module which holds a abstract registry definition class and two simple
+implementations - one for single threaded and one for threaded servers.
 
 Created on Aug 22, 2011
 
@@ -33,6 +33,68 @@ Created on Aug 22, 2011
 from occi.backend import KindBackend, ActionBackend, MixinBackend
 from occi.exceptions import HTTPError
 from occi.protocol.occi_rendering import Rendering
+from occi.workflow import get_fingerprint
+import bisect
+import collections
+import contextlib
+import heapq
+import itertools
+import threading
+import uuid
+
+# max. number of distinct Accept/Content-Type headers kept parsed.
+MEDIA_RANGE_CACHE_SIZE = 256
+
+_MEDIA_RANGES = collections.OrderedDict()
+_MEDIA_RANGES_LOCK = threading.Lock()
+
+# part of all versions - so versions handed out before a restart never match.
+EPOCH = uuid.uuid4().hex[:8]
+
+
+def get_media_ranges(header):
+    '''
+    Returns the mime types of an Accept or Content-Type header ordered by
+    their quality (highest first, ties keep the order of the header). Types
+    with a quality of 0 are not acceptable and left out.
+
+    Parsed headers are kept in a LRU cache - clients tend to send the same
+    header over and over again.
+
+    header -- The raw header.
+    '''
+    with _MEDIA_RANGES_LOCK:
+        try:
+            result = _MEDIA_RANGES.pop(header)
+        except KeyError:
+            result = _parse_media_ranges(header)
+            if len(_MEDIA_RANGES) >= MEDIA_RANGE_CACHE_SIZE:
+                _MEDIA_RANGES.popitem(last=False)
+        _MEDIA_RANGES[header] = result
+        return result
+
+
+def _parse_media_ranges(header):
+    '''
+    Parses an Accept or Content-Type header.
+
+    header -- The raw header.
+    '''
+    ranges = []
+    for i, item in enumerate(header.split(',')):
+        params = item.split(';')
+        mime_type = params[0].strip()
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if mime_type and quality > 0:
+            ranges.append((-quality, i, mime_type))
+    return tuple(mime_type for _, _, mime_type in sorted(ranges))
 
 
 class Registry(object):
@@ -44,6 +106,16 @@ class Registry(object):
 
     default_mime_type = 'text/plain'
 
+    executor = None
+
+    collection_action_limit = 10
+
+    freshness = None
+
+    lazy_links = None
+
+    workflow = None
+
     def get_hostname(self):
         '''
         Returns the hostname of the service.
@@ -56,6 +128,38 @@ class Registry(object):
         '''
         self.hostname = hostname
 
+    def get_generation(self):
+        '''
+        Returns a counter which changes whenever categories are added or
+        removed. Used to invalidate caches of resolved categories - None
+        disables those caches.
+        '''
+        return None
+
+    def get_version(self, key, extras):
+        '''
+        Returns a string which changes whenever the resource or one of its
+        links changes - also when it is deleted and added again. Used as
+        ETag; None (the default) disables conditional GETs of resources.
+
+        key -- The unique identifier.
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        return None
+
+    def get_categories_version(self, extras):
+        '''
+        Returns a string which changes whenever categories are added or
+        removed - based on get_generation. Used as ETag; None disables
+        conditional GETs of the query interface.
+
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        generation = self.get_generation()
+        if generation is None:
+            return None
+        return EPOCH + '-' + str(generation)
+
     def get_default_type(self):
         '''
         Returns the default mime type.
@@ -162,6 +266,18 @@ class Registry(object):
         raise NotImplementedError('Registry implementation seems to be'
                                   ' incomplete.')
 
+    def update_resource(self, key, entity, extras):
+        '''
+        Notifies the registry that an entity was changed by the backends.
+        Entities are updated in place so there is nothing to do for
+        registries which hold them in memory.
+
+        key -- the unique identifier.
+        entity -- the OCCI representation.
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        pass
+
     def delete_resource(self, key, extras):
         '''
         Delete a resource.
@@ -172,6 +288,30 @@ class Registry(object):
         raise NotImplementedError('Registry implementation seems to be'
                                   ' incomplete.')
 
+    def delete_resources(self, keys, extras):
+        '''
+        Delete a set of resources - e.g. when a collection is deleted.
+
+        Calls delete_resource for each key - overwrite this if the registry
+        can remove several resources at once.
+
+        keys -- Unique identifiers of the resources.
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        for key in keys:
+            self.delete_resource(key, extras)
+
+    def has_resource(self, key, extras):
+        '''
+        Return True if a resource with the given key exists and is visible.
+
+        Falls back to a lookup in the list of all keys.
+
+        key -- Unique identifier of the resource.
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        return key in self.get_resource_keys(extras)
+
     def get_resource_keys(self, extras):
         '''
         Return all keys of all resources.
@@ -190,6 +330,161 @@ class Registry(object):
         raise NotImplementedError('Registry implementation seems to be'
                                   ' incomplete.')
 
+    def get_resources_by_category(self, category, extras):
+        '''
+        Return all resources which have the given category as kind or mixin.
+
+        Falls back to a scan over all resources; registries should overwrite
+        this together with add_to_category and remove_from_category.
+
+        category -- The kind or mixin.
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        result = []
+        for item in self.get_resources(extras):
+            if category == item.kind or category in item.mixins:
+                result.append(item)
+        return result
+
+    def get_resources_by_attribute(self, name, value, extras):
+        '''
+        Return all resources which have the given value for an attribute -
+        or None if the registry does not index this attribute (the default)
+        so callers have to scan the resources themselves.
+
+        name -- The name of the attribute.
+        value -- The value of the attribute.
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        return None
+
+    def get_resources_under_path(self, path, extras):
+        '''
+        Return all resources whose identifier starts with the given path.
+
+        Falls back to a scan over all resources.
+
+        path -- The path under which to look.
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        result = []
+        for item in self.get_resources(extras):
+            if not item.identifier.find(path):
+                result.append(item)
+        return result
+
+    def has_resources_under_path(self, path, extras):
+        '''
+        Return True if any resource lives under the given path.
+
+        path -- The path under which to look.
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        return len(self.get_resources_under_path(path, extras)) > 0
+
+    def get_resources_after(self, category, path, position, limit, extras):
+        '''
+        Return up to limit (position, resource) tuples of a listing - the
+        resources of the category or, if category is None, the resources
+        under the path - which follow the given position. Positions are
+        strings which stay valid while resources are added and deleted (the
+        workflow hands them out as cursors). Fewer than limit resources are
+        only returned at the end of the listing.
+
+        Falls back to sorting the listing by identifier (which then is the
+        position); registries should overwrite this to seek to the position
+        without looking at the resources before it.
+
+        category -- The kind or mixin (or None).
+        path -- The path under which to look.
+        position -- The position to continue after (None for the start).
+        limit -- Maximum number of resources returned (None for all).
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        if category is None:
+            items = self.get_resources_under_path(path, extras)
+        else:
+            items = self.get_resources_by_category(category, extras)
+        result = sorted((item.identifier, item) for item in items
+                        if position is None or item.identifier > position)
+        return result[:limit]
+
+    def add_to_category(self, category, entity, extras):
+        '''
+        Notifies the registry that a mixin was assigned to a resource.
+
+        category -- The mixin which was assigned.
+        entity -- The resource.
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        pass
+
+    def remove_from_category(self, category, entity, extras):
+        '''
+        Notifies the registry that a mixin was removed from a resource.
+
+        category -- The mixin which was removed.
+        entity -- The resource.
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        pass
+
+    def get_executor(self):
+        '''
+        Returns the executor the workflow uses to call independent backends
+        concurrently - any object with a submit(func, *args) routine which
+        returns a future (e.g. a concurrent.futures.ThreadPoolExecutor).
+        None (the default) calls the backends one after another.
+        '''
+        return self.executor
+
+    def get_collection_action_limit(self):
+        '''
+        Returns how many actions of one collection action request run at
+        the same time when an executor is set.
+        '''
+        return self.collection_action_limit
+
+    def get_freshness(self, kind):
+        '''
+        Returns for how many seconds a retrieved entity of the given kind may
+        be served without calling the backends again - None (the default)
+        always calls them. Set e.g. freshness = {COMPUTE: 5}.
+
+        kind -- The kind of the entity.
+        '''
+        if self.freshness is None:
+            return None
+        return self.freshness.get(kind)
+
+    def get_lazy_links(self, kind):
+        '''
+        Returns True if the links of resources of the given kind should not
+        be retrieved from their backends when the resource is retrieved -
+        they are rendered as last known. Set e.g. lazy_links = [COMPUTE].
+
+        kind -- The kind of the resource.
+        '''
+        return self.lazy_links is not None and kind in self.lazy_links
+
+    def get_workflow(self):
+        '''
+        Returns the object the handlers call the workflow routines on -
+        e.g. an occi.asynchronous.EventLoopWorkflow. None (the default) uses
+        the occi.workflow module.
+        '''
+        return self.workflow
+
+    def get_lock(self, key):
+        '''
+        Returns a context manager which serializes all changes to the
+        resource with the given key - used by the workflow to make check and
+        add sequences atomic. Not needed by single threaded registries.
+
+        key -- Unique identifier of the resource.
+        '''
+        return _NO_LOCK
+
     def get_extras(self, extras):
         '''
         Will return what goes into the extras attribute of the entity and
@@ -198,6 +493,105 @@ class Registry(object):
         return None
 
 
+class _NoLock(object):
+    '''
+    A lock which does nothing.
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NO_LOCK = _NoLock()
+
+
+class _Order(object):
+    '''
+    The keys of a listing in the order they were added. Positions only grow
+    so a listing can continue after a position with a binary search; removed
+    keys leave gaps which are dropped once they make up half of the list.
+    '''
+
+    def __init__(self):
+        self.positions = {}
+        self.sequence = []
+        self.keys = []
+
+    def add(self, key, position):
+        '''
+        Appends a key - a key which is added again moves to the end.
+
+        key -- The unique identifier.
+        position -- The position - greater than all positions so far.
+        '''
+        self.positions[key] = position
+        self.sequence.append(position)
+        self.keys.append(key)
+
+    def remove(self, key):
+        '''
+        Removes a key.
+
+        key -- The unique identifier.
+        '''
+        self.positions.pop(key, None)
+        if len(self.keys) > 2 * len(self.positions) + 32:
+            # rebuilt instead of changed in place so running iterations are
+            # not disturbed.
+            items = [(position, item)
+                     for position, item in zip(self.sequence, self.keys)
+                     if self.positions.get(item) == position]
+            self.sequence = [position for position, _ in items]
+            self.keys = [item for _, item in items]
+
+    def after(self, position):
+        '''
+        Generator over the (position, key) tuples following a position.
+
+        position -- The position (None for the start).
+        '''
+        sequence, keys = self.sequence, self.keys
+        start = 0
+        if position is not None:
+            start = bisect.bisect_right(sequence, position)
+        for index in range(start, len(sequence)):
+            key = keys[index]
+            if self.positions.get(key) == sequence[index]:
+                yield sequence[index], key
+
+
+class _PathNode(object):
+    '''
+    A node in the trie of resource identifiers. Each node represents one
+    segment of the path and keeps the listing of all resources below it per
+    owner.
+    '''
+
+    # disabling 'Too few public methods' pylint check (just a data model)
+    # pylint: disable=R0903
+
+    def __init__(self):
+        self.children = {}
+        self.resources = {}
+        self.orders = {}
+        self.count = 0
+
+
+def _get_owner_key(owner):
+    '''
+    Returns the key of the partition of an owner - None for public
+    resources. Owners are grouped by their string representation (see
+    NonePersistentRegistry._get_partition).
+
+    owner -- The owner as returned by get_extras (or None).
+    '''
+    if owner is None:
+        return None
+    return str(owner)
+
+
 class NonePersistentRegistry(Registry):
     '''
     None optimized/persistent registry for the OCCI service.
@@ -209,33 +603,373 @@ class NonePersistentRegistry(Registry):
     @author: tmetsch
     '''
 
-    def __init__(self):
-        self.backends = {}
+    def __init__(self, indexed_attributes=None):
+        '''
+        Constructor.
+
+        indexed_attributes -- Names of the attributes for which an index of
+                              their values is kept (speeds up filtering).
+        '''
+        self._indexed = frozenset(indexed_attributes or [])
+        self._attributes = {}
+        self._attribute_values = {}
+        self._backends = {}
+        self._locations = {}
+        self._generation = 0
         self.renderings = {}
-        self.resources = {}
+        self._resources = {}
+        self._public = {}
+        self._owned = {}
+        self._members = {}
+        self._memberships = {}
+        self._paths = _PathNode()
+        self._member_orders = {}
+        self._position = 0
+        self._versions = {}
+        self._changes = 0
         self.host = ''
         super(NonePersistentRegistry, self).__init__()
 
-    def get_renderer(self, mime_type):
-        parser = None
+    def _get_backends(self):
+        '''
+        Returns the dictionary of categories and their backends.
+        '''
+        return self._backends
 
-        for tmp in mime_type.split(','):
-            type_str = tmp.strip()
-            if type_str.find(';q=') > -1:
-                type_str = type_str[:type_str.find(';q=')]
+    def _set_backends(self, backends):
+        '''
+        Replaces all backends at once and rebuilds the location index.
 
-            if type_str in self.renderings:
-                parser = self.renderings[type_str]
-                break
-            elif type_str == '*/*':
-                parser = self.renderings[self.get_default_type()]
-                break
+        backends -- Dictionary of categories and their backends.
+        '''
+        self._backends = backends
+        self._locations = {}
+        self._generation += 1
+        for category in backends.keys():
+            if category.location is not None:
+                self._locations[category.location] = category
+
+    backends = property(_get_backends, _set_backends)
+
+    def _get_resources(self):
+        '''
+        Returns the dictionary of all resources.
+        '''
+        return self._resources
+
+    def _set_resources(self, resources):
+        '''
+        Replaces all resources at once and rebuilds the partitions.
+
+        resources -- Dictionary of keys and their resources.
+        '''
+        self._resources = resources
+        self._public = {}
+        self._owned = {}
+        self._members = {}
+        self._memberships = {}
+        self._paths = _PathNode()
+        self._member_orders = {}
+        self._versions = {}
+        self._attributes = {}
+        self._attribute_values = {}
+        for key, resource in resources.items():
+            self._get_partition(resource.extras)[key] = resource
+            self._index_categories(key, resource)
+            self._index_path(key, resource)
+            self._index_order(key, resource)
+            self._touch(key, resource)
+            self._index_attributes(key, resource)
+
+    resources = property(_get_resources, _set_resources)
+
+    def _get_owner(self, extras):
+        '''
+        Returns the owner of a request - None for anonymous requests.
+
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        if extras is None:
+            return None
+        return self.get_extras(extras)
+
+    def _get_partition(self, owner):
+        '''
+        Returns the partition of resources belonging to an owner. Resources
+        without an owner live in the public partition.
+
+        Owners are grouped by their string representation (same as in the
+        hash of a category) so unhashable extras can be used as well.
+
+        owner -- The owner as returned by get_extras.
+        '''
+        if owner is None:
+            return self._public
+        return self._owned.setdefault(str(owner), {})
+
+    def _index_categories(self, key, resource):
+        '''
+        Adds a resource to the member index of its kind and mixins.
+
+        key -- The unique identifier.
+        resource -- The resource.
+        '''
+        categories = set(resource.mixins or [])
+        if resource.kind is not None:
+            categories.add(resource.kind)
+        for category in categories:
+            self._members.setdefault(category, {})[key] = resource
+        self._memberships[key] = categories
+
+    def _index_order(self, key, resource):
+        '''
+        Appends a resource to the listings of its categories and of the trie
+        nodes on its path - each listing is kept per owner (see
+        _get_orders).
+
+        key -- The unique identifier.
+        resource -- The resource.
+        '''
+        position = self._next_position()
+        owner = _get_owner_key(resource.extras)
+        for category in self._memberships[key]:
+            orders = self._member_orders.setdefault(category, {})
+            orders.setdefault(owner, _Order()).add(key, position)
+        for node in self._get_path_chain(key):
+            node.orders.setdefault(owner, _Order()).add(key, position)
 
-        if parser is None:
-            raise HTTPError(406, 'This service is unable to understand the ' +
-                            ' mime type: ' + repr(mime_type))
+    def _next_position(self):
+        '''
+        Returns the position of the next addition to a listing.
+        '''
+        self._position += 1
+        return self._position
+
+    def _unindex_order(self, key, resource, category=None):
+        '''
+        Removes a resource from the listing of a category - or from the
+        listings of the trie nodes on its path if no category is given.
+
+        key -- The unique identifier.
+        resource -- The resource.
+        category -- The kind or mixin (or None).
+        '''
+        owner = _get_owner_key(resource.extras)
+        if category is not None:
+            items = [self._member_orders[category]]
         else:
-            return parser
+            items = [node.orders for node in self._get_path_chain(key)]
+        for orders in items:
+            orders[owner].remove(key)
+            if not orders[owner].positions:
+                orders.pop(owner)
+        if category is not None and not items[0]:
+            self._member_orders.pop(category)
+
+    def _get_orders(self, category, path, owner):
+        '''
+        Returns the listings which hold the resources of a category (or
+        under a path) visible to an owner: the public ones and those of the
+        owner.
+
+        category -- The kind or mixin (or None).
+        path -- The path under which to look.
+        owner -- The owner as returned by get_extras.
+        '''
+        owners = [None]
+        if owner is not None:
+            owners.append(_get_owner_key(owner))
+        if category is not None:
+            items = [self._member_orders.get(category, {})]
+        else:
+            items = [node.orders for node in self._get_path_nodes(path)]
+        return [orders[item] for orders in items for item in owners
+                if item in orders]
+
+    def _touch(self, key, entity):
+        '''
+        Gives a resource a new version if it changed since the last call.
+
+        key -- The unique identifier.
+        entity -- The resource.
+        '''
+        fingerprint = get_fingerprint(entity)
+        current = self._versions.get(key)
+        if current is not None and current[1] == fingerprint:
+            return
+        self._changes += 1
+        self._versions[key] = (self._changes, fingerprint)
+        self._touch_source(entity)
+
+    def _touch_source(self, entity):
+        '''
+        Gives the source of a link a new version - links are rendered with
+        their source.
+
+        entity -- The entity (nothing is done if it is not a link).
+        '''
+        source = getattr(getattr(entity, 'source', None), 'identifier', None)
+        if source in self._versions:
+            self._changes += 1
+            self._versions[source] = (self._changes,
+                                      self._versions[source][1])
+
+    def _index_attributes(self, key, resource):
+        '''
+        Adds a resource to the index of the values of its indexed
+        attributes. Unhashable values are not indexed.
+
+        key -- The unique identifier.
+        resource -- The resource.
+        '''
+        if not self._indexed:
+            return
+        values = set()
+        for name in self._indexed.intersection(resource.attributes or {}):
+            item = (name, resource.attributes[name])
+            try:
+                self._attributes.setdefault(item, {})[key] = resource
+            except TypeError:
+                continue
+            values.add(item)
+        self._attribute_values[key] = values
+
+    def _unindex_attributes(self, key):
+        '''
+        Removes a resource from the index of attribute values.
+
+        key -- The unique identifier.
+        '''
+        for item in self._attribute_values.pop(key, []):
+            members = self._attributes[item]
+            members.pop(key)
+            if not members:
+                self._attributes.pop(item)
+
+    def _index_path(self, key, resource):
+        '''
+        Adds a resource to the trie of identifiers.
+
+        key -- The unique identifier.
+        resource -- The resource.
+        '''
+        node = self._paths
+        node.count += 1
+        for segment in key.split('/'):
+            node = node.children.setdefault(segment, _PathNode())
+            node.count += 1
+        node.resources[key] = resource
+
+    def _get_path_chain(self, key):
+        '''
+        Returns the trie nodes from the root to the node of an identifier.
+
+        key -- The unique identifier.
+        '''
+        node = self._paths
+        result = [node]
+        for segment in key.split('/'):
+            node = node.children[segment]
+            result.append(node)
+        return result
+
+    def _unindex_path(self, key):
+        '''
+        Removes a resource from the trie of identifiers and prunes empty
+        nodes.
+
+        key -- The unique identifier.
+        '''
+        node = self._paths
+        node.count -= 1
+        for segment in key.split('/'):
+            child = node.children[segment]
+            child.count -= 1
+            if not child.count:
+                node.children.pop(segment)
+            node = child
+        node.resources.pop(key)
+
+    def _get_path_nodes(self, path):
+        '''
+        Returns the trie nodes which hold everything starting with the path.
+
+        Complete segments are followed, the last (partial) segment is matched
+        against the children of the reached node.
+
+        path -- The path.
+        '''
+        segments = path.split('/')
+        node = self._paths
+        for segment in segments[:-1]:
+            node = node.children.get(segment)
+            if node is None:
+                return []
+        partial = segments[-1]
+        if partial == '':
+            return node.children.values()
+        result = []
+        for segment, child in node.children.items():
+            if segment.startswith(partial):
+                result.append(child)
+        return result
+
+    def _walk_path_nodes(self, nodes):
+        '''
+        Generator over all resources held by the given nodes and their
+        children.
+
+        nodes -- List of trie nodes.
+        '''
+        stack = list(nodes)
+        while stack:
+            node = stack.pop()
+            for resource in node.resources.values():
+                yield resource
+            stack.extend(node.children.values())
+
+    def _is_visible(self, resource, owner):
+        '''
+        Checks if a resource is public or belongs to the given owner.
+
+        resource -- The resource.
+        owner -- The owner as returned by get_extras.
+        '''
+        if resource.extras is None:
+            return True
+        return owner is not None and resource.extras == owner
+
+    def _get_visible(self, extras):
+        '''
+        Returns the public partition and the resources of the owner.
+
+        extras -- Extras object - same as the one passed on to the backends.
+        '''
+        owner = self._get_owner(extras)
+        result = list(self._public.items())
+        if owner is not None:
+            for key, item in self._owned.get(str(owner), {}).items():
+                if item.extras == owner:
+                    result.append((key, item))
+        return result
+
+    def get_generation(self):
+        return self._generation
+
+    def get_version(self, key, extras):
+        version = self._versions.get(key)
+        if version is None:
+            return None
+        return EPOCH + '-' + str(version[0])
+
+    def get_renderer(self, mime_type):
+        for type_str in get_media_ranges(mime_type):
+            if type_str in self.renderings:
+                return self.renderings[type_str]
+            elif type_str == '*/*':
+                return self.renderings[self.get_default_type()]
+        raise HTTPError(406, 'This service is unable to understand the ' +
+                        ' mime type: ' + repr(mime_type))
 
     def set_renderer(self, mime_type, renderer):
         if not isinstance(renderer, Rendering):
@@ -269,19 +1003,22 @@ class NonePersistentRegistry(Registry):
             # category belongs to single user...
             category.extras = self.get_extras(extras)
         self.backends[category] = backend
+        if category.location is not None:
+            self._locations[category.location] = category
+        self._generation += 1
 
     def delete_mixin(self, mixin, extras):
         # no need to check because in get_category in renderer it is assured
         # that the user only sees own. Will get not found if he tries to delete
         # mixin from other user.
         self.backends.pop(mixin)
+        if self._locations.get(mixin.location) == mixin:
+            self._locations.pop(mixin.location)
+        self._generation += 1
 
     def get_category(self, path, extras):
         # no need for ownership check - paths cannot overlap!
-        for category in self.backends.keys():
-            if category.location == path:
-                return category
-        return None
+        return self._locations.get(path)
 
     def get_categories(self, extras):
         result = []
@@ -303,29 +1040,442 @@ class NonePersistentRegistry(Registry):
     def add_resource(self, key, resource, extras):
         if extras is not None:
             resource.extras = self.get_extras(extras)
+        if key in self.resources:
+            self.delete_resource(key, extras)
         self.resources[key] = resource
+        # the owner is fixed once the resource is added.
+        self._get_partition(resource.extras)[key] = resource
+        self._index_categories(key, resource)
+        self._index_path(key, resource)
+        self._index_order(key, resource)
+        self._index_attributes(key, resource)
+        self._touch(key, resource)
+
+    def update_resource(self, key, entity, extras):
+        if self.resources.get(key) is not entity:
+            return
+        self._touch(key, entity)
+        # the backends might have changed indexed attributes.
+        if self._indexed:
+            self._unindex_attributes(key)
+            self._index_attributes(key, entity)
 
     def delete_resource(self, key, extras):
         # get_resources and get_resource is called before this - no need for
         # ownership checking.
-        self.resources.pop(key)
+        resource = self.resources.pop(key)
+        partition = self._get_partition(resource.extras)
+        partition.pop(key, None)
+        if not partition and resource.extras is not None:
+            self._owned.pop(str(resource.extras), None)
+        for category in self._memberships.pop(key):
+            members = self._members[category]
+            members.pop(key)
+            if not members:
+                self._members.pop(category)
+            self._unindex_order(key, resource, category)
+        self._unindex_order(key, resource)
+        self._versions.pop(key, None)
+        self._touch_source(resource)
+        self._unindex_path(key)
+        self._unindex_attributes(key)
+
+    def has_resource(self, key, extras):
+        if key not in self.resources:
+            return False
+        return self._is_visible(self.resources[key], self._get_owner(extras))
 
     def get_resource_keys(self, extras):
+        return [key for key, item in self._get_visible(extras)]
+
+    def get_resources(self, extras):
+        return [item for key, item in self._get_visible(extras)]
+
+    def get_resources_by_category(self, category, extras):
+        owner = self._get_owner(extras)
         result = []
-        for key in self.resources.keys():
-            if self.resources[key].extras is None:
-                result.append(key)
-            elif self.resources[key].extras is not None and \
-                    self.resources[key].extras == self.get_extras(extras):
-                result.append(key)
+        for item in self._members.get(category, {}).values():
+            if self._is_visible(item, owner):
+                result.append(item)
         return result
 
-    def get_resources(self, extras):
+    def get_resources_by_attribute(self, name, value, extras):
+        if name not in self._indexed:
+            return None
+        try:
+            members = self._attributes.get((name, value), {})
+        except TypeError:
+            return None
+        owner = self._get_owner(extras)
         result = []
-        for item in self.resources.values():
-            if item.extras is None:
+        for item in members.values():
+            if self._is_visible(item, owner):
                 result.append(item)
-            elif item.extras is not None and \
-                    item.extras == self.get_extras(extras):
+        return result
+
+    def get_resources_under_path(self, path, extras):
+        owner = self._get_owner(extras)
+        result = []
+        for item in self._walk_path_nodes(self._get_path_nodes(path)):
+            if self._is_visible(item, owner):
                 result.append(item)
         return result
+
+    def has_resources_under_path(self, path, extras):
+        owner = self._get_owner(extras)
+        for item in self._walk_path_nodes(self._get_path_nodes(path)):
+            if self._is_visible(item, owner):
+                return True
+        return False
+
+    def get_resources_after(self, category, path, position, limit, extras):
+        # positions count the additions - every listing is kept in the
+        # order its resources were added.
+        try:
+            position = None if position is None else int(position)
+        except ValueError:
+            raise AttributeError('Invalid position: ' + repr(position))
+        owner = self._get_owner(extras)
+        result = []
+        if limit == 0:
+            return result
+        # only the listings of the owner and the public ones are merged.
+        orders = self._get_orders(category, path, owner)
+        for item_position, key in heapq.merge(*[order.after(position)
+                                                for order in orders]):
+            item = self.resources[key]
+            if self._is_visible(item, owner):
+                result.append((str(item_position), item))
+                if len(result) == limit:
+                    break
+        return result
+
+    def add_to_category(self, category, entity, extras):
+        key = entity.identifier
+        # only index what is actually registered.
+        if self.resources.get(key) is entity and \
+                category not in self._memberships[key]:
+            self._members.setdefault(category, {})[key] = entity
+            self._memberships[key].add(category)
+            orders = self._member_orders.setdefault(category, {})
+            orders.setdefault(_get_owner_key(entity.extras), _Order()).add(
+                key, self._next_position())
+            self._touch(key, entity)
+
+    def remove_from_category(self, category, entity, extras):
+        key = entity.identifier
+        if self.resources.get(key) is entity and \
+                category in self._memberships[key]:
+            members = self._members[category]
+            members.pop(key)
+            if not members:
+                self._members.pop(category)
+            self._memberships[key].discard(category)
+            self._unindex_order(key, entity, category)
+            self._touch(key, entity)
+
+
+class ReadWriteLock(object):
+    '''
+    Lock which can be held by many readers or one writer. Waiting writers
+    are preferred so readers cannot starve them.
+    '''
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._waiting = 0
+
+    @contextlib.contextmanager
+    def reading(self):
+        '''
+        Context manager which holds the lock for reading.
+        '''
+        with self._condition:
+            while self._writing or self._waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def writing(self):
+        '''
+        Context manager which holds the lock for writing.
+        '''
+        with self._condition:
+            self._waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class _Stripe(NonePersistentRegistry):
+    '''
+    The resources of one stripe of a ConcurrentRegistry and their indexes.
+    Positions and versions are handed out by the registry so they are
+    unique across all stripes.
+    '''
+
+    # disabling 'Access to protected member' pylint check (same registry)
+    # pylint: disable=W0212
+
+    def __init__(self, registry, indexed_attributes):
+        '''
+        Constructor.
+
+        registry -- The ConcurrentRegistry the stripe belongs to.
+        indexed_attributes -- Names of the attributes for which an index of
+                              their values is kept (speeds up filtering).
+        '''
+        self.registry = registry
+        self.lock = threading.RLock()
+        self.index_lock = ReadWriteLock()
+        super(_Stripe, self).__init__(indexed_attributes)
+
+    @contextlib.contextmanager
+    def writing(self):
+        '''
+        Context manager which holds the lock of the stripe and its indexes
+        for writing.
+        '''
+        with self.lock:
+            with self.index_lock.writing():
+                yield
+
+    def _next_position(self):
+        return self.registry._next_position()
+
+    def _touch(self, key, entity):
+        self.registry._touch(key, entity)
+
+    def _touch_source(self, entity):
+        self.registry._touch_source(entity)
+
+    def get_extras(self, extras):
+        return self.registry.get_extras(extras)
+
+    def delete_resource(self, key, extras):
+        super(_Stripe, self).delete_resource(key, extras)
+        self.registry._forget(key)
+
+
+class ConcurrentRegistry(NonePersistentRegistry):
+    '''
+    Registry which can be shared by the threads of a threaded WSGI server.
+
+    The resources are spread over a fixed number of stripes (picked by the
+    hash of the key) - each stripe keeps its own indexes (partitions,
+    category members, path trie and listings). Changes to a resource are
+    serialized by the lock of its stripe - the workflow holds the same lock
+    while checking and adding links - and the indexes of a stripe are
+    guarded by a reader-writer lock. So writes to keys of different stripes
+    do not wait for each other, lookups by key take no lock at all and
+    other reads visit the stripes one after another - waiting only for a
+    write to the stripe they read.
+
+    Positions are unique across the stripes, but a listing read while
+    resources are added might not yet hold an addition with a smaller
+    position than those returned.
+    '''
+
+    def __init__(self, stripes=16, indexed_attributes=None):
+        '''
+        Constructor.
+
+        stripes -- Number of stripes the keys are spread over.
+        indexed_attributes -- Names of the attributes for which an index of
+                              their values is kept (speeds up filtering).
+        '''
+        self._category_lock = ReadWriteLock()
+        self._counter_lock = threading.RLock()
+        super(ConcurrentRegistry, self).__init__(indexed_attributes)
+        self._stripes = [_Stripe(self, indexed_attributes)
+                         for _ in range(stripes)]
+
+    def _get_stripe(self, key):
+        '''
+        Returns the stripe holding a resource.
+
+        key -- Unique identifier of the resource.
+        '''
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def _get_resources(self):
+        '''
+        Returns a dictionary of all resources.
+        '''
+        result = {}
+        for stripe in self._stripes:
+            result.update(stripe.resources)
+        return result
+
+    def _set_resources(self, resources):
+        '''
+        Replaces all resources at once and rebuilds the stripes.
+
+        resources -- Dictionary of keys and their resources.
+        '''
+        parts = [{} for _ in self._stripes]
+        for key, resource in resources.items():
+            parts[hash(key) % len(self._stripes)][key] = resource
+        with self._counter_lock:
+            self._versions = {}
+        for stripe, part in zip(self._stripes, parts):
+            with stripe.writing():
+                stripe.resources = part
+
+    resources = property(_get_resources, _set_resources)
+
+    def _next_position(self):
+        with self._counter_lock:
+            return super(ConcurrentRegistry, self)._next_position()
+
+    def _touch(self, key, entity):
+        with self._counter_lock:
+            super(ConcurrentRegistry, self)._touch(key, entity)
+
+    def _touch_source(self, entity):
+        with self._counter_lock:
+            super(ConcurrentRegistry, self)._touch_source(entity)
+
+    def _forget(self, key):
+        '''
+        Drops the version of a deleted resource.
+
+        key -- Unique identifier of the resource.
+        '''
+        with self._counter_lock:
+            self._versions.pop(key, None)
+
+    def _read(self, name, *args):
+        '''
+        Calls a read routine on every stripe and returns all results.
+
+        name -- Name of the routine.
+        args -- Its arguments.
+        '''
+        result = []
+        for stripe in self._stripes:
+            with stripe.index_lock.reading():
+                result.extend(getattr(stripe, name)(*args))
+        return result
+
+    def get_lock(self, key):
+        return self._get_stripe(key).lock
+
+    #==========================================================================
+    # Categories
+    #==========================================================================
+
+    def set_backend(self, category, backend, extras):
+        with self._category_lock.writing():
+            super(ConcurrentRegistry, self).set_backend(category, backend,
+                                                        extras)
+
+    def delete_mixin(self, mixin, extras):
+        with self._category_lock.writing():
+            super(ConcurrentRegistry, self).delete_mixin(mixin, extras)
+
+    def get_categories(self, extras):
+        with self._category_lock.reading():
+            return super(ConcurrentRegistry, self).get_categories(extras)
+
+    #==========================================================================
+    # Resources
+    #==========================================================================
+
+    def get_resource(self, key, extras):
+        return self._get_stripe(key).get_resource(key, extras)
+
+    def add_resource(self, key, resource, extras):
+        stripe = self._get_stripe(key)
+        with stripe.writing():
+            stripe.add_resource(key, resource, extras)
+
+    def update_resource(self, key, entity, extras):
+        stripe = self._get_stripe(key)
+        with stripe.writing():
+            stripe.update_resource(key, entity, extras)
+
+    def delete_resource(self, key, extras):
+        stripe = self._get_stripe(key)
+        with stripe.writing():
+            stripe.delete_resource(key, extras)
+
+    def delete_resources(self, keys, extras):
+        # every stripe is taken once for all of its keys.
+        groups = collections.OrderedDict()
+        for key in keys:
+            groups.setdefault(self._get_stripe(key), []).append(key)
+        for stripe, items in groups.items():
+            with stripe.writing():
+                for key in items:
+                    stripe.delete_resource(key, extras)
+
+    def has_resource(self, key, extras):
+        return self._get_stripe(key).has_resource(key, extras)
+
+    def get_resource_keys(self, extras):
+        return self._read('get_resource_keys', extras)
+
+    def get_resources(self, extras):
+        return self._read('get_resources', extras)
+
+    def get_resources_by_category(self, category, extras):
+        return self._read('get_resources_by_category', category, extras)
+
+    def get_resources_by_attribute(self, name, value, extras):
+        result = []
+        for stripe in self._stripes:
+            with stripe.index_lock.reading():
+                items = stripe.get_resources_by_attribute(name, value, extras)
+            if items is None:
+                return None
+            result.extend(items)
+        return result
+
+    def get_resources_under_path(self, path, extras):
+        return self._read('get_resources_under_path', path, extras)
+
+    def has_resources_under_path(self, path, extras):
+        for stripe in self._stripes:
+            with stripe.index_lock.reading():
+                if stripe.has_resources_under_path(path, extras):
+                    return True
+        return False
+
+    def get_resources_after(self, category, path, position, limit, extras):
+        # the listing of each stripe is ordered by position - so they are
+        # merged.
+        listings = []
+        for stripe in self._stripes:
+            with stripe.index_lock.reading():
+                items = stripe.get_resources_after(category, path, position,
+                                                   limit, extras)
+            listings.append([(int(item[0]), item) for item in items])
+        return [item for _, item in
+                itertools.islice(heapq.merge(*listings), limit)]
+
+    def add_to_category(self, category, entity, extras):
+        stripe = self._get_stripe(entity.identifier)
+        with stripe.writing():
+            stripe.add_to_category(category, entity, extras)
+
+    def remove_from_category(self, category, entity, extras):
+        stripe = self._get_stripe(entity.identifier)
+        with stripe.writing():
+            stripe.remove_from_category(category, entity, extras)
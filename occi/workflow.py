@@ -27,13 +27,36 @@ Created on Jun 30, 2011
 from occi.backend import UserDefinedMixinBackend
 from occi.core_model import Resource, Link, Mixin
 from occi.exceptions import HTTPError
+import binascii
+import collections
+import inspect
+import threading
+import time
 import uuid
+import weakref
+
+# per registry: the retrieve cache.
+_RETRIEVE_CACHES = weakref.WeakKeyDictionary()
+_RETRIEVE_CACHES_LOCK = threading.Lock()
+
+# per registry: the ids of the links which are being created.
+_RESERVED = weakref.WeakKeyDictionary()
+_RESERVED_LOCK = threading.Lock()
+
+# coroutines of async backends are awaitable (there are none on Python 2).
+_IS_AWAITABLE = getattr(inspect, 'isawaitable', lambda item: False)
+
+# max. number of entities a retrieve cache remembers.
+RETRIEVE_CACHE_SIZE = 10000
+
+# attributes set by the renderings - covered by identifier, source and target.
+_DERIVED_ATTRIBUTES = frozenset(['occi.core.id', 'occi.core.source',
+                                 'occi.core.target'])
 
 #==============================================================================
 # Handling of Resources & Links
 #==============================================================================
 
-
 def create_entity(key, entity, registry, extras):
     '''
     Handles all the model magic during creation of an entity.
@@ -42,6 +65,21 @@ def create_entity(key, entity, registry, extras):
 
     If it's a link it will ensure that source and target are properly set.
 
+    The backends of the entity are called first, the backends of the links
+    after them (see call_backends).
+
+    key -- The key for the entity.
+    entity -- The entity itself - either Link or Resource instance.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    run_steps(create_entity_steps(key, entity, registry, extras), registry)
+
+
+def create_entity_steps(key, entity, registry, extras):
+    '''
+    The steps of create_entity (see run_steps).
+
     key -- The key for the entity.
     entity -- The entity itself - either Link or Resource instance.
     registry -- The registry used for this process.
@@ -50,9 +88,8 @@ def create_entity(key, entity, registry, extras):
     entity.identifier = key
 
     # call all the backends who are associated with this entity.kind...
-    backends = registry.get_all_backends(entity, extras)
-    for backend in backends:
-        backend.create(entity, extras)
+    yield BackendCalls([(backend.create_many, [entity], extras) for backend
+                        in registry.get_all_backends(entity, extras)])
 
     # if it is an resource we create make sure we create the links properly
     if isinstance(entity, Resource):
@@ -61,16 +98,22 @@ def create_entity(key, entity, registry, extras):
             # FUTURE_IMPROVEMENT: string links
             if link.identifier is None:
                 link.identifier = create_id(link.kind)
-            elif link.identifier in registry.get_resource_keys(extras):
-                raise AttributeError('A link with that id is already present')
-
-            for back in registry.get_all_backends(link, extras):
-                back.create(link, extras)
-
-            registry.add_resource(link.identifier, link, extras)
+        get_retrieve_cache(registry).invalidate(entity.links)
+        keys = reserve_links(entity.links, registry, extras)
+        try:
+            yield BackendCalls([(back.create_many, links, extras)
+                                for back, links in
+                                group_by_backend(entity.links, registry,
+                                                 extras)])
+
+            for link in entity.links:
+                registry.add_resource(link.identifier, link, extras)
+        finally:
+            release_links(keys, registry)
     elif isinstance(entity, Link):
         entity.source.links.append(entity)
 
+    get_retrieve_cache(registry).invalidate([entity])
     registry.add_resource(key, entity, extras)
 
 
@@ -80,25 +123,40 @@ def delete_entity(entity, registry, extras):
 
     If it's a link it will remove the link from the entity source links list.
 
+    The backends of the links are called first, the backends of the entity
+    after them (see call_backends).
+
+    entity -- The entity itself - either Link or Resource instance.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    run_steps(delete_entity_steps(entity, registry, extras), registry)
+
+
+def delete_entity_steps(entity, registry, extras):
+    '''
+    The steps of delete_entity (see run_steps).
+
     entity -- The entity itself - either Link or Resource instance.
     registry -- The registry used for this process.
     extras -- Any extra arguments which are defined by the user.
     '''
+    get_retrieve_cache(registry).invalidate([entity])
     if isinstance(entity, Resource):
         # it's an resource - so delete all it's links
         # FUTURE_IMPROVEMENT: string links
+        get_retrieve_cache(registry).invalidate(entity.links)
+        yield BackendCalls([(back.delete_many, links, extras)
+                            for back, links in
+                            group_by_backend(entity.links, registry, extras)])
         for link in entity.links:
-            for back in registry.get_all_backends(link, extras):
-                back.delete(link, extras)
             registry.delete_resource(link.identifier, extras)
     elif isinstance(entity, Link):
         entity.source.links.remove(entity)
 
     # call all the backends who are associated with this entity.kind...
-    backends = registry.get_all_backends(entity, extras)
-
-    for backend in backends:
-        backend.delete(entity, extras)
+    yield BackendCalls([(backend.delete_many, [entity], extras) for backend
+                        in registry.get_all_backends(entity, extras)])
 
     registry.delete_resource(entity.identifier, extras)
 
@@ -114,7 +172,19 @@ def replace_entity(old, new, registry, extras):
     registry -- The registry used for this process.
     extras -- Any extra arguments which are defined by the user.
     '''
-    if isinstance(new, Resource) and len(new.links) is not 0:
+    run_steps(replace_entity_steps(old, new, registry, extras), registry)
+
+
+def replace_entity_steps(old, new, registry, extras):
+    '''
+    The steps of replace_entity (see run_steps).
+
+    old -- The old entity.
+    new -- The new entity.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    if isinstance(new, Resource) and new.links:
         raise HTTPError(400, 'It is not recommend to have links in a full' +
                         ' update request')
 
@@ -126,11 +196,13 @@ def replace_entity(old, new, registry, extras):
     backends = registry.get_all_backends(old, extras)
     new_backends = registry.get_all_backends(new, extras)
     for backend in backends:
-        backend.replace(old, new, extras)
+        yield BackendCalls([(backend.replace, old, new, extras)])
     for backend in unique(new_backends, backends):
-        backend.create(new, extras)
+        yield BackendCalls([(backend.create, new, extras)])
     for backend in unique(backends, new_backends):
-        backend.delete(old, extras)
+        yield BackendCalls([(backend.delete, old, extras)])
+    get_retrieve_cache(registry).invalidate([old])
+    registry.update_resource(old.identifier, old, extras)
     del new
 
 
@@ -145,7 +217,19 @@ def update_entity(old, new, registry, extras):
     registry -- The registry used for this process.
     extras -- Any extra arguments which are defined by the user.
     '''
-    if isinstance(new, Resource) and len(new.links) is not 0:
+    run_steps(update_entity_steps(old, new, registry, extras), registry)
+
+
+def update_entity_steps(old, new, registry, extras):
+    '''
+    The steps of update_entity (see run_steps).
+
+    old -- The old entity.
+    new -- The new entity.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    if isinstance(new, Resource) and new.links:
         raise HTTPError(400, 'It is not recommend to have links in a full' +
                         ' update request')
 
@@ -153,41 +237,230 @@ def update_entity(old, new, registry, extras):
     backends = registry.get_all_backends(old, extras)
     new_backends = registry.get_all_backends(new, extras)
     for backend in backends:
-        backend.update(old, new, extras)
+        yield BackendCalls([(backend.update, old, new, extras)])
     for backend in unique(new_backends, backends):
         # for added mixins called create!
-        backend.create(old, extras)
+        yield BackendCalls([(backend.create, old, extras)])
+    get_retrieve_cache(registry).invalidate([old])
+    registry.update_resource(old.identifier, old, extras)
 
     del new
 
 
-def retrieve_entity(entity, registry, extras):
+def delete_entities(entities, registry, extras):
+    '''
+    Deletes a set of entities (e.g. a whole collection) together with the
+    links of the resources. Entities are grouped by backend so each backend
+    is called once for all links and once for all other entities - and the
+    registry removes all of them at once (see Registry.delete_resources).
+
+    A failing backend call does not stop the others. The entities it
+    covered are kept - so is a resource if one of its links was kept.
+
+    Returns a list with the error for each entity (None on success) in the
+    order of the entities.
+
+    entities -- The entities which are to be deleted.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    return run_steps(delete_entities_steps(entities, registry, extras),
+                     registry)
+
+
+def delete_entities_steps(entities, registry, extras):
+    '''
+    The steps of delete_entities (see run_steps).
+
+    entities -- The entities which are to be deleted.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    links, others = gather_links(entities)
+    get_retrieve_cache(registry).invalidate(links + others)
+
+    groups = group_by_backend(links, registry, extras)
+    results = yield BackendCalls([(back.delete_many, items, extras)
+                                  for back, items in groups], errors=True)
+    failed = get_failed(groups, results)
+    links = keep_failed_links(links, failed)
+
+    others = [entity for entity in others if entity.identifier not in failed]
+    groups = group_by_backend(others, registry, extras)
+    results = yield BackendCalls([(back.delete_many, items, extras)
+                                  for back, items in groups], errors=True)
+    failed.update(get_failed(groups, results))
+    others = [entity for entity in others if entity.identifier not in failed]
+
+    detach_links(links, others)
+    registry.delete_resources([item.identifier for item in links + others],
+                              extras)
+    yield [failed.get(entity.identifier) for entity in entities]
+
+
+def gather_links(entities):
+    '''
+    Returns the links which are deleted along with the entities (without
+    duplicates) and the entities which are no links.
+
+    entities -- The entities which are to be deleted.
+    '''
+    links = []
+    others = []
+    seen = set()
+    for entity in entities:
+        # FUTURE_IMPROVEMENT: string links
+        items = entity.links if isinstance(entity, Resource) else []
+        if isinstance(entity, Link):
+            items = [entity]
+        else:
+            others.append(entity)
+        for link in items:
+            if link.identifier not in seen:
+                seen.add(link.identifier)
+                links.append(link)
+    return links, others
+
+
+def get_failed(groups, results):
+    '''
+    Returns a dictionary with the error for each entity of a failed group.
+
+    groups -- The backends and their entities (see group_by_backend).
+    results -- The result of each group - the error if it failed.
+    '''
+    failed = {}
+    for (_, items), error in zip(groups, results):
+        if isinstance(error, Exception):
+            for item in items:
+                failed.setdefault(item.identifier, error)
+    return failed
+
+
+def keep_failed_links(links, failed):
+    '''
+    Returns the links which were deleted - the source of a link which was
+    not is marked as failed as well.
+
+    links -- The links.
+    failed -- Dictionary with the error for each failed entity.
+    '''
+    result = []
+    for link in links:
+        if link.identifier in failed:
+            failed.setdefault(link.source.identifier, failed[link.identifier])
+        else:
+            result.append(link)
+    return result
+
+
+def detach_links(links, deleted):
+    '''
+    Removes deleted links from the resources which are not deleted - one
+    pass over the links of each of these resources.
+
+    links -- The deleted links.
+    deleted -- The deleted entities which are no links.
+    '''
+    deleted = set(entity.identifier for entity in deleted)
+    sources = collections.OrderedDict()
+    for link in links:
+        if link.source.identifier not in deleted:
+            item = sources.setdefault(link.source.identifier,
+                                      (link.source, set()))
+            item[1].add(link.identifier)
+    for source, identifiers in sources.values():
+        source.links[:] = [link for link in source.links
+                           if link.identifier not in identifiers]
+
+
+def retrieve_entity(entity, registry, extras, links=True):
     '''
     Retrieves/refreshed an entity.
 
     If it's a link the entities must be retrieved/refreshed.
 
+    The backends of the entity and its links are called together (see
+    call_backends). Entities and links which were retrieved less than
+    registry.get_freshness(kind) seconds ago are skipped.
+
+    While an entity is being retrieved other requests for the same entity
+    wait for that retrieve and share its outcome instead of calling the
+    backends again.
+
     entity -- The entity which is to be retrieved.
     registry -- The registry used for this process.
     extras -- Any extra arguments which are defined by the user.
+    links -- If False the links of a resource are not retrieved.
     '''
-    if isinstance(entity, Resource):
+    cache = get_retrieve_cache(registry)
+    flight = cache.take_off(entity, links)
+    if flight is not None:
+        flight.wait()
+        if flight.error is not None:
+            raise flight.error
+        return
+    try:
+        run_steps(retrieve_entity_steps(entity, links, cache, registry,
+                                        extras), registry)
+    except Exception as err:
+        cache.land(entity, err, links)
+        raise
+    cache.land(entity, None, links)
+
+
+def retrieve_entity_steps(entity, links, cache, registry, extras):
+    '''
+    The steps of retrieve_entity (see run_steps) - calls the backends of an
+    entity and its links which are not fresh.
+
+    entity -- The entity which is to be retrieved.
+    links -- If False the links of a resource are not retrieved.
+    cache -- The retrieve cache of the registry.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    stale = []
+    if links and isinstance(entity, Resource):
         # if it's a resource - retrieve all links...
-        for link in entity.links:
-            # FUTURE_IMPROVEMENT: string links
-            for back in registry.get_all_backends(link, extras):
-                back.retrieve(link, extras)
+        # FUTURE_IMPROVEMENT: string links
+        stale = [link for link in entity.links
+                 if not cache.is_fresh(link, registry)]
+    calls = [(back.retrieve_many, links, extras)
+             for back, links in group_by_backend(stale, registry, extras)]
 
     # call all the backends who are associated with this entity.kind...
-    backends = registry.get_all_backends(entity, extras)
-    for backend in backends:
-        backend.retrieve(entity, extras)
+    if not cache.is_fresh(entity, registry):
+        stale.append(entity)
+        for backend in registry.get_all_backends(entity, extras):
+            calls.append((backend.retrieve_many, [entity], extras))
+    fingerprints = [get_fingerprint(item) for item in stale]
+    yield BackendCalls(calls)
+    cache.retrieved(stale, registry)
+    # only what the backends changed is written back.
+    for item, fingerprint in zip(stale, fingerprints):
+        if get_fingerprint(item) != fingerprint:
+            registry.update_resource(item.identifier, item, extras)
 
 
 def action_entity(entity, action, registry, attributes, extras):
     '''
     Performs an action on the entity.
 
+    entity -- The entity on which to perform the operation.
+    action -- The action definition.
+    registry -- The registry used for this process.
+    attributes -- The attributes fro the operation.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    run_steps(action_entity_steps(entity, action, registry, attributes,
+                                  extras), registry)
+
+
+def action_entity_steps(entity, action, registry, attributes, extras):
+    '''
+    The steps of action_entity (see run_steps).
+
     entity -- The entity on which to perform the operation.
     action -- The action definition.
     registry -- The registry used for this process.
@@ -195,18 +468,98 @@ def action_entity(entity, action, registry, attributes, extras):
     extras -- Any extra arguments which are defined by the user.
     '''
     backend = registry.get_backend(action, extras)
-    backend.action(entity, action, attributes, extras)
+    yield BackendCalls([(backend.action, entity, action, attributes,
+                         extras)])
+    get_retrieve_cache(registry).invalidate([entity])
+    registry.update_resource(entity.identifier, entity, extras)
 
 #==============================================================================
 # Collections
 #==============================================================================
 
 
+def action_collection(entities, action, registry, attributes, extras):
+    '''
+    Performs an action on all entities of a collection using the batch
+    routine of the action backend. A failing entity does not stop the
+    others.
+
+    With an executor in the registry the entities are split into up to
+    get_collection_action_limit() batches which run at the same time -
+    otherwise one batch covers all entities.
+
+    Returns a list with the error raised for each entity (None on success)
+    in the order of the entities.
+
+    entities -- The entities on which to perform the operation.
+    action -- The action definition.
+    registry -- The registry used for this process.
+    attributes -- The attributes fro the operation.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    limit = 1
+    if registry.get_executor() is not None:
+        limit = registry.get_collection_action_limit()
+    return run_steps(action_collection_steps(entities, action, registry,
+                                             attributes, extras, limit),
+                     registry)
+
+
+def action_collection_steps(entities, action, registry, attributes, extras,
+                            limit):
+    '''
+    The steps of action_collection (see run_steps).
+
+    entities -- The entities on which to perform the operation.
+    action -- The action definition.
+    registry -- The registry used for this process.
+    attributes -- The attributes fro the operation.
+    extras -- Any extra arguments which are defined by the user.
+    limit -- The max. number of batches.
+    '''
+    entities = list(entities)
+    if not entities:
+        yield []
+        return
+    backend = registry.get_backend(action, extras)
+
+    size = -(-len(entities) // max(limit, 1))
+    batches = [entities[i:i + size] for i in range(0, len(entities), size)]
+    get_retrieve_cache(registry).invalidate(entities)
+    results = yield BackendCalls([(backend.action_many, batch, action,
+                                   attributes, extras) for batch in batches],
+                                 errors=True)
+    errors = []
+    for batch, result in zip(batches, results):
+        if isinstance(result, Exception):
+            result = [result] * len(batch)
+        for entity, error in zip(batch, result):
+            if error is None:
+                registry.update_resource(entity.identifier, entity, extras)
+        errors.extend(result)
+    yield errors
+
+
 def update_collection(mixin, old_entities, new_entities, registry, extras):
     '''
     Updates a Collection of Mixin. If not present in the current collections
     entities will be added to the collection (aka. assigned the Mixin).
 
+    mixin -- The mixin which defines the collection.
+    old_entities -- The entities which are in the collection to date.
+    new_entities -- The entities which should be added to the collection.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    run_steps(update_collection_steps(mixin, old_entities, new_entities,
+                                      registry, extras), registry)
+
+
+def update_collection_steps(mixin, old_entities, new_entities, registry,
+                            extras):
+    '''
+    The steps of update_collection (see run_steps).
+
     mixin -- The mixin which defines the collection.
     old_entities -- The entities which are in the collection to date.
     new_entities -- The entities which should be added to the collection.
@@ -216,10 +569,13 @@ def update_collection(mixin, old_entities, new_entities, registry, extras):
     if not isinstance(mixin, Mixin):
         raise AttributeError('This operation is only supported on Collections'
                              + ' of Mixins.')
-    for entity in unique(new_entities, old_entities):
+    backend = registry.get_backend(mixin, extras)
+    added = unique(unique_items(new_entities), old_entities)
+    get_retrieve_cache(registry).invalidate(added)
+    for entity in added:
         entity.mixins.append(mixin)
-        backend = registry.get_backend(mixin, extras)
-        backend.create(entity, extras)
+        registry.add_to_category(mixin, entity, extras)
+    yield BackendCalls([(backend.create_many, added, extras)])
     del new_entities
 
 
@@ -230,6 +586,21 @@ def replace_collection(mixin, old_entities, new_entities, registry, extras):
     entities are not present in the new collection the mixin will be removed
     from them.
 
+    mixin -- The mixin which defines the collection.
+    old_entities -- The entities which are in the collection to date.
+    new_entities -- The new collection of entities.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    run_steps(replace_collection_steps(mixin, old_entities, new_entities,
+                                       registry, extras), registry)
+
+
+def replace_collection_steps(mixin, old_entities, new_entities, registry,
+                             extras):
+    '''
+    The steps of replace_collection (see run_steps).
+
     mixin -- The mixin which defines the collection.
     old_entities -- The entities which are in the collection to date.
     new_entities -- The new collection of entities.
@@ -239,14 +610,18 @@ def replace_collection(mixin, old_entities, new_entities, registry, extras):
     if not isinstance(mixin, Mixin):
         raise AttributeError('This operation is only supported on Collections'
                              + ' of Mixins.')
-    for entity in unique(new_entities, old_entities):
+    backend = registry.get_backend(mixin, extras)
+    added = unique(unique_items(new_entities), old_entities)
+    removed = unique(old_entities, new_entities)
+    get_retrieve_cache(registry).invalidate(added + removed)
+    for entity in added:
         entity.mixins.append(mixin)
-        backend = registry.get_backend(mixin, extras)
-        backend.create(entity, extras)
-    for entity in unique(old_entities, new_entities):
-        backend = registry.get_backend(mixin, extras)
-        backend.delete(entity, extras)
+        registry.add_to_category(mixin, entity, extras)
+    yield BackendCalls([(backend.create_many, added, extras)])
+    yield BackendCalls([(backend.delete_many, removed, extras)])
+    for entity in removed:
         entity.mixins.remove(mixin)
+        registry.remove_from_category(mixin, entity, extras)
     del new_entities
 
 
@@ -254,6 +629,19 @@ def delete_from_collection(mixin, entities, registry, extras):
     '''
     Removes entities from a collection by removing the mixin from their list.
 
+    mixin -- The mixin which defines the collection.
+    entities -- The entities which are to be removed.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    run_steps(delete_from_collection_steps(mixin, entities, registry,
+                                           extras), registry)
+
+
+def delete_from_collection_steps(mixin, entities, registry, extras):
+    '''
+    The steps of delete_from_collection (see run_steps).
+
     mixin -- The mixin which defines the collection.
     entities -- The entities which are to be removed.
     registry -- The registry used for this process.
@@ -263,10 +651,19 @@ def delete_from_collection(mixin, entities, registry, extras):
         raise AttributeError('This operation is only supported on Collections'
                              + ' of Mixins.')
 
-    for entity in intersect(entities, registry.get_resources(extras)):
-        backend = registry.get_backend(mixin, extras)
-        backend.delete(entity, extras)
+    backend = registry.get_backend(mixin, extras)
+    removed = []
+    for entity in unique_items(entities):
+        try:
+            if registry.get_resource(entity.identifier, extras) is entity:
+                removed.append(entity)
+        except KeyError:
+            pass
+    get_retrieve_cache(registry).invalidate(removed)
+    yield BackendCalls([(backend.delete_many, removed, extras)])
+    for entity in removed:
         entity.mixins.remove(mixin)
+        registry.remove_from_category(mixin, entity, extras)
 
 
 def get_entities_under_path(path, registry, extras):
@@ -282,18 +679,117 @@ def get_entities_under_path(path, registry, extras):
     registry -- The registry used for this process.
     extras -- Any extra arguments which are defined by the user.
     '''
-    result = []
-    if registry.get_category(path, extras) is None:
-        for res in registry.get_resources(extras):
-            if not res.identifier.find(path):
-                result.append(res)
-        return result
+    cat = registry.get_category(path, extras)
+    if cat is None:
+        return registry.get_resources_under_path(path, extras)
     else:
-        cat = registry.get_category(path, extras)
-        for res in registry.get_resources(extras):
-            if cat == res.kind or cat in res.mixins:
-                result.append(res)
-        return result
+        return registry.get_resources_by_category(cat, extras)
+
+
+def filter_entities_under_path(path, categories, attributes, registry,
+                               extras):
+    '''
+    Returns the entities under a path which match the given categories and
+    attributes - same as filter_entities on get_entities_under_path.
+
+    If the registry indexes all the filtered attributes the matches are
+    looked up in the index instead of scoring every entity under the path.
+
+    path -- The path under which to look...
+    categories -- Categories which must be present in the entity.
+    attributes -- Attributes which must match with the entity's attrs.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    matches = collections.OrderedDict()
+    for name, value in attributes.items():
+        items = registry.get_resources_by_attribute(name, value, extras)
+        if items is None:
+            matches = None
+            break
+        for item in items:
+            matches.setdefault(item.identifier, [item, 0])[1] += 1
+    if matches is None or not attributes:
+        entities = get_entities_under_path(path, registry, extras)
+        return filter_entities(entities, categories, attributes)
+
+    cat = registry.get_category(path, extras)
+    result = []
+    for entity, count in matches.values():
+        if cat is None and entity.identifier.find(path):
+            continue
+        if cat is not None and cat != entity.kind and \
+                cat not in entity.mixins:
+            continue
+        # same scoring as in filter_entities.
+        if not categories:
+            if count == 1:
+                result.append(entity)
+        elif count >= 2 or entity.kind in categories or \
+                len(intersect(categories, entity.mixins)):
+            result.append(entity)
+    return result
+
+
+def get_page(path, categories, attributes, limit, cursor, registry,
+             extras):
+    '''
+    Returns one page of the entities under a path which match the given
+    categories and attributes, and the cursor of the next page (None on the
+    last page).
+
+    The registry seeks to the cursor, so earlier pages are not looked at;
+    entities added after a page was returned show up on a later page.
+
+    path -- The path under which to look...
+    categories -- Categories which must be present in the entity.
+    attributes -- Attributes which must match with the entity's attrs.
+    limit -- Maximum number of entities on the page (None for all).
+    cursor -- The cursor returned with the previous page (None for the
+              first page).
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    cat = registry.get_category(path, extras)
+    position = None if cursor is None else decode_cursor(cursor)
+    result = []
+    while True:
+        # one more than needed tells if there is a next page.
+        count = None if limit is None else limit + 1 - len(result)
+        items = registry.get_resources_after(cat, path, position, count,
+                                             extras)
+        for item_position, entity in items:
+            if filter_entities([entity], categories, attributes):
+                result.append((item_position, entity))
+        if count is None or len(items) < count or len(result) > limit:
+            break
+        position = items[-1][0]
+
+    if limit is not None and len(result) > limit:
+        return [entity for _, entity in result[:limit]], \
+            encode_cursor(result[limit - 1][0])
+    return [entity for _, entity in result], None
+
+
+def encode_cursor(position):
+    '''
+    Returns the opaque cursor for a position in a listing of the registry.
+
+    position -- The position as returned by the registry.
+    '''
+    return binascii.hexlify(position.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    '''
+    Returns the position in a listing of the registry a cursor points to.
+
+    cursor -- The cursor as returned by encode_cursor.
+    '''
+    try:
+        return str(binascii.unhexlify(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError):
+        raise AttributeError('Invalid cursor: ' + cursor)
 
 
 def filter_entities(entities, categories, attributes):
@@ -398,16 +894,417 @@ def remove_mixins(mixins, registry, extras):
             raise HTTPError(403, 'This Mixin cannot be deleted!')
 
         entities = get_entities_under_path(mixin.location, registry, extras)
+        get_retrieve_cache(registry).invalidate(entities)
         for entity in entities:
             entity.mixins.remove(mixin)
+            registry.remove_from_category(mixin, entity, extras)
         registry.delete_mixin(mixin, extras)
         del mixin
 
+#==============================================================================
+# Retrieve cache
+#==============================================================================
+
+
+class RetrieveCache(object):
+    '''
+    Remembers when entities were last retrieved from their backends so
+    retrieve_entity can skip entities which are still fresh (see
+    Registry.get_freshness). Counts hits (skipped) and misses (retrieved).
+
+    Only entities whose kind has a freshness are remembered - by weak
+    reference (so the cache does not keep them alive) and at most max_size
+    of them, the least recently retrieved are dropped first.
+
+    Also keeps track of the retrieves in flight so concurrent retrieves of
+    the same entity are coalesced - counted as coalesced.
+    '''
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, max_size=RETRIEVE_CACHE_SIZE):
+        self.max_size = max_size
+        self._retrieved = collections.OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def take_off(self, entity, links=True):
+        '''
+        Starts a retrieve of the entity. Returns None if the caller should
+        do the retrieve (and call land afterwards) - otherwise the flight
+        already under way, which the caller should wait for.
+
+        Retrieves with and without the links are separate flights.
+
+        entity -- The entity.
+        links -- If the links are retrieved as well.
+        '''
+        key = (entity.identifier, links)
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.entity is entity:
+                self.coalesced += 1
+                return flight
+            self._flights[key] = _Flight(entity)
+            return None
+
+    def land(self, entity, error, links=True):
+        '''
+        Finishes a retrieve started with take_off and wakes up the waiting
+        callers.
+
+        entity -- The entity.
+        error -- The error raised by the retrieve (None on success).
+        links -- If the links were retrieved as well.
+        '''
+        key = (entity.identifier, links)
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None or flight.entity is not entity:
+                return
+            self._flights.pop(key)
+        flight.finish(error)
+
+    def is_fresh(self, entity, registry):
+        '''
+        Returns True if the entity was retrieved recently enough.
+
+        entity -- The entity.
+        registry -- The registry used for this process.
+        '''
+        ttl = registry.get_freshness(entity.kind)
+        with self._lock:
+            item = self._retrieved.get(entity.identifier)
+            if ttl is not None and item is not None and \
+                    item[0]() is entity and self.clock() - item[1] < ttl:
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def retrieved(self, entities, registry):
+        '''
+        Notes that the entities were just retrieved.
+
+        entities -- The entities.
+        registry -- The registry used for this process.
+        '''
+        entities = [entity for entity in entities
+                    if registry.get_freshness(entity.kind) is not None]
+        if not entities:
+            return
+        now = self.clock()
+        with self._lock:
+            for entity in entities:
+                self._retrieved.pop(entity.identifier, None)
+                self._retrieved[entity.identifier] = (weakref.ref(entity),
+                                                      now)
+            while len(self._retrieved) > self.max_size:
+                self._retrieved.popitem(last=False)
+
+    def __len__(self):
+        return len(self._retrieved)
+
+    def invalidate(self, entities):
+        '''
+        Forgets when the entities were retrieved - called whenever the
+        workflow changes them.
+
+        entities -- The entities.
+        '''
+        with self._lock:
+            for entity in entities:
+                self._retrieved.pop(entity.identifier, None)
+
+    def get_hit_rate(self):
+        '''
+        Returns the share of retrieves which were skipped.
+        '''
+        total = self.hits + self.misses
+        if not total:
+            return 0.0
+        return float(self.hits) / total
+
+
+class _Flight(object):
+    '''
+    A retrieve in flight.
+    '''
+
+    def __init__(self, entity):
+        self.entity = entity
+        self.error = None
+        self.done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def wait(self):
+        '''
+        Waits for the retrieve to finish.
+        '''
+        self.done.wait()
+
+    def add_done_callback(self, callback):
+        '''
+        Calls the callback (without arguments) once the retrieve finished -
+        right away if it already did. Lets waiters which must not block
+        (e.g. coroutines) wait for the flight.
+
+        callback -- The callback.
+        '''
+        with self._lock:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def finish(self, error):
+        '''
+        Marks the retrieve as finished and wakes up the waiters.
+
+        error -- The error raised by the retrieve (None on success).
+        '''
+        with self._lock:
+            self.error = error
+            self.done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+def get_retrieve_cache(registry):
+    '''
+    Returns the retrieve cache of a registry.
+
+    registry -- The registry.
+    '''
+    with _RETRIEVE_CACHES_LOCK:
+        if registry not in _RETRIEVE_CACHES:
+            _RETRIEVE_CACHES[registry] = RetrieveCache()
+        return _RETRIEVE_CACHES[registry]
+
 #==============================================================================
 # Convenient stuff
 #==============================================================================
 
 
+def get_fingerprint(entity):
+    '''
+    Returns a hash over everything which is rendered for an entity - used to
+    tell if the backends changed it. Values which are changed in place are
+    only noticed if their repr changes.
+
+    entity -- The entity.
+    '''
+    # categories are shared instances - their identity is enough.
+    categories = [id(entity.kind)]
+    categories.extend(id(mixin) for mixin in entity.mixins)
+    categories.append(None)
+    categories.extend(id(action) for action in entity.actions)
+    # FUTURE_IMPROVEMENT: string links
+    related = [getattr(link, 'identifier', link)
+               for link in getattr(entity, 'links', [])]
+    related.append(getattr(getattr(entity, 'source', None), 'identifier',
+                           None))
+    related.append(getattr(getattr(entity, 'target', None), 'identifier',
+                           None))
+    attributes = [item for item in entity.attributes.items()
+                  if item[0] not in _DERIVED_ATTRIBUTES]
+    return hash((tuple(categories), tuple(related),
+                 repr((entity.title, getattr(entity, 'summary', None),
+                       attributes))))
+
+
+def group_by_backend(entities, registry, extras):
+    '''
+    Returns a list of backends and the entities they are responsible for -
+    in the order they are first encountered.
+
+    entities -- The entities.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    groups = collections.OrderedDict()
+    for entity in entities:
+        for backend in registry.get_all_backends(entity, extras):
+            groups.setdefault(backend, []).append(entity)
+    return list(groups.items())
+
+
+class BackendCalls(object):
+    '''
+    Independent backend routines a workflow routine waits for - each call
+    is the routine followed by its arguments.
+
+    The *_steps routines yield them and the caller of the steps decides how
+    they are called (see run_steps). Once all calls finished the steps are
+    sent the result of each call - or, unless errors is set, the error of
+    the first failed call (in the given order) is raised in them.
+    '''
+
+    def __init__(self, calls, errors=False):
+        self.calls = calls
+        self.errors = errors
+
+    def outcome(self, results):
+        '''
+        Returns what is sent to the steps.
+
+        results -- The result of each call - the error if it failed.
+        '''
+        if not self.errors:
+            for item in results:
+                if isinstance(item, Exception):
+                    raise item
+        return results
+
+
+def run_steps(steps, registry):
+    '''
+    Runs the steps of a workflow routine - the backend routines they yield
+    are called using call_backends. Returns the last value the steps yield
+    which is no BackendCalls (None if there is none).
+
+    steps -- The steps (generator) of the routine.
+    registry -- The registry used for this process.
+    '''
+    outcome = error = None
+    while True:
+        try:
+            if error is None:
+                request = steps.send(outcome)
+            else:
+                request = steps.throw(error)
+        except StopIteration:
+            return None
+        if not isinstance(request, BackendCalls):
+            steps.close()
+            return request
+        try:
+            outcome, error = call_backends(request, registry), None
+        except Exception as err:  # pylint: disable=W0703
+            outcome, error = None, err
+
+
+def call_backends(request, registry):
+    '''
+    Calls a group of independent backend routines and returns their
+    outcome (see BackendCalls.outcome).
+
+    Without an executor in the registry they are called one after another
+    - stopping at the first failed call unless all errors are requested.
+    Otherwise all of them are submitted at once and this waits for all of
+    them to finish - so no backend is still running when an error is
+    raised.
+
+    Raises a TypeError if a routine returned a coroutine - async backends
+    only run in the EventLoopWorkflow (see occi.asynchronous).
+
+    request -- The BackendCalls.
+    registry -- The registry used for this process.
+    '''
+    executor = registry.get_executor()
+    results = []
+    if executor is None or len(request.calls) < 2:
+        for call in request.calls:
+            try:
+                results.append(call[0](*call[1:]))
+            except Exception as err:  # pylint: disable=W0703
+                if not request.errors:
+                    raise
+                results.append(err)
+            _check_results(results[-1:])
+        return request.outcome(results)
+
+    futures = [executor.submit(*call) for call in request.calls]
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as err:  # pylint: disable=W0703
+            results.append(err)
+    _check_results(results)
+    return request.outcome(results)
+
+
+def _check_results(results):
+    '''
+    Raises a TypeError if backend routines returned coroutines (which are
+    closed without running).
+
+    results -- The results of the backend routines.
+    '''
+    awaitables = [item for item in results if _IS_AWAITABLE(item)]
+    for item in awaitables:
+        if hasattr(item, 'close'):
+            item.close()
+    if awaitables:
+        raise TypeError('The backend is asynchronous - set an'
+                        ' EventLoopWorkflow as workflow of the registry.')
+
+
+def reserve_links(links, registry, extras):
+    '''
+    Reserves the ids of links which are about to be created - so concurrent
+    creates cannot add the same link while the backends of the links run.
+    Raises an AttributeError if an id is taken. Returns the reserved ids
+    (see release_links).
+
+    links -- The links.
+    registry -- The registry used for this process.
+    extras -- Any extra arguments which are defined by the user.
+    '''
+    with _RESERVED_LOCK:
+        reserved = _RESERVED.setdefault(registry, set())
+    keys = [link.identifier for link in links]
+    locks = _acquire([registry.get_lock(item) for item in keys])
+    try:
+        for i, item in enumerate(keys):
+            if item in keys[:i] or item in reserved or \
+                    registry.has_resource(item, extras):
+                raise AttributeError('A link with that id is already'
+                                     ' present')
+        reserved.update(keys)
+    finally:
+        _release(locks)
+    return keys
+
+
+def release_links(keys, registry):
+    '''
+    Releases the ids reserved by reserve_links.
+
+    keys -- The reserved ids.
+    registry -- The registry used for this process.
+    '''
+    _RESERVED[registry].difference_update(keys)
+
+
+def _acquire(locks):
+    '''
+    Enters a set of locks - always in the same order to avoid deadlocks.
+
+    locks -- The locks (context managers).
+    '''
+    result = []
+    for lock in sorted(set(locks), key=id):
+        lock.__enter__()
+        result.append(lock)
+    return result
+
+
+def _release(locks):
+    '''
+    Leaves the locks entered by _acquire.
+
+    locks -- The locks.
+    '''
+    for lock in reversed(locks):
+        lock.__exit__(None, None, None)
+
+
 def create_id(kind):
     '''
     Create a key with the hierarchy of the entity encapsulated.
@@ -431,11 +1328,33 @@ def intersect(list_a, list_b):
         return list()
 
 
+def unique_items(items):
+    '''
+    Returns the items without duplicates - in their original order.
+
+    items -- The items.
+    '''
+    seen = set()
+    result = []
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            result.append(item)
+    return result
+
+
 def unique(list_a, list_b):
     '''
     Returns a list of elements which are only in list_a.
 
+    Membership is checked in a set so this is linear - unless the items
+    are not hashable.
+
     list_a -- The list to look into for unique elements.
     list_b -- Ths list the verify against.
     '''
-    return [item for item in list_a if item not in list_b]
+    try:
+        lookup = set(list_b)
+    except TypeError:
+        lookup = list_b
+    return [item for item in list_a if item not in lookup]
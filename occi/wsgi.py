@@ -34,17 +34,22 @@ from occi.backend import KindBackend, MixinBackend, ActionBackend
 from occi.exceptions import HTTPError
 from occi.handlers import QUERY_STRING
 from occi.handlers import QueryHandler, CollectionHandler, ResourceHandler, \
-    CATEGORY, LINK, ATTRIBUTE, LOCATION, ACCEPT, CONTENT_TYPE
+    RequestContext, CATEGORY, LINK, ATTRIBUTE, LOCATION, ACCEPT, \
+    CONTENT_TYPE, IF_NONE_MATCH
 from occi.protocol.html_rendering import HTMLRendering
 from occi.protocol.json_rendering import JsonRendering
 from occi.protocol.occi_rendering import TextOcciRendering, \
     TextPlainRendering, TextUriListRendering
 from occi.registry import NonePersistentRegistry
-import StringIO
+import itertools
 import logging
+import threading
+import time
+import zlib
 
 RETURN_CODES = {201: '201 Created',
                 200: '200 OK',
+                304: '304 Not Modified',
                 400: '400 Bad Request',
                 403: '403 Forbidden',
                 404: '404 Not Found',
@@ -53,6 +58,16 @@ RETURN_CODES = {201: '201 Created',
                 500: '500 Internal Server Error',
                 501: '501 Not implemented'}
 
+# content codings in order of preference.
+CODINGS = ('gzip', 'deflate')
+
+# bodies of these types are sent at once - others are iterables of chunks.
+TEXT_TYPES = (bytes, type(u''))
+
+# clock measuring the CPU time spent compressing - per thread where possible.
+CPU_CLOCK = getattr(time, 'thread_time', None) or \
+    getattr(time, 'process_time', None) or time.clock
+
 
 def _parse_headers(environ):
     '''
@@ -78,6 +93,8 @@ def _parse_headers(environ):
         headers[ACCEPT] = environ.get('HTTP_ACCEPT')
     if 'CONTENT_TYPE' in environ.keys():
         headers[CONTENT_TYPE] = environ.get('CONTENT_TYPE')
+    if 'HTTP_IF_NONE_MATCH' in environ.keys():
+        headers[IF_NONE_MATCH] = environ.get('HTTP_IF_NONE_MATCH')
     if 'QUERY_STRING' in environ.keys():
         headers[QUERY_STRING] = environ.get('QUERY_STRING')
 
@@ -92,10 +109,13 @@ def _parse_body(environ):
     '''
     try:
         length = int(environ.get('CONTENT_LENGTH', '0'))
-        body = StringIO.StringIO(environ['wsgi.input'].read(length))
-        return body.getvalue()
+        body = environ['wsgi.input'].read(length)
     except (KeyError, ValueError):
         return ''
+    if not isinstance(body, str):
+        # Python 3 - the handlers work on text.
+        body = body.decode('utf-8')
+    return body
 
 
 def _parse_query(environ):
@@ -115,12 +135,23 @@ def _parse_query(environ):
     return query
 
 
-def _set_hostname(environ, registry):
+def _to_bytes(data):
+    '''
+    Returns a body (or a chunk of it) as bytes as WSGI demands - text is
+    UTF-8 encoded.
+
+    data -- The body or chunk.
+    '''
+    if isinstance(data, bytes):
+        return data
+    return data.encode('utf-8')
+
+
+def _get_hostname(environ):
     '''
-    Set the hostname of the service.
+    Returns the hostname of the service as seen by the client.
 
     environ -- The WSGI environ.
-    registry -- The OCCI registry.
     '''
     scheme = environ.get("wsgi.url_scheme")
     host = scheme + "://"
@@ -131,7 +162,155 @@ def _set_hostname(environ, registry):
         # WSGI - could be that HTTP_HOST is not available...
         host += environ.get('SERVER_NAME') + ':'
         host += environ.get('SERVER_PORT')
-    registry.set_hostname(host)
+    return host
+
+
+def _get_coding(header):
+    '''
+    Returns the content coding (see CODINGS) the client prefers according to
+    an Accept-Encoding header - None if the body should not be compressed.
+
+    Codings with a quality of 0 are refused, the wildcard stands for all
+    codings not named and ties are broken by the order of CODINGS.
+
+    header -- The raw Accept-Encoding header.
+    '''
+    qualities = {}
+    for item in header.split(','):
+        coding, _, param = item.partition(';')
+        quality = 1.0
+        name, _, value = param.partition('=')
+        if name.strip() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    if 'x-gzip' in qualities:
+        qualities.setdefault('gzip', qualities['x-gzip'])
+
+    wildcard = qualities.get('*', 0.0)
+    quality, _, coding = max((qualities.get(item, wildcard), -i, item)
+                             for i, item in enumerate(CODINGS))
+    if quality <= 0 or qualities.get('identity', 0.0) > quality:
+        return None
+    return coding
+
+
+class Compression(object):
+    '''
+    Compresses response bodies with the content coding the client accepts.
+    Bodies smaller than the threshold are sent as they are - streamed bodies
+    are compressed chunk by chunk once their first chunks reach it.
+
+    Counts the compressed responses, their size before (bytes_in) and after
+    (bytes_out) compression and the CPU time spent compressing.
+    '''
+
+    clock = staticmethod(CPU_CLOCK)
+
+    def __init__(self, threshold=1024, level=6):
+        '''
+        threshold -- Minimal size of the bodies to compress (None disables
+                     compression).
+        level -- The zlib compression level (1 fast - 9 small).
+        '''
+        self.threshold = threshold
+        self.level = level
+        self._lock = threading.Lock()
+        self.responses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_time = 0.0
+
+    def encode(self, accept_encoding, headers, body):
+        '''
+        Returns the body - compressed when the client accepts one of the
+        CODINGS and the body is large enough. Sets the Content-Encoding and
+        Vary headers accordingly.
+
+        accept_encoding -- The Accept-Encoding header of the request (or
+                           None).
+        headers -- The headers of the response.
+        body -- The body as string or an iterable of chunks.
+        '''
+        if self.threshold is None:
+            return body
+        headers['Vary'] = 'Accept-Encoding'
+        if accept_encoding is None:
+            return body
+        coding = _get_coding(accept_encoding)
+        if coding is None:
+            return body
+
+        if not isinstance(body, TEXT_TYPES):
+            # collect the first chunks - small bodies end up buffered.
+            chunks = iter(body)
+            head = []
+            size = 0
+            for chunk in chunks:
+                head.append(chunk)
+                size += len(chunk)
+                if size >= self.threshold:
+                    break
+            else:
+                body = ''.join(head)
+            if size >= self.threshold:
+                headers['Content-Encoding'] = coding
+                return self._compress_chunks(coding,
+                                             itertools.chain(head, chunks))
+
+        if len(body) < self.threshold:
+            return body
+        headers['Content-Encoding'] = coding
+        return b''.join(self._compress_chunks(coding, [body]))
+
+    def _compress_chunks(self, coding, chunks):
+        '''
+        Compresses the chunks - counting them once done (or aborted).
+
+        coding -- The content coding.
+        chunks -- The chunks of the body.
+        '''
+        start = self.clock()
+        if coding == 'gzip':
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+        else:
+            compressor = zlib.compressobj(self.level)
+        cpu_time = self.clock() - start
+        size_in = size_out = 0
+        try:
+            for chunk in chunks:
+                if not isinstance(chunk, bytes):
+                    chunk = chunk.encode('utf-8')
+                start = self.clock()
+                data = compressor.compress(chunk)
+                cpu_time += self.clock() - start
+                size_in += len(chunk)
+                if data:
+                    size_out += len(data)
+                    yield data
+            start = self.clock()
+            data = compressor.flush()
+            cpu_time += self.clock() - start
+            size_out += len(data)
+            yield data
+        finally:
+            with self._lock:
+                self.responses += 1
+                self.bytes_in += size_in
+                self.bytes_out += size_out
+                self.cpu_time += cpu_time
+
+    def get_ratio(self):
+        '''
+        Returns the size of the compressed bodies relative to their original
+        size.
+        '''
+        if not self.bytes_in:
+            return 1.0
+        return float(self.bytes_out) / self.bytes_in
 
 
 class Application(object):
@@ -142,7 +321,12 @@ class Application(object):
     # disabling 'Too few public methods' pylint check (given by WSGI)
     # pylint: disable=R0903
 
-    def __init__(self, registry=None, renderings=None):
+    def __init__(self, registry=None, renderings=None,
+                 compression_threshold=1024, compression_level=6):
+        # compress large bodies (see Compression)
+        self.compression = Compression(compression_threshold,
+                                       compression_level)
+
         # set default registry
         if registry is None:
             self.registry = NonePersistentRegistry()
@@ -213,19 +397,23 @@ class Application(object):
         # parse query
         query = _parse_query(environ)
 
-        _set_hostname(environ, self.registry)
+        # the request's own state - the registry is shared.
+        context = RequestContext(self.registry, _get_hostname(environ), heads,
+                                 extras)
 
         # find right handler
         if environ['PATH_INFO'] == '/-/':
-            handler = QueryHandler(self.registry, heads, body, query, extras)
+            handler = QueryHandler(self.registry, heads, body, query, extras,
+                                   context)
         elif environ['PATH_INFO'] == '/.well-known/org/ogf/occi/-/':
-            handler = QueryHandler(self.registry, heads, body, query, extras)
+            handler = QueryHandler(self.registry, heads, body, query, extras,
+                                   context)
         elif environ['PATH_INFO'].endswith('/'):
             handler = CollectionHandler(self.registry, heads, body, query,
-                                        extras)
+                                        extras, context)
         else:
             handler = ResourceHandler(self.registry, heads, body, query,
-                                      extras)
+                                      extras, context)
 
         # call handler
         mtd = environ['REQUEST_METHOD']
@@ -242,14 +430,24 @@ class Application(object):
 
         # send
         headers['Server'] = VERSION
-        headers['Content-length'] = str(len(body))
+        if status in (200, 201):
+            body = self.compression.encode(
+                environ.get('HTTP_ACCEPT_ENCODING'), headers, body)
+        streamed = not isinstance(body, TEXT_TYPES)
+        if not streamed:
+            body = _to_bytes(body)
+            if status != 304:
+                headers['Content-length'] = str(len(body))
 
         code = RETURN_CODES[status]
 
         # headers.items() because we need a list of sets...& unicode handling
         # for wsgi since it is not supported :-/
         response(code, [(str(k), str(v)) for k, v in headers.items()])
-        return [str(body), ]
+        if streamed:
+            # no Content-Length - the server sends the chunks as they come.
+            return (_to_bytes(item) for item in body)
+        return [body, ]
 
     def __call__(self, environ, response):
         '''
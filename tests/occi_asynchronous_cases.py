@@ -0,0 +1,399 @@
+# coding=utf-8
+#
+# Copyright (C) 2010-2012 Platform Computing
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+'''
+Tests the asynchronous module - imported by occi_asynchronous_test on
+Python 3.5 or later only, as coroutines are no valid syntax before.
+
+Created on Oct 18, 2012
+
+@author: tmetsch
+'''
+
+# disabling 'Invalid name' pylint check (unittest's fault)
+# disabling 'Too many public methods' pylint check (unittest's fault)
+# pylint: disable=C0103,R0904
+
+from occi import asynchronous
+from occi import workflow
+from occi.backend import KindBackend
+from occi.core_model import Resource, Kind, Link, Action, Mixin
+from occi.extensions.infrastructure import COMPUTE
+from occi.registry import NonePersistentRegistry
+from occi.wsgi import Application
+from tests import occi_handlers_test as handlers_test
+import asyncio
+import threading
+import time
+import unittest
+
+
+class SleepyBackend(asynchronous.AsyncMixinBackend,
+                    asynchronous.AsyncActionBackend):
+    '''
+    Async backend which simulates a slow call - and records the calls.
+    '''
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    async def create(self, entity, extras):
+        await asyncio.sleep(self.delay)
+        self.calls.append(('create', entity.identifier))
+
+    async def retrieve(self, entity, extras):
+        await asyncio.sleep(self.delay)
+        self.calls.append(('retrieve', entity.identifier))
+
+    async def delete(self, entity, extras):
+        await asyncio.sleep(self.delay)
+        self.calls.append(('delete', entity.identifier))
+
+    async def update(self, old, new, extras):
+        old.attributes.update(new.attributes)
+        self.calls.append(('update', old.identifier))
+
+    async def action(self, entity, action, attributes, extras):
+        await asyncio.sleep(self.delay)
+        if 'broken' in entity.attributes:
+            raise AttributeError('broken')
+        self.calls.append(('action', entity.identifier))
+
+
+class ThreadBackend(KindBackend):
+    '''
+    Synchronous backend which records the threads it is called in.
+    '''
+
+    def __init__(self):
+        self.threads = []
+
+    def create(self, entity, extras):
+        self.threads.append(threading.current_thread())
+
+    def retrieve(self, entity, extras):
+        time.sleep(0.05)
+        self.threads.append(threading.current_thread())
+
+
+class AsyncWorkflowTest(unittest.TestCase):
+    '''
+    Tests the coroutine versions of the workflow routines.
+    '''
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.registry = NonePersistentRegistry()
+        self.kind = Kind('http://example.com#', 'compute')
+        self.link_kind = Kind('http://example.com#', 'link')
+        self.mixin = Mixin('http://example.com#', 'mixin')
+        self.action = Action('http://example.com#', 'start')
+        self.backend = SleepyBackend()
+        for category in [self.kind, self.link_kind, self.mixin, self.action]:
+            self.registry.set_backend(category, self.backend, None)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _run(self, coroutine):
+        '''
+        Runs a coroutine on the loop.
+        '''
+        return self.loop.run_until_complete(coroutine)
+
+    def _run_all(self, coroutines):
+        '''
+        Runs coroutines at the same time on the loop.
+        '''
+        async def run_all():
+            '''
+            Awaits all coroutines.
+            '''
+            return await asyncio.gather(*coroutines)
+        return self._run(run_all())
+
+    def _resource(self, key, links=0):
+        '''
+        Creates a resource with links through the async workflow.
+        '''
+        res = Resource(None, self.kind, [self.mixin], [])
+        res.links = [Link(None, self.link_kind, [], res, res)
+                     for _ in range(links)]
+        self._run(asynchronous.create_entity(key, res, self.registry, None))
+        return res
+
+    def test_lifecycle_for_sanity(self):
+        '''
+        Test create, retrieve, update, action and delete.
+        '''
+        res = self._resource('/compute/1', 2)
+        self.assertEqual(len(self.registry.get_resources(None)), 3)
+        self.assertEqual(len(self.backend.calls), 3)
+
+        self._run(asynchronous.retrieve_entity(res, self.registry, None))
+        self.assertEqual(len(self.backend.calls), 6)
+
+        new = Resource(None, self.kind, [], [])
+        new.attributes = {'foo': 'bar'}
+        self._run(asynchronous.update_entity(res, new, self.registry, None))
+        self.assertEqual(res.attributes['foo'], 'bar')
+
+        self._run(asynchronous.action_entity(res, self.action, self.registry,
+                                             {}, None))
+        self.assertIn(('action', '/compute/1'), self.backend.calls)
+
+        self._run(asynchronous.delete_entity(res, self.registry, None))
+        self.assertEqual(self.registry.get_resources(None), [])
+
+    def test_create_entity_for_failure(self):
+        '''
+        Test that duplicate link ids are refused.
+        '''
+        self._resource('/compute/1')
+        res = Resource(None, self.kind, [], [])
+        res.links = [Link('/compute/1', self.link_kind, [], res, res)]
+        self.assertRaises(AttributeError, self._run,
+                          asynchronous.create_entity('/compute/2', res,
+                                                     self.registry, None))
+
+    def test_concurrency_for_sanity(self):
+        '''
+        Test that slow backends of many entities are awaited at the same
+        time.
+        '''
+        self.backend.delay = 0.1
+        resources = [Resource(None, self.kind, [], []) for _ in range(100)]
+        start = time.time()
+        self._run_all([asynchronous.create_entity('/compute/' + str(i), res,
+                                                  self.registry, None)
+                       for i, res in enumerate(resources)])
+        self.assertTrue(time.time() - start < 2)
+        self.assertEqual(len(self.registry.get_resources(None)), 100)
+
+    def test_action_collection_for_sanity(self):
+        '''
+        Test per entity errors of a collection action.
+        '''
+        resources = [self._resource('/compute/' + str(i)) for i in range(5)]
+        resources[2].attributes['broken'] = '1'
+        errors = self._run(asynchronous.action_collection(
+            resources, self.action, self.registry, {}, None))
+        self.assertEqual([error is None for error in errors],
+                         [True, True, False, True, True])
+
+    def test_collections_for_sanity(self):
+        '''
+        Test the collection routines and the bulk delete.
+        '''
+        other = Mixin('http://example.com#', 'other')
+        self.registry.set_backend(other, self.backend, None)
+        resources = [self._resource('/compute/' + str(i), 1)
+                     for i in range(4)]
+
+        self._run(asynchronous.update_collection(other, [], resources[:2],
+                                                 self.registry, None))
+        self._run(asynchronous.replace_collection(other, resources[:2],
+                                                  resources[1:3],
+                                                  self.registry, None))
+        self.assertEqual([other in res.mixins for res in resources],
+                         [False, True, True, False])
+        self._run(asynchronous.delete_from_collection(other, resources[1:3],
+                                                      self.registry, None))
+        self.assertFalse(any(other in res.mixins for res in resources))
+
+        self._run(asynchronous.delete_entities(resources, self.registry,
+                                               None))
+        self.assertEqual(self.registry.get_resources(None), [])
+
+    def test_thread_adapter_for_sanity(self):
+        '''
+        Test that synchronous backends run outside of the loop's thread.
+        '''
+        backend = ThreadBackend()
+        self.registry.set_backend(self.kind, backend, None)
+        res = Resource(None, self.kind, [], [])
+        self._run(asynchronous.create_entity('/compute/1', res, self.registry,
+                                             None))
+        self.assertNotEqual(backend.threads, [])
+        self.assertNotIn(threading.current_thread(), backend.threads)
+
+    def test_sync_workflow_for_failure(self):
+        '''
+        Test that the synchronous workflow refuses async backends instead of
+        dropping their coroutines.
+        '''
+        res = Resource(None, self.kind, [], [])
+        self.assertRaises(TypeError, workflow.create_entity, '/compute/1',
+                          res, self.registry, None)
+        self.assertFalse(self.registry.has_resource('/compute/1', None))
+
+        self._resource('/compute/2')
+        res = self.registry.get_resource('/compute/2', None)
+        self.assertRaises(TypeError, workflow.delete_entity, res,
+                          self.registry, None)
+        self.assertTrue(self.registry.has_resource('/compute/2', None))
+        self.assertRaises(TypeError, workflow.action_collection, [res],
+                          self.action, self.registry, {}, None)
+        self.assertEqual(self.backend.calls, [('create', '/compute/2')])
+
+    def test_single_flight_for_sanity(self):
+        '''
+        Test that concurrent retrieves share one backend call.
+        '''
+        backend = ThreadBackend()
+        self.registry.set_backend(self.kind, backend, None)
+        res = Resource('/compute/1', self.kind, [], [])
+        self.registry.add_resource(res.identifier, res, None)
+        self._run_all([asynchronous.retrieve_entity(res, self.registry, None)
+                       for _ in range(10)])
+        self.assertEqual(len(backend.threads), 1)
+        self.assertEqual(workflow.get_retrieve_cache(self.registry).coalesced,
+                         9)
+
+
+class EventLoopWorkflowTest(unittest.TestCase):
+    '''
+    Tests running the workflow from threads on an event loop.
+    '''
+
+    def setUp(self):
+        self.workflow = asynchronous.EventLoopWorkflow()
+
+    def tearDown(self):
+        self.workflow.close()
+
+    def test_routines_for_sanity(self):
+        '''
+        Test that routines run as coroutines or come from the workflow.
+        '''
+        registry = NonePersistentRegistry()
+        kind = Kind('http://example.com#', 'compute', location='/compute/')
+        backend = SleepyBackend()
+        registry.set_backend(kind, backend, None)
+        res = Resource(None, kind, [], [])
+        self.workflow.create_entity('/compute/1', res, registry, None)
+        self.assertEqual(backend.calls, [('create', '/compute/1')])
+        self.assertEqual(self.workflow.get_entities_under_path,
+                         workflow.get_entities_under_path)
+        self.assertEqual(self.workflow.get_entities_under_path(
+            '/compute/', registry, None), [res])
+
+
+class ApplicationTest(unittest.TestCase):
+    '''
+    Tests the WSGI application with the workflow on an event loop.
+    '''
+
+    def setUp(self):
+        self.registry = NonePersistentRegistry()
+        self.registry.workflow = asynchronous.EventLoopWorkflow()
+        self.app = Application(registry=self.registry)
+        self.backend = SleepyBackend(0.2)
+        self.app.register_backend(COMPUTE, self.backend)
+
+    def tearDown(self):
+        self.registry.workflow.close()
+
+    def _call(self, method, path, **headers):
+        '''
+        Calls the application - returns status and body.
+        '''
+        environ = {'SERVER_NAME': 'foo',
+                   'SERVER_PORT': '8888',
+                   'wsgi.url_scheme': 'http',
+                   'PATH_INFO': path,
+                   'REQUEST_METHOD': method,
+                   'HTTP_ACCEPT': 'text/plain'}
+        environ.update(headers)
+        status = []
+        body = self.app(environ, lambda code, heads: status.append(code))
+        return status[0], b''.join(body)
+
+    def test_requests_for_sanity(self):
+        '''
+        Test that requests reach the async backend - concurrent requests
+        wait for it at the same time.
+        '''
+        category = 'compute; scheme="' + COMPUTE.scheme + '"; class="kind"'
+        for i in range(5):
+            status, _ = self._call('PUT', '/compute/' + str(i),
+                                   CONTENT_TYPE='text/occi',
+                                   HTTP_CATEGORY=category)
+            self.assertEqual(status, '201 Created')
+
+        results = []
+        threads = [threading.Thread(target=lambda key=key: results.append(
+            self._call('GET', key))) for key in
+            ['/compute/' + str(i) for i in range(5)]]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(time.time() - start < 0.8)
+        self.assertEqual([status for status, _ in results], ['200 OK'] * 5)
+        self.assertTrue(all(b'compute' in body for _, body in results))
+
+        status, _ = self._call('DELETE', '/compute/0')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(sorted(self.backend.calls)[:3],
+                         [('create', '/compute/' + str(i)) for i in range(3)])
+        self.assertIn(('delete', '/compute/0'), self.backend.calls)
+        self.assertEqual(len([call for call in self.backend.calls
+                              if call[0] == 'retrieve']), 5)
+
+
+class EventLoopRegistry(NonePersistentRegistry):
+    '''
+    Registry whose handlers run the workflow on an event loop.
+    '''
+
+    workflow = asynchronous.EventLoopWorkflow()
+
+
+class AsyncQueryCapabilitesTest(handlers_test.TestQueryCapabilites):
+    '''
+    Runs the query handler tests on an event loop.
+    '''
+
+    registry = EventLoopRegistry()
+
+
+class AsyncCollectionCapabilitesTest(handlers_test.TestCollectionCapabilites):
+    '''
+    Runs the collection handler tests on an event loop.
+    '''
+
+    registry = EventLoopRegistry()
+
+
+class AsyncResourceCapabilitesTest(handlers_test.TestResourceCapabilites):
+    '''
+    Runs the resource handler tests on an event loop.
+    '''
+
+    registry = EventLoopRegistry()
+
+
+class AsyncLinkHandlingTest(handlers_test.TestLinkHandling):
+    '''
+    Runs the link handling tests on an event loop.
+    '''
+
+    registry = EventLoopRegistry()
@@ -0,0 +1,37 @@
+# coding=utf-8
+#
+# Copyright (C) 2010-2012 Platform Computing
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+'''
+Tests the asynchronous module - the tests live in occi_asynchronous_cases
+which needs Python 3.5 or later; older versions skip them.
+
+Created on Oct 18, 2012
+
+@author: tmetsch
+'''
+
+# disabling 'Unused import' pylint check (the tests are collected from here)
+# pylint: disable=W0611
+
+import sys
+
+if sys.version_info >= (3, 5):
+    from tests.occi_asynchronous_cases import AsyncWorkflowTest, \
+        EventLoopWorkflowTest, ApplicationTest, AsyncQueryCapabilitesTest, \
+        AsyncCollectionCapabilitesTest, AsyncResourceCapabilitesTest, \
+        AsyncLinkHandlingTest
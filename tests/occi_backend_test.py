@@ -60,6 +60,21 @@ class TestKindBackend(unittest.TestCase):
         self.back.update(None, None, None)
         self.back.replace(None, None, None)
 
+    def test_batch_calls_for_sanity(self):
+        '''
+        Test that the batch routines call the single ones by default.
+        '''
+        calls = []
+        back = KindBackend()
+        back.create = lambda entity, extras: calls.append(('c', entity))
+        back.retrieve = lambda entity, extras: calls.append(('r', entity))
+        back.delete = lambda entity, extras: calls.append(('d', entity))
+        back.create_many([1, 2], None)
+        back.retrieve_many([3], None)
+        back.delete_many([4, 5], None)
+        self.assertEqual(calls, [('c', 1), ('c', 2), ('r', 3), ('d', 4),
+                                 ('d', 5)])
+
     def test_is_related_for_sanity(self):
         '''
         Tests links...
@@ -108,3 +123,21 @@ class TestActionBackend(unittest.TestCase):
         '''
         back = ActionBackend()
         back.action(None, None, None, None)
+
+    def test_action_many_for_sanity(self):
+        '''
+        Test that the batch routine reports the error of each entity.
+        '''
+        def action(entity, action, attributes, extras):
+            '''
+            Fails for entity 2.
+            '''
+            if entity == 2:
+                raise AttributeError('Nope.')
+
+        back = ActionBackend()
+        back.action = action
+        errors = back.action_many([1, 2, 3], None, None, None)
+        self.assertEqual(errors[0], None)
+        self.assertTrue(isinstance(errors[1], AttributeError))
+        self.assertEqual(errors[2], None)
@@ -86,3 +86,31 @@ class TestCore(unittest.TestCase):
         '''
         Resource(None, None, None)
         Link(None, None, None, 'foo', 'bar')
+
+    def test_mixins_for_sanity(self):
+        '''
+        Tests the ordered set of mixins.
+        '''
+        mixin1 = Mixin('http://example.com#', '1')
+        mixin2 = Mixin('http://example.com#', '2')
+        res = Resource(None, None, [mixin1])
+        res.mixins.append(mixin2)
+        res.mixins.append(mixin1)
+        self.assertEqual(list(res.mixins), [mixin1, mixin2])
+        self.assertEqual(res.mixins, [mixin1, mixin2])
+        self.assertEqual(len(res.mixins), 2)
+        self.assertEqual(res.mixins[1], mixin2)
+        self.assertTrue(mixin2 in res.mixins)
+        self.assertFalse([] in res.mixins)
+
+        res.mixins.remove(mixin1)
+        self.assertEqual(res.mixins, [mixin2])
+        self.assertEqual(res.mixins[0], mixin2)
+        self.assertRaises(ValueError, res.mixins.remove, mixin1)
+        self.assertNotEqual(res.mixins, None)
+        self.assertNotEqual(res.mixins, 1)
+        self.assertTrue(res.mixins.__eq__(None) is NotImplemented)
+        self.assertEqual(res.mixins, (mixin2, ))
+
+        res.mixins = None
+        self.assertEqual(len(res.mixins), 0)
@@ -36,7 +36,8 @@ from occi.exceptions import HTTPError
 from occi.extensions.infrastructure import COMPUTE, STORAGE, NETWORK, \
     NETWORKINTERFACE, IPNETWORKINTERFACE, IPNETWORK, START
 from occi.handlers import QueryHandler, CollectionHandler, \
-    ResourceHandler, ACCEPT, CATEGORY, LOCATION, ATTRIBUTE, LINK, CONTENT_TYPE
+    ResourceHandler, RequestContext, ACCEPT, CATEGORY, LOCATION, ATTRIBUTE, \
+    LINK, NEXT, CONTENT_TYPE, LAZY_LINKS, QUERY_STRING, ETAG, IF_NONE_MATCH
 from occi.protocol.occi_rendering import TextOcciRendering, \
     TextUriListRendering, TextPlainRendering
 from occi.registry import NonePersistentRegistry
@@ -63,6 +64,53 @@ class TestBaseHandler(unittest.TestCase):
         status, header, body = handler.handle('GET', '')
         self.assertEquals(status, 405)
 
+    def test_get_renderer_for_sanity(self):
+        '''
+        Tests that the rendering is resolved once per request.
+        '''
+        registry = CountingRegistry()
+        registry.set_renderer('text/plain', TextPlainRendering(registry))
+        handler = ResourceHandler(registry, {'Accept': 'text/plain'}, '', '')
+        first = handler.get_renderer('Accept')
+        self.assertTrue(handler.get_renderer('Accept') is first)
+        self.assertTrue(handler.get_renderer('Content-Type') is first)
+        self.assertEqual(registry.lookups, 2)
+
+    def test_context_for_sanity(self):
+        '''
+        Tests that the renderings see the hostname of their request only.
+        '''
+        registry = NonePersistentRegistry()
+        registry.set_hostname('http://a')
+        registry.set_renderer('text/plain', TextPlainRendering(registry))
+        res = Resource('/compute/1', COMPUTE, [])
+        bodies = []
+        for hostname in ['http://b', 'http://c', None]:
+            headers = {ACCEPT: 'text/plain'}
+            context = RequestContext(registry, hostname, headers, None)
+            handler = CollectionHandler(registry, headers, '', (), None,
+                                        context)
+            rendering = handler.get_renderer(ACCEPT)
+            self.assertTrue(rendering.context is context)
+            bodies.append(rendering.from_entities([res], '/')[1])
+        self.assertTrue('http://b/compute/1' in bodies[0])
+        self.assertTrue('http://c/compute/1' in bodies[1])
+        self.assertTrue('http://a/compute/1' in bodies[2])
+        self.assertEqual(registry.get_hostname(), 'http://a')
+        self.assertTrue(registry.get_renderer('text/plain').context is None)
+
+
+class CountingRegistry(NonePersistentRegistry):
+    '''
+    Registry which counts renderer lookups.
+    '''
+
+    lookups = 0
+
+    def get_renderer(self, mime_type):
+        self.lookups += 1
+        return super(CountingRegistry, self).get_renderer(mime_type)
+
 
 class TestQueryCapabilites(unittest.TestCase):
     '''
@@ -176,6 +224,25 @@ class TestQueryCapabilites(unittest.TestCase):
         status, headers, body = handler.get()
         self.assertTrue(len(headers['Category'].split(',')) == 1)
 
+    def test_conditional_get_for_sanity(self):
+        '''
+        Test that an unchanged QI is not rendered again.
+        '''
+        handler = QueryHandler(self.registry, {ACCEPT: 'text/occi'}, '', [])
+        status, headers, body = handler.get()
+        etag = headers[ETAG]
+
+        headers = {ACCEPT: 'text/occi', IF_NONE_MATCH: 'W/"x", ' + etag}
+        handler = QueryHandler(self.registry, headers, '', [])
+        self.assertEqual(handler.get(), (304, {ETAG: etag}, ''))
+
+        self.registry.set_backend(Mixin('http://example.com#', 'foo'),
+                                  MixinBackend(), None)
+        handler = QueryHandler(self.registry, headers, '', [])
+        status, headers, body = handler.get()
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers[ETAG], etag)
+
     def test_mixin_for_sanity(self):
         '''
         Test if a user defined mixin can be added.
@@ -254,6 +321,20 @@ class TestCollectionCapabilites(unittest.TestCase):
         handler = CollectionHandler(self.registry, headers, '', ())
         self.assertRaises(HTTPError, handler.get, '')
 
+        # unknown path
+        headers = {ACCEPT: 'text/occi'}
+        handler = CollectionHandler(self.registry, headers, '', ())
+        self.assertRaises(HTTPError, handler.get, '/foobar/')
+
+    def test_paging_for_failure(self):
+        '''
+        Do a get with a broken limit or cursor.
+        '''
+        for query in ['limit=0', 'limit=abc', 'limit=1&cursor=xyz']:
+            headers = {ACCEPT: 'text/occi', QUERY_STRING: query}
+            handler = CollectionHandler(self.registry, headers, '', ())
+            self.assertRaises(HTTPError, handler.get, '/')
+
     def test_action_for_failure(self):
         '''
         Tests if actions can be triggered with garbage as content
@@ -324,7 +405,7 @@ class TestCollectionCapabilites(unittest.TestCase):
         handler = CollectionHandler(self.registry, headers, '', ())
         status, headers, body = handler.get('/')
         self.assertTrue(headers[CONTENT_TYPE] == 'text/uri-list')
-        self.assertTrue(len(body) == 98)
+        self.assertTrue(len(''.join(body)) == 98)
 
     def test_retrieve_for_sanity(self):
         '''
@@ -336,6 +417,16 @@ class TestCollectionCapabilites(unittest.TestCase):
         self.assertTrue(headers[CONTENT_TYPE] == 'text/occi')
         self.assertTrue(self.compute.identifier in headers['X-OCCI-Location'])
 
+        # hostname of the request
+        headers = {ACCEPT: 'text/occi'}
+        context = RequestContext(self.registry, 'http://example.com', headers)
+        handler = CollectionHandler(self.registry, headers, '', (), None,
+                                    context)
+        status, headers, body = handler.get('/compute/')
+        self.assertTrue('http://example.com' + self.compute.identifier in
+                        headers['X-OCCI-Location'])
+        self.assertEqual(self.registry.get_hostname(), 'http://127.0.0.1')
+
         # filter on category
         headers = {ACCEPT: 'text/occi',
                    CONTENT_TYPE: 'text/occi',
@@ -359,6 +450,26 @@ class TestCollectionCapabilites(unittest.TestCase):
         self.assertTrue(self.compute.identifier in headers['X-OCCI-Location'])
         self.assertFalse(self.network.identifier in headers['X-OCCI-Location'])
 
+    def test_paging_for_sanity(self):
+        '''
+        Test GET of pages - following the link to the next page.
+        '''
+        headers = {ACCEPT: 'text/occi', QUERY_STRING: 'limit=2'}
+        handler = CollectionHandler(self.registry, headers, '', ())
+        status, headers, body = handler.get('/')
+        self.assertEqual(len(headers[LOCATION].split(', ')), 2)
+        link = headers[NEXT]
+        self.assertTrue(link.startswith('http://127.0.0.1/?limit=2&cursor='))
+        self.assertFalse(LINK in headers)
+
+        headers = {ACCEPT: 'text/uri-list',
+                   QUERY_STRING: link[link.find('?') + 1:]}
+        handler = CollectionHandler(self.registry, headers, '', ())
+        status, headers, body = handler.get('/')
+        lines = ''.join(body).split('\n')
+        self.assertEqual(len(lines), 2)
+        self.assertFalse('# next:' in lines[1])
+
     def test_delete_for_sanity(self):
         '''
         Tests if complete resource collection can be removed.
@@ -376,9 +487,31 @@ class TestCollectionCapabilites(unittest.TestCase):
 
         handler = CollectionHandler(self.registry, headers, '',
                                     ['action', 'start'])
-        handler.post('/compute/')
+        status, headers, body = handler.post('/compute/')
         self.assertTrue(self.compute.attributes['occi.compute.state']
                         == 'active')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, 'http://127.0.0.1/compute/1: OK')
+
+    def test_action_report_for_sanity(self):
+        '''
+        Tests that a failing entity does not stop the others.
+        '''
+        compute2 = Resource('/compute/2', COMPUTE, [])
+        compute2.attributes = {'broken': 'yes'}
+        self.registry.add_resource(compute2.identifier, compute2, None)
+        headers = {CONTENT_TYPE: 'text/occi',
+                   CATEGORY: parser.get_category_str(START, self.registry)}
+
+        handler = CollectionHandler(self.registry, headers, '',
+                                    ['action', 'start'])
+        status, headers, body = handler.post('/compute/')
+        self.assertEqual(status, 400)
+        self.assertEqual(self.compute.attributes['occi.compute.state'],
+                         'active')
+        self.assertEqual(sorted(body.split('\n')),
+                         ['http://127.0.0.1/compute/1: OK',
+                          'http://127.0.0.1/compute/2: 400 - I am broken.'])
 
     def test_update_mixin_collection_for_sanity(self):
         '''
@@ -607,6 +740,90 @@ class TestResourceCapabilites(unittest.TestCase):
         self.assertTrue('compute' in headers['Category'])
         self.assertTrue('text/occi' in headers[CONTENT_TYPE])
 
+    def test_lazy_links_for_sanity(self):
+        '''
+        test that links are not retrieved when not needed...
+        '''
+        backend = RetrieveCountingBackend()
+        self.registry.set_backend(NETWORKINTERFACE, backend, None)
+        compute = Resource('/compute/1', COMPUTE, [])
+        network = Resource('/network/1', NETWORK, [])
+        compute.links = [Link('/link/1', NETWORKINTERFACE, [], compute,
+                              network)]
+        for item in [compute, network] + compute.links:
+            self.registry.add_resource(item.identifier, item, None)
+
+        headers = {ACCEPT: 'text/occi'}
+        ResourceHandler(self.registry, headers, '', ()).get('/compute/1')
+        self.assertEqual(backend.retrieved, ['/link/1'])
+        ResourceHandler(self.registry, headers, '',
+                        LAZY_LINKS).get('/compute/1')
+        self.assertEqual(backend.retrieved, ['/link/1'])
+
+        self.registry.lazy_links = [COMPUTE]
+        try:
+            ResourceHandler(self.registry, headers, '', ()).get('/compute/1')
+        finally:
+            self.registry.lazy_links = None
+        self.assertEqual(backend.retrieved, ['/link/1'])
+
+    def test_fresh_links_for_sanity(self):
+        '''
+        test that links are not retrieved for renderings without links...
+        '''
+        backend = RetrieveCountingBackend()
+        self.registry.set_backend(NETWORKINTERFACE, backend, None)
+        compute = Resource('/compute/1', COMPUTE, [])
+        network = Resource('/network/1', NETWORK, [])
+        compute.links = [Link('/link/1', NETWORKINTERFACE, [], compute,
+                              network)]
+        for item in [compute, network] + compute.links:
+            self.registry.add_resource(item.identifier, item, None)
+
+        self.registry.set_renderer('text/x-summary',
+                                   SummaryRendering(self.registry))
+        try:
+            headers = {ACCEPT: 'text/x-summary'}
+            status, headers, body = ResourceHandler(
+                self.registry, headers, '', ()).get('/compute/1')
+        finally:
+            self.registry.renderings.pop('text/x-summary')
+        self.assertEqual(body, '/compute/1')
+        self.assertEqual(backend.retrieved, [])
+
+        headers = {ACCEPT: 'text/occi'}
+        ResourceHandler(self.registry, headers, '', ()).get('/compute/1')
+        self.assertEqual(backend.retrieved, ['/link/1'])
+
+    def test_conditional_get_for_sanity(self):
+        '''
+        Test that an unchanged resource is not rendered again.
+        '''
+        compute = Resource('/compute/1', COMPUTE, [])
+        self.registry.add_resource(compute.identifier, compute, None)
+
+        handler = ResourceHandler(self.registry, {ACCEPT: 'text/occi'}, '', ())
+        status, headers, body = handler.get('/compute/1')
+        etag = headers[ETAG]
+
+        headers = {ACCEPT: 'text/occi', IF_NONE_MATCH: etag}
+        handler = ResourceHandler(self.registry, headers, '', ())
+        self.assertEqual(handler.get('/compute/1'), (304, {ETAG: etag}, ''))
+
+        # other renderings are other representations.
+        headers = {ACCEPT: 'text/plain', IF_NONE_MATCH: etag}
+        handler = ResourceHandler(self.registry, headers, '', ())
+        self.assertEqual(handler.get('/compute/1')[0], 200)
+
+        headers = {CONTENT_TYPE: 'text/occi',
+                   ATTRIBUTE: 'occi.compute.cores="2"'}
+        ResourceHandler(self.registry, headers, '', ()).post('/compute/1')
+        headers = {ACCEPT: 'text/occi', IF_NONE_MATCH: etag}
+        handler = ResourceHandler(self.registry, headers, '', ())
+        status, headers, body = handler.get('/compute/1')
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers[ETAG], etag)
+
     def test_partial_update_for_sanity(self):
         '''
         test update...
@@ -767,6 +984,29 @@ class TestLinkHandling(unittest.TestCase):
         self.assertTrue('occi.core.source' in body)
 
 
+class RetrieveCountingBackend(KindBackend):
+    '''
+    Remembers which entities were retrieved.
+    '''
+
+    def __init__(self):
+        self.retrieved = []
+
+    def retrieve(self, entity, extras):
+        self.retrieved.append(entity.identifier)
+
+
+class SummaryRendering(TextOcciRendering):
+    '''
+    Renders just the location of an entity - without its links.
+    '''
+
+    fresh_links = False
+
+    def from_entity(self, entity):
+        return {CONTENT_TYPE: 'text/x-summary'}, entity.identifier
+
+
 class SimpleComputeBackend(KindBackend, ActionBackend):
     '''
     Simple backend...handing the kinds and Actions!
@@ -788,4 +1028,6 @@ class SimpleComputeBackend(KindBackend, ActionBackend):
             raise AttributeError("I cannot be delete...")
 
     def action(self, entity, action, attributes, extras):
+        if 'broken' in entity.attributes:
+            raise AttributeError('I am broken.')
         entity.attributes['occi.compute.state'] = 'active'
@@ -0,0 +1,485 @@
+# coding=utf-8
+#
+# Copyright (C) 2010-2012 Platform Computing
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+'''
+Module to test the persistent registries.
+
+Runs the registry and workflow tests against them as well.
+
+Created on Oct 18, 2012
+
+@author: tmetsch
+'''
+
+# disabling 'Invalid name' pylint check (unittest's fault)
+# disabling 'Too many public methods' pylint check (unittest's fault)
+# pylint: disable=C0103,R0904
+
+from occi import workflow
+from occi.backend import KindBackend, UserDefinedMixinBackend
+from occi.core_model import Kind, Link, Mixin, Resource
+from occi.persistence import JournalRegistry, SqliteRegistry
+from tests import occi_registry_test as registry_test
+from tests import occi_workflow_test as workflow_test
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+#==============================================================================
+# The registry & workflow tests running on the persistent registries
+#==============================================================================
+
+
+class SqliteBackendsRegistryTest(registry_test.TestBackendsRegistry):
+    '''
+    Backend tests on the SQLite registry.
+    '''
+
+    registry = SqliteRegistry()
+
+
+class SqliteCategoryRegistryTest(registry_test.CategoryRegistryTest):
+    '''
+    Category tests on the SQLite registry.
+    '''
+
+    registry = SqliteRegistry()
+
+
+class SqliteResourcesTest(registry_test.ResourcesTest):
+    '''
+    Resource tests on the SQLite registry.
+    '''
+
+    registry = SqliteRegistry()
+
+
+class SqliteEntityWorkflowTest(workflow_test.EntityWorkflowTest):
+    '''
+    Entity workflow tests on the SQLite registry.
+    '''
+
+    registry = SqliteRegistry()
+
+
+class SqliteCollectionWorkflowTest(workflow_test.CollectionWorkflowTest):
+    '''
+    Collection workflow tests on the SQLite registry.
+    '''
+
+    registry = SqliteRegistry()
+
+
+class SqliteQueryInterfaceTest(workflow_test.QueriyInterfaceTest):
+    '''
+    Query interface tests on the SQLite registry.
+    '''
+
+    registry = SqliteRegistry()
+
+JOURNAL_DIR = tempfile.mkdtemp()
+
+
+def tearDownModule():
+    '''
+    Closes and removes the journals of the registry & workflow tests.
+    '''
+    for test in [JournalBackendsRegistryTest, JournalCategoryRegistryTest,
+                 JournalResourcesTest, JournalEntityWorkflowTest,
+                 JournalCollectionWorkflowTest, JournalQueryInterfaceTest]:
+        test.registry.close()
+    shutil.rmtree(JOURNAL_DIR)
+
+
+class JournalBackendsRegistryTest(registry_test.TestBackendsRegistry):
+    '''
+    Backend tests on the journal registry.
+    '''
+
+    registry = JournalRegistry(os.path.join(JOURNAL_DIR, 'backends'))
+
+
+class JournalCategoryRegistryTest(registry_test.CategoryRegistryTest):
+    '''
+    Category tests on the journal registry.
+    '''
+
+    registry = JournalRegistry(os.path.join(JOURNAL_DIR, 'categories'))
+
+
+class JournalResourcesTest(registry_test.ResourcesTest):
+    '''
+    Resource tests on the journal registry.
+    '''
+
+    registry = JournalRegistry(os.path.join(JOURNAL_DIR, 'resources'))
+
+
+class JournalEntityWorkflowTest(workflow_test.EntityWorkflowTest):
+    '''
+    Entity workflow tests on the journal registry.
+    '''
+
+    registry = JournalRegistry(os.path.join(JOURNAL_DIR, 'entities'))
+
+
+class JournalCollectionWorkflowTest(workflow_test.CollectionWorkflowTest):
+    '''
+    Collection workflow tests on the journal registry.
+    '''
+
+    registry = JournalRegistry(os.path.join(JOURNAL_DIR, 'collections'))
+
+
+class JournalQueryInterfaceTest(workflow_test.QueriyInterfaceTest):
+    '''
+    Query interface tests on the journal registry.
+    '''
+
+    registry = JournalRegistry(os.path.join(JOURNAL_DIR, 'query'))
+
+#==============================================================================
+# Persistence
+#==============================================================================
+
+
+class MyRegistry(SqliteRegistry):
+    '''
+    Dummy registry.
+    '''
+
+    def get_extras(self, extras):
+        return extras
+
+
+class MyJournalRegistry(JournalRegistry):
+    '''
+    Dummy registry.
+    '''
+
+    def get_extras(self, extras):
+        return extras
+
+
+class SqliteRegistryTest(unittest.TestCase):
+    '''
+    Tests that the SQLite registry survives a restart.
+    '''
+
+    registry_class = SqliteRegistry
+    owner_registry_class = MyRegistry
+    # the routine all writes go through.
+    writer = '_queue'
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'occi.db')
+
+        self.kind = Kind('http://example.com#', 'compute',
+                         related=[Resource.kind])
+        self.link_kind = Kind('http://example.com#', 'link',
+                              related=[Link.kind])
+        self.mixin = Mixin('http://example.com#', 'mine',
+                           location='/mine/')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _open(self, cls):
+        '''
+        Open the registry.
+
+        cls -- The class of the registry.
+        '''
+        return cls(self.path, batch_size=2)
+
+    def _create_registry(self):
+        '''
+        Create a registry with the backends registered.
+        '''
+        registry = self._open(self.registry_class)
+        registry.set_backend(self.kind, KindBackend(), None)
+        registry.set_backend(self.link_kind, KindBackend(), None)
+        return registry
+
+    def test_restart_for_sanity(self):
+        '''
+        Test if resources, links and mixins are restored.
+        '''
+        registry = self._create_registry()
+        workflow.append_mixins([self.mixin], registry, None)
+        res1 = Resource(None, self.kind, [], [])
+        res1.attributes = {'foo': 'bar'}
+        res2 = Resource(None, self.kind, [], [])
+        workflow.create_entity('/compute/1', res1, registry, None)
+        workflow.create_entity('/compute/2', res2, registry, None)
+        link = Link(None, self.link_kind, [], res1, res2)
+        workflow.create_entity('/link/1', link, registry, None)
+        workflow.update_collection(self.mixin, [], [res2], registry, None)
+        registry.close()
+
+        registry = self._create_registry()
+        mixin = registry.get_category('/mine/', None)
+        self.assertEqual(mixin, self.mixin)
+        self.assertTrue(isinstance(registry.get_backend(mixin, None),
+                                   UserDefinedMixinBackend))
+
+        res1 = registry.get_resource('/compute/1', None)
+        self.assertEqual(res1.kind, self.kind)
+        self.assertEqual(res1.attributes, {'foo': 'bar'})
+        self.assertEqual(len(res1.links), 1)
+        self.assertTrue(res1.links[0].source is res1)
+        self.assertTrue(res1.links[0].target is
+                        registry.get_resource('/compute/2', None))
+
+        self.assertEqual(len(workflow.get_entities_under_path('/compute/',
+                                                              registry,
+                                                              None)), 2)
+        members = workflow.get_entities_under_path('/mine/', registry, None)
+        self.assertEqual([item.identifier for item in members],
+                         ['/compute/2'])
+
+        workflow.delete_entity(res1, registry, None)
+        registry.close()
+
+        registry = self._create_registry()
+        self.assertEqual(sorted(registry.get_resource_keys(None)),
+                         ['/compute/2'])
+        registry.close()
+
+    def test_retrieve_for_sanity(self):
+        '''
+        Test that retrieving entities the backends did not change writes
+        nothing.
+        '''
+        registry = self._create_registry()
+        res1 = Resource(None, self.kind, [], [])
+        res2 = Resource(None, self.kind, [], [])
+        workflow.create_entity('/compute/1', res1, registry, None)
+        workflow.create_entity('/compute/2', res2, registry, None)
+        link = Link(None, self.link_kind, [], res1, res2)
+        workflow.create_entity('/link/1', link, registry, None)
+
+        writes = []
+        write = getattr(registry, self.writer)
+        setattr(registry, self.writer,
+                lambda *args: writes.append(args) or write(*args))
+        for _ in range(10):
+            workflow.retrieve_entity(res1, registry, None)
+        self.assertEqual(writes, [])
+
+        registry.set_backend(self.kind, workflow_test.StoppingBackend(),
+                             None)
+        workflow.retrieve_entity(res1, registry, None)
+        self.assertNotEqual(writes, [])
+        registry.close()
+
+        registry = self._create_registry()
+        self.assertEqual(registry.get_resource('/compute/1', None).attributes,
+                         {'state': 'stopped'})
+        registry.close()
+
+    def test_owners_for_sanity(self):
+        '''
+        Test that owners only see their own resources after a restart.
+        '''
+        registry = self._open(self.owner_registry_class)
+        registry.add_resource('/compute/1', Resource('/compute/1', self.kind,
+                                                     []), 'foo')
+        registry.add_resource('/compute/2', Resource('/compute/2', self.kind,
+                                                     []), None)
+        registry.close()
+
+        registry = self._open(self.owner_registry_class)
+        self.assertEqual(sorted(registry.get_resource_keys('foo')),
+                         ['/compute/1', '/compute/2'])
+        self.assertEqual(registry.get_resource_keys('bar'), ['/compute/2'])
+        self.assertRaises(KeyError, registry.get_resource, '/compute/1',
+                          'bar')
+        self.assertFalse(registry.has_resources_under_path('/compute/1',
+                                                           'bar'))
+        self.assertTrue(registry.has_resources_under_path('/compute/1',
+                                                          'foo'))
+        registry.close()
+
+
+class CountingSqliteRegistry(SqliteRegistry):
+    '''
+    SQLite registry which counts its queries.
+    '''
+
+    queries = 0
+
+    def _query(self, statement, params):
+        self.queries += 1
+        return super(CountingSqliteRegistry, self)._query(statement, params)
+
+
+class SqliteQueriesTest(unittest.TestCase):
+    '''
+    Tests the number of queries of the SQLite registry.
+    '''
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'occi.db')
+        self.kind = Kind('http://example.com#', 'compute',
+                         related=[Resource.kind])
+        self.link_kind = Kind('http://example.com#', 'link',
+                              related=[Link.kind])
+        self.mixin = Mixin('http://example.com#', 'mine', location='/mine/')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _open(self):
+        '''
+        Open the registry with the backends registered.
+        '''
+        registry = CountingSqliteRegistry(self.path)
+        for category in [self.kind, self.link_kind, self.mixin]:
+            registry.set_backend(category, KindBackend(), None)
+        return registry
+
+    def test_listing_for_sanity(self):
+        '''
+        Test that listings load mixins and links of all rows at once.
+        '''
+        registry = self._open()
+        for i in range(50):
+            res = Resource('/compute/' + str(i), self.kind, [self.mixin], [])
+            registry.add_resource(res.identifier, res, None)
+            link = Link('/link/' + str(i), self.link_kind, [], res, res)
+            registry.add_resource(link.identifier, link, None)
+        registry.close()
+
+        registry = self._open()
+        registry.queries = 0
+        resources = registry.get_resources_under_path('/compute/', None)
+        self.assertEqual(len(resources), 50)
+        for res in resources:
+            self.assertEqual(res.mixins, [self.mixin])
+            self.assertEqual(len(res.links), 1)
+            self.assertTrue(res.links[0].source is res)
+            self.assertTrue(res.links[0].target is res)
+        self.assertTrue(registry.queries <= 6)
+        registry.close()
+
+
+class JournalRegistryTest(SqliteRegistryTest):
+    '''
+    Tests that the journal registry survives a restart.
+    '''
+
+    registry_class = JournalRegistry
+    owner_registry_class = MyJournalRegistry
+    writer = '_append'
+
+    def _open(self, cls):
+        return cls(self.path, group_size=2, compact_after=None)
+
+    def test_compact_for_sanity(self):
+        '''
+        Test if the state is restored from a snapshot and the journal.
+        '''
+        registry = self._create_registry()
+        workflow.append_mixins([self.mixin], registry, None)
+        res1 = Resource(None, self.kind, [], [])
+        workflow.create_entity('/compute/1', res1, registry, None)
+        registry.compact()
+        self.assertEqual(os.path.getsize(registry.journal_path), 0)
+        res2 = Resource(None, self.kind, [], [])
+        workflow.create_entity('/compute/2', res2, registry, None)
+        workflow.update_collection(self.mixin, [], [res1], registry, None)
+        registry.close()
+
+        registry = self._create_registry()
+        self.assertEqual(sorted(registry.get_resource_keys(None)),
+                         ['/compute/1', '/compute/2'])
+        members = workflow.get_entities_under_path('/mine/', registry, None)
+        self.assertEqual([item.identifier for item in members],
+                         ['/compute/1'])
+        registry.close()
+
+    def test_interrupted_write_for_sanity(self):
+        '''
+        Test that the tail of an interrupted write is dropped.
+        '''
+        registry = self._create_registry()
+        workflow.create_entity('/compute/1', Resource(None, self.kind, [],
+                                                      []), registry, None)
+        registry.close()
+        with open(registry.journal_path, 'ab') as journal:
+            journal.write(b'\x00\x00\x10\x00garbage')
+
+        registry = self._create_registry()
+        self.assertEqual(registry.get_resource_keys(None), ['/compute/1'])
+        workflow.create_entity('/compute/2', Resource(None, self.kind, [],
+                                                      []), registry, None)
+        registry.close()
+
+        registry = self._create_registry()
+        self.assertEqual(sorted(registry.get_resource_keys(None)),
+                         ['/compute/1', '/compute/2'])
+        registry.close()
+
+    def test_auto_compact_for_sanity(self):
+        '''
+        Test that a snapshot is written after enough changes.
+        '''
+        registry = JournalRegistry(self.path, group_size=1, compact_after=3)
+        registry.set_backend(self.kind, KindBackend(), None)
+        for i in range(4):
+            workflow.create_entity('/compute/' + str(i),
+                                   Resource(None, self.kind, [], []),
+                                   registry, None)
+        registry.close()
+        self.assertTrue(os.path.exists(registry.snapshot_path))
+
+        registry = JournalRegistry(self.path)
+        registry.set_backend(self.kind, KindBackend(), None)
+        self.assertEqual(len(registry.get_resource_keys(None)), 4)
+        registry.close()
+
+    def test_group_interval_for_sanity(self):
+        '''
+        Test that one daemon thread commits the changes after the interval
+        and stops on close.
+        '''
+        registry = JournalRegistry(self.path, group_interval=0.05)
+        registry.set_backend(self.kind, KindBackend(), None)
+        flushers = set()
+        for i in range(3):
+            workflow.create_entity('/compute/' + str(i),
+                                   Resource(None, self.kind, [], []),
+                                   registry, None)
+            flushers.add(registry._flusher)
+            for _ in range(100):
+                if not registry._pending:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(registry._pending, [])
+        self.assertTrue(os.path.getsize(registry.journal_path) > 0)
+        self.assertEqual(len(flushers), 1)
+        flusher = flushers.pop()
+        self.assertTrue(flusher.daemon)
+
+        registry.close()
+        self.assertFalse(flusher.is_alive())
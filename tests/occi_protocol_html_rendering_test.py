@@ -88,6 +88,9 @@ class TestHTMLRendering(unittest.TestCase):
         '''
         self.parser.from_entities([self.source], '/foo/')
         self.parser.from_entities([], '/')
+        heads, body = self.parser.from_entities([self.source], '/foo/',
+                                                '/foo/?cursor=1')
+        self.assertTrue('<a href="/foo/?cursor=1" rel="next">' in body)
 
     def test_from_categories_for_success(self):
         '''
@@ -12,6 +12,7 @@ Created on Feb 2, 2012
 from occi.core_model import Action, Kind, Mixin, Resource, Link
 from occi.protocol.json_rendering import JsonRendering
 from occi.registry import NonePersistentRegistry
+import json
 import unittest
 
 
@@ -60,6 +61,23 @@ class JsonRenderingTest(unittest.TestCase):
         self.parser.from_entities([self.source], '/foo/')
         self.parser.from_entities([], '/foo/')
 
+    def test_stream_entities_for_success(self):
+        '''
+        Test that streamed listings match a rendering of the whole list...
+        '''
+        for entities in [[], [self.source], [self.source, self.target]]:
+            heads, body = self.parser.stream_entities(entities, '/foo/')
+            expected = json.dumps([json.loads(self.parser.from_entity(item)[1])
+                                   for item in entities],
+                                  sort_keys=True, indent=2)
+            self.assertEqual(''.join(body), expected)
+
+        # the link to the next page is in the header.
+        heads, body = self.parser.stream_entities([self.source], '/foo/',
+                                                  '/foo/?cursor=1')
+        self.assertEqual(heads['Link'], '</foo/?cursor=1>; rel="next"')
+        self.assertEqual(len(json.loads(''.join(body))), 1)
+
     def test_from_categories_for_success(self):
         '''
         Test from categories...
@@ -199,6 +199,27 @@ class TestParser(unittest.TestCase):
                          parser.get_category('foo1; \
                          scheme="http://example.com#"', reg, 'bar'))
 
+    def test_category_cache_for_sanity(self):
+        '''
+        Test that resolved categories are cached until the categories of the
+        registry change.
+        '''
+        reg = MyRegistry()
+        mixin1 = Mixin('http://example.com#', 'foo1')
+        reg.set_backend(mixin1, None, 'foo')
+        cat_str = 'foo1; scheme="http://example.com#"'
+
+        self.assertEqual(mixin1, parser.get_category(cat_str, reg, 'foo'))
+        self.assertTrue(('http://example.com#', 'foo1', 'foo') in
+                        parser._CATEGORY_CACHE[reg][1])
+        self.assertRaises(AttributeError, parser.get_category, cat_str, reg,
+                          'bar')
+
+        # removal invalidates the cache.
+        reg.delete_mixin(mixin1, 'foo')
+        self.assertRaises(AttributeError, parser.get_category, cat_str, reg,
+                          'foo')
+
     def test_get_link_for_sanity(self):
         '''
         Verifies that source and target are set...
@@ -30,9 +30,10 @@ Created on Jul 5, 2011
 
 from occi.backend import KindBackend, MixinBackend, ActionBackend
 from occi.core_model import Kind, Resource, Link, Mixin, Action
-from occi.handlers import CONTENT_TYPE
+from occi.handlers import CONTENT_TYPE, RequestContext
 from occi.protocol.occi_rendering import TextOcciRendering, Rendering, \
     TextPlainRendering, TextUriListRendering
+from occi.protocol.rendering import chunk
 from occi.registry import NonePersistentRegistry
 import unittest
 
@@ -209,6 +210,17 @@ class TestTextOcciRendering(unittest.TestCase):
         self.assertTrue(cats == [self.kind])
         self.assertTrue(attrs['foo'] == 'bar')
 
+    def test_next_page_for_sanity(self):
+        '''
+        Test that the next page does not end up in the Link header.
+        '''
+        entities = [Resource('/foo/' + str(i), None, []) for i in range(3)]
+        headers, body = self.rendering.from_entities(entities, '/foo/',
+                                                     '/foo/?cursor=1')
+        self.assertEqual(headers['X-OCCI-Next'], '/foo/?cursor=1')
+        self.assertFalse('Link' in headers)
+        self.assertEqual(len(headers['X-OCCI-Location'].split(', ')), 3)
+
 
 class TestTextPlainRendering(unittest.TestCase):
     '''
@@ -241,6 +253,29 @@ class TestTextPlainRendering(unittest.TestCase):
         self.assertTrue(body.count('X-OCCI-Attribute') == 3)
         self.assertTrue(body.count('X-OCCI-Location') == 3)
 
+    def test_stream_entities_for_sanity(self):
+        '''
+        Test that the streamed listing matches the text/occi data.
+        '''
+        entities = [Resource('/foo/' + str(i), None, []) for i in range(3)]
+        heads, body = self.rendering.stream_entities(entities, '/foo/')
+        expected = TextOcciRendering.from_entities(self.rendering, entities,
+                                                   '/foo/')
+        self.assertEqual((heads, ''.join(body)), expected)
+
+    def test_next_page_for_sanity(self):
+        '''
+        Test that the link to the next page is rendered.
+        '''
+        entities = [Resource('/foo/' + str(i), None, []) for i in range(3)]
+        heads, body = self.rendering.stream_entities(entities, '/foo/',
+                                                     '/foo/?cursor=1')
+        expected = TextOcciRendering.from_entities(self.rendering, entities,
+                                                   '/foo/', '/foo/?cursor=1')
+        self.assertEqual((heads, ''.join(body)), expected)
+        self.assertTrue('\nX-OCCI-Next: /foo/?cursor=1' in expected[1])
+        self.assertFalse('Link' in expected[1])
+
 
 class TestTextURIListRendering(unittest.TestCase):
     '''
@@ -262,6 +297,10 @@ class TestTextURIListRendering(unittest.TestCase):
         self.assertTrue(heads == {CONTENT_TYPE: self.rendering.mime_type})
         self.assertTrue(res.identifier in body)
 
+        heads, body = self.rendering.from_entities(entities, 'foo',
+                                                   '/foo/?cursor=1')
+        self.assertEqual(body.split('\n')[1], '# next:/foo/?cursor=1')
+
     def test_not_support_thrown_for_success(self):
         '''
         Tests is attr-exp are thrown for unsupported operations.
@@ -306,3 +345,25 @@ class TestRendering(unittest.TestCase):
         self.assertRaises(NotImplementedError, rendering.from_categories, None)
         self.assertRaises(NotImplementedError, rendering.from_entities, None,
                           None)
+        self.assertRaises(NotImplementedError, rendering.stream_entities,
+                          None, None)
+
+    def test_bind_for_sanity(self):
+        '''
+        Test that bound renderings take the hostname from the context.
+        '''
+        self.registry.set_hostname('http://a')
+        rendering = TextUriListRendering(self.registry)
+        context = RequestContext(self.registry, 'http://b')
+        bound = rendering.bind(context)
+        self.assertEqual(rendering.get_hostname(), 'http://a')
+        self.assertEqual(bound.get_hostname(), 'http://b')
+        self.assertTrue(bound.registry is self.registry)
+        self.registry.set_hostname('')
+
+    def test_chunk_for_sanity(self):
+        '''
+        Test that small pieces are joined into chunks.
+        '''
+        self.assertEqual(list(chunk(['ab', 'cd', 'e'], 3)), ['abcd', 'e'])
+        self.assertEqual(list(chunk([], 3)), [])
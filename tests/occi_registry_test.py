@@ -27,13 +27,17 @@ Created on Jul 4, 2011
 # disabling 'Invalid name' pylint check (unittest's fault)
 # disabling 'Too many public methods' pylint check (unittest's fault)
 # disabling 'Method could be func' pylint check (naw...)
-# pylint: disable=C0103,R0904,R0201
+# disabling 'Access to protected member' pylint check (testing the cache)
+# pylint: disable=C0103,R0904,R0201,W0212
 
 from occi.backend import KindBackend, ActionBackend, MixinBackend
-from occi.core_model import Kind, Resource, Action, Mixin
+from occi.core_model import Kind, Resource, Link, Action, Mixin
 from occi.exceptions import HTTPError
 from occi.protocol.occi_rendering import Rendering
-from occi.registry import NonePersistentRegistry, Registry
+from occi import registry as registry_module
+from occi.registry import ConcurrentRegistry, NonePersistentRegistry, \
+    Registry
+import threading
 import unittest
 
 
@@ -195,6 +199,38 @@ class TestParserRegistry(unittest.TestCase):
         self.assertEquals(parser1, parser3)
         self.assertEquals(parser2, parser3)
 
+    def test_quality_for_sanity(self):
+        '''
+        Test that the mime type with the highest quality wins.
+        '''
+        plain = self.registry.get_renderer('text/plain')
+        occi = self.registry.get_renderer('text/occi')
+
+        self.assertEqual(self.registry.get_renderer(
+            'text/plain;q=0.5, text/occi'), occi)
+        self.assertEqual(self.registry.get_renderer(
+            'text/occi;q=0.5,text/plain;q=0.8'), plain)
+        self.assertEqual(self.registry.get_renderer(
+            'text/html,text/occi; charset=utf-8'), occi)
+        self.assertRaises(HTTPError, self.registry.get_renderer,
+                          'text/plain;q=0')
+
+    def test_media_range_cache_for_sanity(self):
+        '''
+        Test that parsed headers are cached and the cache is bounded.
+        '''
+        header = 'text/html,application/xhtml+xml,*/*;q=0.8'
+        ranges = registry_module.get_media_ranges(header)
+        self.assertEqual(ranges, ('text/html', 'application/xhtml+xml',
+                                  '*/*'))
+        self.assertTrue(registry_module.get_media_ranges(header) is ranges)
+
+        for i in range(registry_module.MEDIA_RANGE_CACHE_SIZE + 1):
+            registry_module.get_media_ranges('text/x-%d' % i)
+        self.assertEqual(len(registry_module._MEDIA_RANGES),
+                         registry_module.MEDIA_RANGE_CACHE_SIZE)
+        self.assertFalse(header in registry_module._MEDIA_RANGES)
+
 
 class CategoryRegistryTest(unittest.TestCase):
     '''
@@ -227,6 +263,22 @@ class CategoryRegistryTest(unittest.TestCase):
         result = self.registry.get_category('/bar/', None)
         self.assertTrue(result is None)
 
+    def test_location_index_for_sanity(self):
+        '''
+        Test if the location lookup follows additions and removals.
+        '''
+        mixin = Mixin('http://example.com#', 'mixin', location='/bar/')
+        self.registry.set_backend(mixin, MixinBackend(), None)
+        self.assertEqual(self.registry.get_category('/bar/', None), mixin)
+
+        self.registry.delete_mixin(mixin, None)
+        self.assertTrue(self.registry.get_category('/bar/', None) is None)
+
+        other = NonePersistentRegistry()
+        other.backends = {self.kind2: DummyBackend()}
+        self.assertEqual(other.get_category('/foo/', None), self.kind2)
+        self.assertTrue(other.get_category('/1/', None) is None)
+
     def test_set_category_for_sanity(self):
         '''
         Test the hash function of the categories...
@@ -246,6 +298,18 @@ class MyRegistry(NonePersistentRegistry):
         return extras
 
 
+class VisitCountingRegistry(MyRegistry):
+    '''
+    Counts the resources whose visibility is checked.
+    '''
+
+    visited = 0
+
+    def _is_visible(self, resource, owner):
+        self.visited += 1
+        return MyRegistry._is_visible(self, resource, owner)
+
+
 class ResourcesTest(unittest.TestCase):
     '''
     Tests the reigstry's resource handling.
@@ -268,6 +332,8 @@ class ResourcesTest(unittest.TestCase):
         my_reg = MyRegistry()
         my_reg.add_resource('tmp1', self.res1, 'foo')
         self.assertRaises(KeyError, my_reg.get_resource, 'tmp1', 'bar')
+        self.assertFalse(my_reg.has_resource('tmp1', 'bar'))
+        self.assertFalse(my_reg.has_resource('tmp2', 'foo'))
 
     def test_get_resource_for_sanity(self):
         '''
@@ -275,6 +341,7 @@ class ResourcesTest(unittest.TestCase):
         '''
         self.registry.add_resource('foo', self.res1, None)
         self.assertEquals(self.res1, self.registry.get_resource('foo', None))
+        self.assertTrue(self.registry.has_resource('foo', None))
 
     def test_delete_resource_for_sanity(self):
         '''
@@ -284,6 +351,15 @@ class ResourcesTest(unittest.TestCase):
         self.registry.delete_resource('foo', None)
         self.assertRaises(KeyError, self.registry.get_resource, 'foo', None)
 
+    def test_delete_resources_for_sanity(self):
+        '''
+        Test if several resources can be deleted at once.
+        '''
+        self.registry.add_resource('foo', self.res1, None)
+        self.registry.add_resource('bar', self.res2, None)
+        self.registry.delete_resources(['foo', 'bar'], None)
+        self.assertEqual(self.registry.get_resource_keys(None), [])
+
     def test_resources_for_sanity(self):
         '''
         Test is all resources and all keys can be retrieved.
@@ -293,6 +369,456 @@ class ResourcesTest(unittest.TestCase):
         self.assertTrue(len(self.registry.get_resources(None)) == 2)
         self.assertTrue(len(self.registry.get_resource_keys(None)) == 2)
 
+    def test_partitions_for_sanity(self):
+        '''
+        Test that owners only see public and their own resources.
+        '''
+        my_reg = MyRegistry()
+        res3 = Resource('baz', None, None)
+        my_reg.add_resource('foo', self.res1, 'foo')
+        my_reg.add_resource('bar', self.res2, 'bar')
+        my_reg.add_resource('baz', res3, None)
+
+        self.assertEqual(sorted(my_reg.get_resource_keys('foo')),
+                         ['baz', 'foo'])
+        self.assertEqual(sorted(my_reg.get_resource_keys('bar')),
+                         ['bar', 'baz'])
+        self.assertEqual(my_reg.get_resources(None), [res3])
+
+        my_reg.delete_resource('foo', 'foo')
+        self.assertEqual(my_reg.get_resource_keys('foo'), ['baz'])
+
+        my_reg.resources = {'foo': self.res1}
+        self.assertEqual(my_reg.get_resource_keys('foo'), ['foo'])
+        self.assertEqual(my_reg.get_resource_keys('bar'), [])
+
+    def test_category_index_for_sanity(self):
+        '''
+        Test if resources can be looked up by their kind and mixins.
+        '''
+        kind = Kind('http://example.com#', 'kind')
+        mixin = Mixin('http://example.com#', 'mixin')
+        res1 = Resource('/kind/1', kind, [mixin])
+        res2 = Resource('/kind/2', kind, [])
+        self.registry.add_resource(res1.identifier, res1, None)
+        self.registry.add_resource(res2.identifier, res2, None)
+
+        self.assertEqual(len(self.registry.get_resources_by_category(kind,
+                                                                     None)), 2)
+        self.assertEqual(self.registry.get_resources_by_category(mixin, None),
+                         [res1])
+
+        res2.mixins.append(mixin)
+        self.registry.add_to_category(mixin, res2, None)
+        self.assertEqual(len(self.registry.get_resources_by_category(mixin,
+                                                                     None)), 2)
+
+        res1.mixins.remove(mixin)
+        self.registry.remove_from_category(mixin, res1, None)
+        self.assertEqual(self.registry.get_resources_by_category(mixin, None),
+                         [res2])
+
+        self.registry.delete_resource(res2.identifier, None)
+        self.assertEqual(self.registry.get_resources_by_category(mixin, None),
+                         [])
+        self.assertEqual(self.registry.get_resources_by_category(kind, None),
+                         [res1])
+
+        # unregistered entities are not indexed.
+        self.registry.add_to_category(mixin, res2, None)
+        self.assertEqual(self.registry.get_resources_by_category(mixin, None),
+                         [])
+
+    def test_path_index_for_sanity(self):
+        '''
+        Test if resources can be looked up by the prefix of their id.
+        '''
+        res3 = Resource('/users/foo/1', None, None)
+        res4 = Resource('/users/foobar/1', None, None)
+        self.registry.add_resource('/users/foo/1', res3, None)
+        self.registry.add_resource('/users/foobar/1', res4, None)
+
+        self.assertEqual(self.registry.get_resources_under_path('/users/foo/',
+                                                                None), [res3])
+        self.assertEqual(len(self.registry.get_resources_under_path(
+            '/users/foo', None)), 2)
+        self.assertEqual(len(self.registry.get_resources_under_path(
+            '/', None)), 2)
+        self.assertTrue(self.registry.has_resources_under_path('/users/',
+                                                               None))
+        self.assertFalse(self.registry.has_resources_under_path('/compute/',
+                                                                None))
+
+        self.registry.delete_resource('/users/foo/1', None)
+        self.assertFalse(self.registry.has_resources_under_path('/users/foo/',
+                                                                None))
+        self.assertTrue(self.registry.has_resources_under_path('/users/',
+                                                               None))
+
+        # other users do not see my resources.
+        my_reg = MyRegistry()
+        my_reg.add_resource('/users/foo/1', res3, 'foo')
+        self.assertTrue(my_reg.has_resources_under_path('/users/', 'foo'))
+        self.assertFalse(my_reg.has_resources_under_path('/users/', 'bar'))
+
+    def test_versions_for_sanity(self):
+        '''
+        Test that versions change with the resource and its links only.
+        '''
+        kind = Kind('http://example.com#', 'kind')
+        res = Resource('/kind/1', kind, [])
+        self.registry.add_resource(res.identifier, res, None)
+        first = self.registry.get_version(res.identifier, None)
+        self.assertTrue(first is not None)
+
+        # nothing changed.
+        self.registry.update_resource(res.identifier, res, None)
+        self.assertEqual(self.registry.get_version(res.identifier, None),
+                         first)
+
+        res.attributes['foo'] = 'bar'
+        self.registry.update_resource(res.identifier, res, None)
+        second = self.registry.get_version(res.identifier, None)
+        self.assertNotEqual(second, first)
+
+        # links are rendered with their source.
+        link = Link('/link/1', kind, [], res, res)
+        res.links.append(link)
+        self.registry.add_resource(link.identifier, link, None)
+        third = self.registry.get_version(res.identifier, None)
+        self.assertNotEqual(third, second)
+        self.registry.delete_resource(link.identifier, None)
+        res.links.remove(link)
+        self.assertNotEqual(self.registry.get_version(res.identifier, None),
+                            third)
+
+        # deleted and added again.
+        self.registry.delete_resource(res.identifier, None)
+        self.registry.add_resource(res.identifier, res, None)
+        self.assertFalse(self.registry.get_version(res.identifier, None) in
+                         [first, second, third])
+
+        version = self.registry.get_categories_version(None)
+        mixin = Mixin('http://example.com#', 'versions')
+        self.registry.set_backend(mixin, MixinBackend(), None)
+        self.assertNotEqual(self.registry.get_categories_version(None),
+                            version)
+        self.registry.delete_mixin(mixin, None)
+
+    def test_positions_for_sanity(self):
+        '''
+        Test that listings continue after a position - also when resources
+        are added and deleted in between.
+        '''
+        kind = Kind('http://example.com#', 'kind')
+        mixin = Mixin('http://example.com#', 'mixin')
+        for i in range(5):
+            res = Resource('/kind/' + str(i), kind, [mixin])
+            self.registry.add_resource(res.identifier, res, None)
+
+        first = self.registry.get_resources_after(kind, '/kind/', None, 2,
+                                                  None)
+        self.assertEqual([item.identifier for _, item in first],
+                         ['/kind/0', '/kind/1'])
+
+        self.registry.delete_resource('/kind/1', None)
+        self.registry.delete_resource('/kind/2', None)
+        res = Resource('/kind/5', kind, [mixin])
+        self.registry.add_resource(res.identifier, res, None)
+        rest = self.registry.get_resources_after(kind, '/kind/', first[-1][0],
+                                                 None, None)
+        self.assertEqual([item.identifier for _, item in rest],
+                         ['/kind/3', '/kind/4', '/kind/5'])
+
+        self.assertEqual(len(self.registry.get_resources_after(
+            mixin, '/kind/', None, 10, None)), 4)
+        page = self.registry.get_resources_after(None, '/kind/',
+                                                 first[-1][0], 1, None)
+        self.assertEqual(page[0][1].identifier, '/kind/3')
+
+        # gaps left by deleted resources are dropped.
+        for _ in range(100):
+            res = Resource('/kind/6', kind, [mixin])
+            self.registry.add_resource(res.identifier, res, None)
+            self.registry.delete_resource(res.identifier, None)
+        self.assertEqual(self.registry.get_resources_after(
+            kind, '/kind/', first[-1][0], None, None), rest)
+
+        # the default sorts by identifier.
+        page = Registry.get_resources_after(self.registry, kind, '/kind/',
+                                            '/kind/0', 1, None)
+        self.assertEqual(page, [('/kind/3', rest[0][1])])
+
+        # other users do not see my resources.
+        my_reg = MyRegistry()
+        my_reg.add_resource('/users/foo/1', self.res1, 'foo')
+        self.assertEqual(my_reg.get_resources_after(None, '/', None, 1,
+                                                    'bar'), [])
+
+    def test_positions_per_owner_for_sanity(self):
+        '''
+        Test that listings only look at the resources of the category (or
+        under the path) which are public or belong to the user.
+        '''
+        registry = VisitCountingRegistry()
+        kind = Kind('http://example.com#', 'kind')
+        keys = []
+        for i in range(50):
+            keys.append(('/kind/foo/' + str(i), 'foo'))
+            keys.append(('/other/' + str(i), None))
+        keys.extend([('/kind/bar/1', 'bar'), ('/kind/pub', None),
+                     ('/kind/bar/2', 'bar')])
+        for key, owner in keys:
+            registry.add_resource(key, Resource(key, kind, []), owner)
+
+        expected = ['/kind/bar/1', '/kind/pub', '/kind/bar/2']
+        registry.visited = 0
+        page = registry.get_resources_after(None, '/kind/', None, None,
+                                            'bar')
+        self.assertEqual([item.identifier for _, item in page], expected)
+        self.assertEqual(registry.visited, 3)
+
+        registry.visited = 0
+        page = registry.get_resources_after(kind, '/kind/', page[0][0],
+                                            None, 'bar')
+        self.assertEqual([item.identifier for _, item in page],
+                         expected[1:])
+        self.assertEqual(registry.visited, 2)
+
+        registry.visited = 0
+        page = registry.get_resources_after(None, '/oth', None, 5, 'bar')
+        self.assertEqual([item.identifier for _, item in page],
+                         ['/other/' + str(i) for i in range(5)])
+        self.assertEqual(registry.visited, 5)
+
+        registry.delete_resource('/kind/pub', None)
+        page = registry.get_resources_after(None, '/kind/', None, None,
+                                            'bar')
+        self.assertEqual([item.identifier for _, item in page],
+                         ['/kind/bar/1', '/kind/bar/2'])
+
+
+class AttributeIndexTest(unittest.TestCase):
+    '''
+    Tests the index of attribute values.
+    '''
+
+    def test_index_for_sanity(self):
+        '''
+        Test that resources are indexed, hidden from others and removed.
+        '''
+        registry = MyRegistry(['state'])
+        res1 = Resource('/foo/1', None, [])
+        res1.attributes = {'state': 'active', 'other': 'x'}
+        res2 = Resource('/foo/2', None, [])
+        res2.attributes = {'state': 'active'}
+        registry.add_resource('/foo/1', res1, None)
+        registry.add_resource('/foo/2', res2, 'foo')
+
+        self.assertEqual(registry.get_resources_by_attribute(
+            'state', 'active', None), [res1])
+        self.assertEqual(len(registry.get_resources_by_attribute(
+            'state', 'active', 'foo')), 2)
+        self.assertEqual(registry.get_resources_by_attribute(
+            'other', 'x', None), None)
+
+        registry.delete_resource('/foo/1', None)
+        registry.delete_resource('/foo/2', None)
+        self.assertEqual(registry.get_resources_by_attribute(
+            'state', 'active', 'foo'), [])
+        self.assertEqual(registry._attributes, {})
+
+
+class ConcurrentBackendsRegistryTest(TestBackendsRegistry):
+    '''
+    Backend tests on the concurrent registry.
+    '''
+
+    registry = ConcurrentRegistry()
+
+
+class ConcurrentCategoryRegistryTest(CategoryRegistryTest):
+    '''
+    Category tests on the concurrent registry.
+    '''
+
+    registry = ConcurrentRegistry()
+
+
+class ConcurrentResourcesTest(ResourcesTest):
+    '''
+    Resource tests on the concurrent registry.
+    '''
+
+    registry = ConcurrentRegistry()
+
+
+class ConcurrencyStressTest(unittest.TestCase):
+    '''
+    Hammers the concurrent registry with threads.
+    '''
+
+    threads = 8
+
+    def setUp(self):
+        self.registry = ConcurrentRegistry()
+        self.kind = Kind('http://example.com#', 'compute',
+                         location='/compute/')
+        self.mixin = Mixin('http://example.com#', 'mine', location='/mine/')
+        self.registry.set_backend(self.kind, KindBackend(), None)
+        self.registry.set_backend(self.mixin, MixinBackend(), None)
+
+    def _run(self, target, *args):
+        '''
+        Runs the target in all threads and re-raises their errors.
+
+        target -- Function called with the thread number and the arguments.
+        '''
+        errors = []
+
+        def run(i):
+            '''
+            Collects errors of the target.
+            '''
+            try:
+                target(i, *args)
+            except Exception as error:  # pylint: disable=W0703
+                errors.append(error)
+
+        threads = [threading.Thread(target=run, args=(i,))
+                   for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def test_no_lost_updates_for_sanity(self):
+        '''
+        Test that concurrent writes and reads neither lose updates nor
+        break the indexes.
+        '''
+        def write(i, count):
+            '''
+            Adds, re-adds and deletes resources while reading.
+            '''
+            for j in range(count):
+                key = '/compute/%d_%d' % (i, j)
+                res = Resource(key, self.kind, [])
+                self.registry.add_resource(key, res, None)
+                self.registry.add_resource(key, res, None)
+                if j % 2:
+                    self.registry.add_to_category(self.mixin, res, None)
+                self.registry.get_resources_under_path('/compute/', None)
+                self.registry.get_resources_by_category(self.mixin, None)
+                if j % 5 == 0:
+                    self.registry.delete_resource(key, None)
+
+        self._run(write, 200)
+
+        expected = self.threads * 160
+        self.assertEqual(len(self.registry.get_resource_keys(None)),
+                         expected)
+        self.assertEqual(len(self.registry.get_resources_under_path(
+            '/compute/', None)), expected)
+        self.assertEqual(len(self.registry.get_resources_by_category(
+            self.kind, None)), expected)
+        self.assertEqual(len(self.registry.get_resources_by_category(
+            self.mixin, None)), self.threads * 80)
+
+    def test_parallel_reads_for_sanity(self):
+        '''
+        Test that readers do not wait for each other - all threads hold the
+        read lock at the same time so reads scale with the threads.
+        '''
+        lock = threading.Lock()
+        all_in = threading.Event()
+        inside = [0]
+
+        def read(i):
+            '''
+            Waits inside the read lock until all readers are in.
+            '''
+            with self.registry._stripes[0].index_lock.reading():
+                with lock:
+                    inside[0] += 1
+                    if inside[0] == self.threads:
+                        all_in.set()
+                all_in.wait(5)
+                if not all_in.is_set():
+                    raise AssertionError('Readers got serialized.')
+
+        self._run(read)
+        self.assertEqual(inside[0], self.threads)
+
+    def test_writer_for_sanity(self):
+        '''
+        Test that a writer waits for the readers.
+        '''
+        lock = self.registry._stripes[0].index_lock
+        written = threading.Event()
+
+        def write():
+            '''
+            Takes the write lock.
+            '''
+            with lock.writing():
+                written.set()
+
+        with lock.reading():
+            thread = threading.Thread(target=write)
+            thread.start()
+            self.assertFalse(written.wait(0.1))
+        thread.join()
+        self.assertTrue(written.is_set())
+
+    def test_disjoint_writes_for_sanity(self):
+        '''
+        Test that writes to keys of different stripes do not wait for each
+        other - and that reads of a listing only wait for the stripe which is
+        written.
+        '''
+        first = '/compute/0'
+        stripe = self.registry._get_stripe(first)
+        keys = ['/compute/%d' % i for i in range(1, 100)]
+        other = [key for key in keys
+                 if self.registry._get_stripe(key) is not stripe][0]
+        done = threading.Event()
+
+        def write():
+            '''
+            Adds a resource to another stripe and lists its category.
+            '''
+            self.registry.add_resource(other, Resource(other, self.kind, []),
+                                       None)
+            self.registry.add_to_category(
+                self.mixin, self.registry.get_resource(other, None), None)
+            done.set()
+
+        def read():
+            '''
+            Lists the kind - which visits all stripes.
+            '''
+            self.registry.get_resources_by_category(self.kind, None)
+            done.set()
+
+        self.registry.add_resource(first, Resource(first, self.kind, []),
+                                   None)
+        with stripe.writing():
+            thread = threading.Thread(target=write)
+            thread.start()
+            self.assertTrue(done.wait(5))
+            done.clear()
+            thread = threading.Thread(target=read)
+            thread.start()
+            # the listing visits the stripe which is written.
+            self.assertFalse(done.wait(0.1))
+        thread.join()
+        self.assertTrue(done.is_set())
+        self.assertEqual(len(self.registry.get_resources_by_category(
+            self.kind, None)), 2)
+
 
 class DummyBackend(KindBackend):
     '''
@@ -87,7 +87,8 @@ class SecurityChecksTest(unittest.TestCase):
     env = {'SERVER_NAME': 'localhost',
            'SERVER_PORT': '8888',
            'PATH_INFO': '/compute/',
-           'REQUEST_METHOD': 'GET'}
+           'REQUEST_METHOD': 'GET',
+           'wsgi.url_scheme': 'http'}
 
     my_registry = MyRegistry()
 
@@ -194,15 +195,15 @@ class SecurityChecksTest(unittest.TestCase):
 
         env1_list = self.env.copy()
         env1_list['username'] = 'foo'
-        id1 = app(env1_list, Response())[0]. strip().split('\n')
-        self.assertTrue(len(app(env1_list,
-                                Response())[0].strip().split('\n')) == 2)
+        id1 = b''.join(app(env1_list, Response())).strip().split(b'\n')
+        self.assertTrue(len(b''.join(app(env1_list, Response())).strip().split(
+            b'\n')) == 2)
 
         env2_list = self.env.copy()
         env2_list['username'] = 'bar'
-        id2 = app(env2_list, Response())[0]. strip().split('\n')
-        self.assertTrue(len(app(env2_list,
-                                Response())[0].strip().split('\n')) == 2)
+        id2 = b''.join(app(env2_list, Response())).strip().split(b'\n')
+        self.assertTrue(len(b''.join(app(env2_list, Response())).strip().split(
+            b'\n')) == 2)
 
         self.assertTrue(id1 != id2)
 
@@ -32,8 +32,12 @@ from occi import workflow
 from occi.backend import KindBackend, MixinBackend, ActionBackend
 from occi.core_model import Resource, Kind, Link, Action, Mixin
 from occi.exceptions import HTTPError
-from occi.registry import NonePersistentRegistry
+from occi.registry import ConcurrentRegistry, NonePersistentRegistry
+import gc
+import threading
+import time
 import unittest
+import weakref
 
 
 class EntityWorkflowTest(unittest.TestCase):
@@ -291,10 +295,37 @@ class CollectionWorkflowTest(unittest.TestCase):
         self.assertRaises(AttributeError, workflow.delete_from_collection,
                           self.kind, [], self.registry, None)
 
+    def test_get_page_for_failure(self):
+        '''
+        Check that broken cursors are refused.
+        '''
+        self.assertRaises(AttributeError, workflow.get_page, '/', [], {}, 1,
+                          'xyz', self.registry, None)
+
     #==========================================================================
     # Sanity
     #==========================================================================
 
+    def test_get_page_for_sanity(self):
+        '''
+        Check that paging returns every (filtered) entity once.
+        '''
+        result = []
+        cursor = None
+        while True:
+            page, cursor = workflow.get_page('/', [], {'foo': 'bar'}, 1,
+                                             cursor, self.registry, None)
+            result.extend(page)
+            if cursor is None:
+                break
+        self.assertEqual(sorted(item.identifier for item in result),
+                         ['/foo/src', '/link/foo'])
+
+        page, cursor = workflow.get_page('/foo/', [self.kind], {}, None, None,
+                                         self.registry, None)
+        self.assertEqual(len(page), 2)
+        self.assertTrue(cursor is None)
+
     def test_get_entities_for_sanity(self):
         '''
         Test if correct entities are returned.
@@ -486,3 +517,713 @@ class QueriyInterfaceTest(unittest.TestCase):
         workflow.remove_mixins([self.mixin], self.registry, None)
         self.assertFalse(self.mixin in self.registry.get_categories(None))
         self.assertFalse(self.mixin in res.mixins)
+
+
+class ConcurrentEntityWorkflowTest(EntityWorkflowTest):
+    '''
+    Entity workflow tests on the concurrent registry.
+    '''
+
+    registry = ConcurrentRegistry()
+
+    def test_create_links_for_sanity(self):
+        '''
+        Test that a link id is only taken once by concurrent creates.
+        '''
+        results = []
+
+        def create(i):
+            '''
+            Creates a resource with a link with a fixed id.
+            '''
+            src = Resource(None, self.test_kind, [], [])
+            src.links = [Link('/link/shared', self.link_kind, [], src,
+                              self.trg_entity)]
+            try:
+                workflow.create_entity('/foo/src' + str(i), src,
+                                       self.registry, None)
+                results.append(True)
+            except AttributeError:
+                results.append(False)
+
+        threads = [threading.Thread(target=create, args=(i,))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 1)
+
+
+class ConcurrentCollectionWorkflowTest(CollectionWorkflowTest):
+    '''
+    Collection workflow tests on the concurrent registry.
+    '''
+
+    registry = ConcurrentRegistry()
+
+
+class ConcurrentQueryInterfaceTest(QueriyInterfaceTest):
+    '''
+    Query interface tests on the concurrent registry.
+    '''
+
+    registry = ConcurrentRegistry()
+
+
+class ThreadFuture(object):
+    '''
+    The result of a call running in a thread of its own.
+    '''
+
+    def __init__(self, func, args):
+        self._result = self._error = None
+        self._thread = threading.Thread(target=self._run, args=(func, args))
+        self._thread.start()
+
+    def _run(self, func, args):
+        '''
+        Runs the call and remembers the result or the error.
+        '''
+        try:
+            self._result = func(*args)
+        except Exception as err:  # pylint: disable=W0703
+            self._error = err
+
+    def result(self):
+        '''
+        Waits for the call and returns its result - or raises its error.
+        '''
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class ThreadExecutor(object):
+    '''
+    Minimal executor which runs every call in a thread of its own -
+    concurrent.futures is not part of the Python 2 standard library.
+    '''
+
+    def submit(self, func, *args):
+        '''
+        Starts the call and returns its future.
+        '''
+        return ThreadFuture(func, args)
+
+
+class ExecutorRegistry(NonePersistentRegistry):
+    '''
+    Registry which calls the backends concurrently.
+    '''
+
+    executor = ThreadExecutor()
+
+
+class ExecutorEntityWorkflowTest(EntityWorkflowTest):
+    '''
+    Entity workflow tests with concurrent backend calls.
+    '''
+
+    registry = ExecutorRegistry()
+
+
+class SlowBackend(MixinBackend):
+    '''
+    Backend with a bulk API which takes its time and records the calls.
+    '''
+
+    def __init__(self, calls, fail=False):
+        self.calls = calls
+        self.fail = fail
+
+    def _call(self, name, entities):
+        '''
+        Waits a bit, records the call and fails if asked to.
+        '''
+        time.sleep(0.1)
+        for entity in entities:
+            self.calls.append((name, entity.identifier))
+        if self.fail:
+            raise AttributeError('Backend failed.')
+
+    def create_many(self, entities, extras):
+        self._call('create', entities)
+
+    def retrieve_many(self, entities, extras):
+        self._call('retrieve', entities)
+
+    def delete_many(self, entities, extras):
+        self._call('delete', entities)
+
+
+class BackendFanOutTest(unittest.TestCase):
+    '''
+    Tests the concurrent calls of the backends.
+    '''
+
+    def setUp(self):
+        self.registry = ExecutorRegistry()
+        self.calls = []
+        self.kind = Kind('http://example.com#', 'compute',
+                         location='/compute/')
+        self.link_kind = Kind('http://example.com#', 'link',
+                              location='/link/')
+        self.mixins = [Mixin('http://example.com#', str(i))
+                       for i in range(3)]
+        self.registry.set_backend(self.kind, SlowBackend(self.calls), None)
+        self.registry.set_backend(self.link_kind, SlowBackend(self.calls),
+                                  None)
+        for mixin in self.mixins:
+            self.registry.set_backend(mixin, SlowBackend(self.calls), None)
+
+    def _create(self):
+        '''
+        Creates a resource with 3 mixins and 2 links.
+        '''
+        trg = Resource('/compute/trg', self.kind, [], [])
+        self.registry.add_resource(trg.identifier, trg, None)
+        src = Resource(None, self.kind, self.mixins, [])
+        src.links = [Link('/link/%d' % i, self.link_kind, [], src, trg)
+                     for i in range(2)]
+        workflow.create_entity('/compute/src', src, self.registry, None)
+        return src
+
+    def test_create_for_sanity(self):
+        '''
+        Test that the backends are called concurrently - entity first.
+        '''
+        start = time.time()
+        src = self._create()
+        # 4 entity backends, then 2 link backends - each round takes 0.1s.
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertEqual(len(self.calls), 6)
+        self.assertEqual(set(self.calls[:4]),
+                         set([('create', '/compute/src')]))
+        self.assertEqual(sorted(self.calls[4:]), [('create', '/link/0'),
+                                                  ('create', '/link/1')])
+        self.assertEqual(sorted(self.registry.get_resource_keys(None)),
+                         ['/compute/src', '/compute/trg', '/link/0',
+                          '/link/1'])
+        self.assertEqual(src.links[0].identifier, '/link/0')
+
+    def test_retrieve_delete_for_sanity(self):
+        '''
+        Test that retrieve runs all backends at once and delete the links
+        first.
+        '''
+        src = self._create()
+        self.calls[:] = []
+
+        start = time.time()
+        workflow.retrieve_entity(src, self.registry, None)
+        self.assertTrue(time.time() - start < 0.2)
+        self.assertEqual(len(self.calls), 6)
+
+        self.calls[:] = []
+        workflow.delete_entity(src, self.registry, None)
+        self.assertEqual(sorted(self.calls[:2]), [('delete', '/link/0'),
+                                                  ('delete', '/link/1')])
+        self.assertEqual(len(self.calls), 6)
+        self.assertEqual(self.registry.get_resource_keys(None),
+                         ['/compute/trg'])
+
+    def test_errors_for_failure(self):
+        '''
+        Test that the first error is raised once all backends finished.
+        '''
+        self.registry.set_backend(self.mixins[1],
+                                  SlowBackend(self.calls, fail=True), None)
+        src = Resource(None, self.kind, self.mixins, [])
+        self.assertRaises(AttributeError, workflow.create_entity,
+                          '/compute/src', src, self.registry, None)
+        self.assertEqual(len(self.calls), 4)
+        self.assertFalse(self.registry.has_resource('/compute/src', None))
+
+    def test_link_ids_for_failure(self):
+        '''
+        Test that taken link ids are detected before any link backend runs.
+        '''
+        trg = Resource('/compute/trg', self.kind, [], [])
+        src = Resource(None, self.kind, [], [])
+        src.links = [Link('/link/0', self.link_kind, [], src, trg),
+                     Link('/link/0', self.link_kind, [], src, trg)]
+        self.assertRaises(AttributeError, workflow.create_entity,
+                          '/compute/src', src, self.registry, None)
+        self.assertEqual(self.calls, [('create', '/compute/src')])
+
+
+class CountingActionBackend(ActionBackend):
+    '''
+    Action backend which fails for some entities and records how many
+    actions run at the same time.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def action(self, entity, action, attributes, extras):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        if entity.identifier.endswith('3'):
+            raise AttributeError('Cannot do that.')
+
+
+class CollectionActionTest(unittest.TestCase):
+    '''
+    Tests actions on collections.
+    '''
+
+    def setUp(self):
+        self.kind = Kind('http://example.com#', 'compute')
+        self.action = Action('http://example.com#', 'start')
+        self.backend = CountingActionBackend()
+        self.entities = [Resource('/compute/' + str(i), self.kind, [], [])
+                         for i in range(20)]
+
+    def _run(self, registry):
+        '''
+        Runs the action on all entities.
+        '''
+        registry.set_backend(self.action, self.backend, None)
+        errors = workflow.action_collection(self.entities, self.action,
+                                            registry, {}, None)
+        self.assertEqual(len(errors), 20)
+        for entity, error in zip(self.entities, errors):
+            if entity.identifier.endswith('3'):
+                self.assertTrue(isinstance(error, AttributeError))
+            else:
+                self.assertTrue(error is None)
+
+    def test_sequential_for_sanity(self):
+        '''
+        Test that failures do not stop the other actions.
+        '''
+        self._run(NonePersistentRegistry())
+        self.assertEqual(self.backend.max_running, 1)
+
+    def test_concurrent_for_sanity(self):
+        '''
+        Test that the actions run concurrently within the limit.
+        '''
+        registry = ExecutorRegistry()
+        registry.collection_action_limit = 3
+        self._run(registry)
+        self.assertTrue(1 < self.backend.max_running <= 3)
+
+
+class BatchBackend(MixinBackend, ActionBackend):
+    '''
+    Backend which records the batch calls.
+    '''
+
+    def __init__(self):
+        self.calls = []
+
+    def create_many(self, entities, extras):
+        self.calls.append(('create', sorted(item.identifier
+                                            for item in entities)))
+
+    def delete_many(self, entities, extras):
+        self.calls.append(('delete', sorted(item.identifier
+                                            for item in entities)))
+
+    def action_many(self, entities, action, attributes, extras):
+        self.calls.append(('action', sorted(item.identifier
+                                            for item in entities)))
+        return [None] * len(entities)
+
+
+class FailingBackend(MixinBackend):
+    '''
+    Backend whose batch delete fails.
+    '''
+
+    def delete_many(self, entities, extras):
+        raise AttributeError('Cannot delete.')
+
+
+class BatchTest(unittest.TestCase):
+    '''
+    Tests that operations on several entities use the batch routines.
+    '''
+
+    def setUp(self):
+        self.registry = NonePersistentRegistry()
+        self.kind = Kind('http://example.com#', 'compute',
+                         location='/compute/')
+        self.link_kind = Kind('http://example.com#', 'link',
+                              location='/link/')
+        self.mixin = Mixin('http://example.com#', 'mine', location='/mine/')
+        self.action = Action('http://example.com#', 'start')
+        self.back = BatchBackend()
+        self.link_back = BatchBackend()
+        self.registry.set_backend(self.kind, self.back, None)
+        self.registry.set_backend(self.mixin, self.back, None)
+        self.registry.set_backend(self.action, self.back, None)
+        self.registry.set_backend(self.link_kind, self.link_back, None)
+
+        self.entities = []
+        for i in range(3):
+            res = Resource(None, self.kind, [], [])
+            workflow.create_entity('/compute/' + str(i), res, self.registry,
+                                   None)
+            self.entities.append(res)
+        link = Link(None, self.link_kind, [], self.entities[0],
+                    self.entities[1])
+        workflow.create_entity('/link/0', link, self.registry, None)
+        self.back.calls[:] = []
+        self.link_back.calls[:] = []
+
+    def test_collections_for_sanity(self):
+        '''
+        Test that mixin collections are updated with one call.
+        '''
+        workflow.update_collection(self.mixin, [], self.entities[:2],
+                                   self.registry, None)
+        workflow.replace_collection(self.mixin, self.entities[:2],
+                                    self.entities[1:], self.registry, None)
+        workflow.delete_from_collection(self.mixin, self.entities[1:],
+                                        self.registry, None)
+        self.assertEqual(self.back.calls,
+                         [('create', ['/compute/0', '/compute/1']),
+                          ('create', ['/compute/2']),
+                          ('delete', ['/compute/0']),
+                          ('delete', ['/compute/1', '/compute/2'])])
+
+    def test_action_collection_for_sanity(self):
+        '''
+        Test that an action on a collection is one call.
+        '''
+        errors = workflow.action_collection(self.entities, self.action,
+                                            self.registry, {}, None)
+        self.assertEqual(errors, [None, None, None])
+        self.assertEqual(self.back.calls,
+                         [('action', ['/compute/0', '/compute/1',
+                                      '/compute/2'])])
+
+    def test_delete_entities_for_sanity(self):
+        '''
+        Test that deleting a collection is one call per backend.
+        '''
+        workflow.delete_entities(self.registry.get_resources(None),
+                                 self.registry, None)
+        self.assertEqual(self.link_back.calls, [('delete', ['/link/0'])])
+        self.assertEqual(self.back.calls,
+                         [('delete', ['/compute/0', '/compute/1',
+                                      '/compute/2'])])
+        self.assertEqual(self.registry.get_resources(None), [])
+
+    def test_delete_entities_for_failure(self):
+        '''
+        Test that failing backends only keep the entities they cover.
+        '''
+        broken = Mixin('http://example.com#', 'broken')
+        self.registry.set_backend(broken, FailingBackend(), None)
+        self.entities[2].mixins.append(broken)
+        errors = workflow.delete_entities(self.entities, self.registry, None)
+        self.assertEqual(errors[:2], [None, None])
+        self.assertTrue(isinstance(errors[2], AttributeError))
+        self.assertEqual(self.registry.get_resource_keys(None),
+                         ['/compute/2'])
+
+    def test_delete_entities_with_links_for_failure(self):
+        '''
+        Test that the source of a link which was not deleted is kept.
+        '''
+        self.registry.set_backend(self.link_kind, FailingBackend(), None)
+        errors = workflow.delete_entities(self.entities, self.registry, None)
+        self.assertTrue(isinstance(errors[0], AttributeError))
+        self.assertEqual(errors[1:], [None, None])
+        self.assertEqual(sorted(self.registry.get_resource_keys(None)),
+                         ['/compute/0', '/link/0'])
+        self.assertEqual(len(self.entities[0].links), 1)
+
+
+class RetrieveCacheTest(unittest.TestCase):
+    '''
+    Tests the freshness policy of retrieve_entity.
+    '''
+
+    def setUp(self):
+        self.registry = NonePersistentRegistry()
+        self.calls = []
+        self.now = [1000.0]
+        self.kind = Kind('http://example.com#', 'compute',
+                         location='/compute/')
+        self.link_kind = Kind('http://example.com#', 'link',
+                              location='/link/')
+        self.action = Action('http://example.com#', 'start')
+        self.registry.set_backend(self.kind, SlowBackend(self.calls), None)
+        self.registry.set_backend(self.link_kind, SlowBackend(self.calls),
+                                  None)
+        self.registry.set_backend(self.action, ActionBackend(), None)
+        self.registry.freshness = {self.kind: 5}
+        self.cache = workflow.get_retrieve_cache(self.registry)
+        self.cache.clock = lambda: self.now[0]
+
+        trg = Resource('/compute/trg', self.kind, [], [])
+        self.registry.add_resource(trg.identifier, trg, None)
+        self.res = Resource(None, self.kind, [], [])
+        self.res.links = [Link('/link/1', self.link_kind, [], self.res, trg)]
+        workflow.create_entity('/compute/1', self.res, self.registry, None)
+        self.calls[:] = []
+
+    def test_retrieve_for_sanity(self):
+        '''
+        Test that fresh entities are skipped - links have no policy.
+        '''
+        workflow.retrieve_entity(self.res, self.registry, None)
+        workflow.retrieve_entity(self.res, self.registry, None)
+        self.assertEqual(self.calls, [('retrieve', '/link/1'),
+                                      ('retrieve', '/compute/1'),
+                                      ('retrieve', '/link/1')])
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 3)
+        self.assertEqual(self.cache.get_hit_rate(), 0.25)
+
+        self.calls[:] = []
+        self.now[0] += 5
+        workflow.retrieve_entity(self.res, self.registry, None)
+        self.assertTrue(('retrieve', '/compute/1') in self.calls)
+
+    def test_lazy_links_for_sanity(self):
+        '''
+        Test that the links can be left out.
+        '''
+        workflow.retrieve_entity(self.res, self.registry, None, False)
+        self.assertEqual(self.calls, [('retrieve', '/compute/1')])
+
+        # retrieves with and without links are separate flights.
+        self.assertEqual(self.cache.take_off(self.res, False), None)
+        self.assertEqual(self.cache.take_off(self.res), None)
+        self.assertNotEqual(self.cache.take_off(self.res, False), None)
+        self.cache.land(self.res, None, False)
+        self.cache.land(self.res, None)
+
+    def test_invalidate_for_sanity(self):
+        '''
+        Test that changes made through the workflow invalidate the entity.
+        '''
+        workflow.retrieve_entity(self.res, self.registry, None)
+        workflow.action_entity(self.res, self.action, self.registry, {},
+                               None)
+        self.calls[:] = []
+        workflow.retrieve_entity(self.res, self.registry, None)
+        self.assertTrue(('retrieve', '/compute/1') in self.calls)
+
+        new = Resource('/compute/1', self.kind, [], [])
+        workflow.update_entity(self.res, new, self.registry, None)
+        self.calls[:] = []
+        workflow.retrieve_entity(self.res, self.registry, None)
+        self.assertTrue(('retrieve', '/compute/1') in self.calls)
+
+        # a new entity with the same key is never served from the cache.
+        workflow.delete_entity(self.res, self.registry, None)
+        other = Resource('/compute/1', self.kind, [], [])
+        self.registry.add_resource('/compute/1', other, None)
+        self.calls[:] = []
+        workflow.retrieve_entity(other, self.registry, None)
+        self.assertEqual(self.calls, [('retrieve', '/compute/1')])
+
+    def test_size_for_sanity(self):
+        '''
+        Test that only entities with a freshness are remembered - weakly
+        and up to max_size of them.
+        '''
+        workflow.retrieve_entity(self.res, self.registry, None)
+        self.assertEqual(len(self.cache), 1)
+
+        kind = Kind('http://example.com#', 'fast')
+        self.registry.set_backend(kind, KindBackend(), None)
+        self.registry.freshness[kind] = 5
+        self.cache.max_size = 10
+        resources = [Resource('/compute/x' + str(i), kind, [], [])
+                     for i in range(20)]
+        for res in resources:
+            workflow.retrieve_entity(res, self.registry, None)
+        self.assertEqual(len(self.cache), 10)
+        self.assertTrue(self.cache.is_fresh(resources[-1], self.registry))
+        self.assertFalse(self.cache.is_fresh(resources[0], self.registry))
+
+        ref = weakref.ref(resources[-1])
+        del resources, res
+        gc.collect()
+        self.assertTrue(ref() is None)
+
+        self.registry.freshness = None
+        self.cache.max_size = workflow.RETRIEVE_CACHE_SIZE
+        self.cache.invalidate([self.res])
+        for i in range(100):
+            res = Resource('/compute/y' + str(i), kind, [], [])
+            workflow.retrieve_entity(res, self.registry, None)
+        self.assertEqual(len(self.cache), 10)
+
+
+class GateBackend(KindBackend):
+    '''
+    Backend whose retrieve blocks until the gate opens.
+    '''
+
+    def __init__(self, gate, fail=False):
+        self.gate = gate
+        self.fail = fail
+        self.calls = 0
+
+    def retrieve(self, entity, extras):
+        self.calls += 1
+        self.gate()
+        if self.fail:
+            raise AttributeError('Backend failed.')
+
+
+class SingleFlightTest(unittest.TestCase):
+    '''
+    Tests that concurrent retrieves of the same entity are coalesced.
+    '''
+
+    threads = 8
+
+    def setUp(self):
+        self.registry = NonePersistentRegistry()
+        self.kind = Kind('http://example.com#', 'compute')
+        self.cache = workflow.get_retrieve_cache(self.registry)
+        self.res = Resource('/compute/1', self.kind, [], [])
+
+    def _gate(self):
+        '''
+        Waits until all other threads joined the flight.
+        '''
+        start = time.time()
+        while self.cache.coalesced < self.threads - 1:
+            if time.time() - start > 5:
+                raise AssertionError('Retrieves were not coalesced.')
+            time.sleep(0.001)
+
+    def _retrieve_all(self):
+        '''
+        Retrieves the resource from all threads and returns the errors.
+        '''
+        errors = []
+
+        def retrieve():
+            '''
+            Retrieves the resource.
+            '''
+            try:
+                workflow.retrieve_entity(self.res, self.registry, None)
+            except AttributeError as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=retrieve)
+                   for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_coalesce_for_sanity(self):
+        '''
+        Test that the backend is called once for concurrent retrieves.
+        '''
+        backend = GateBackend(self._gate)
+        self.registry.set_backend(self.kind, backend, None)
+        self.assertEqual(self._retrieve_all(), [])
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(self.cache.coalesced, self.threads - 1)
+
+        # once landed the next retrieve calls the backend again.
+        workflow.retrieve_entity(self.res, self.registry, None)
+        self.assertEqual(backend.calls, 2)
+
+    def test_coalesce_for_failure(self):
+        '''
+        Test that all waiting callers get the error.
+        '''
+        backend = GateBackend(self._gate, fail=True)
+        self.registry.set_backend(self.kind, backend, None)
+        self.assertEqual(len(self._retrieve_all()), self.threads)
+        self.assertEqual(backend.calls, 1)
+
+
+class StoppingBackend(KindBackend):
+    '''
+    Backend which finds the resources stopped when retrieving them.
+    '''
+
+    def retrieve(self, entity, extras):
+        entity.attributes['state'] = 'stopped'
+
+
+class AttributeIndexTest(unittest.TestCase):
+    '''
+    Tests that filtering with the attribute index gives the same results as
+    scoring all entities.
+    '''
+
+    def setUp(self):
+        self.kind = Kind('http://example.com#', 'compute',
+                         location='/compute/')
+        self.mixins = [Mixin('http://example.com#', 'a', location='/a/'),
+                       Mixin('http://example.com#', 'b', location='/b/')]
+        self.indexed = NonePersistentRegistry(['state', 'size'])
+        self.plain = NonePersistentRegistry()
+        for registry in [self.indexed, self.plain]:
+            registry.set_backend(self.kind, KindBackend(), None)
+            for mixin in self.mixins:
+                registry.set_backend(mixin, MixinBackend(), None)
+            for i in range(60):
+                key = '/compute/%d' % i
+                res = Resource(key, self.kind, self.mixins[:i % 3], [])
+                res.attributes = {'state': ['active', 'inactive'][i % 2],
+                                  'size': str(i % 4)}
+                if i % 5 == 0:
+                    res.attributes['size'] = ['unhashable']
+                registry.add_resource(key, res, None)
+
+    def _compare(self, path, categories, attributes):
+        '''
+        Compares the results of both registries.
+        '''
+        indexed = workflow.filter_entities_under_path(path, categories,
+                                                      attributes,
+                                                      self.indexed, None)
+        plain = workflow.filter_entities(
+            workflow.get_entities_under_path(path, self.plain, None),
+            categories, attributes)
+        self.assertEqual(sorted(item.identifier for item in indexed),
+                         sorted(item.identifier for item in plain))
+
+    def test_filter_for_sanity(self):
+        '''
+        Test all kinds of filters.
+        '''
+        filters = [{}, {'state': 'active'}, {'size': '1'},
+                   {'state': 'active', 'size': '1'},
+                   {'state': 'inactive', 'size': '2'}, {'state': 'foo'}]
+        for path in ['/', '/compute/', '/compute/1', '/a/', '/b/']:
+            for categories in [[], [self.kind], [self.mixins[1]]]:
+                for attributes in filters:
+                    self._compare(path, categories, attributes)
+
+    def test_update_for_sanity(self):
+        '''
+        Test that changed attributes are re-indexed on update.
+        '''
+        res = self.indexed.get_resource('/compute/0', None)
+        self.indexed.set_backend(self.kind, StoppingBackend(), None)
+        self.assertEqual(self.indexed.get_resources_by_attribute(
+            'state', 'stopped', None), [])
+        workflow.retrieve_entity(res, self.indexed, None)
+        self.assertEqual(self.indexed.get_resources_by_attribute(
+            'state', 'stopped', None), [res])
+        self.assertEqual(self.plain.get_resources_by_attribute(
+            'state', 'stopped', None), None)
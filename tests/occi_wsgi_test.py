@@ -31,6 +31,7 @@ Created on Nov 24, 2011
 # pylint: disable=R0904,R0201,R0903,C0103
 
 from occi.backend import ActionBackend, KindBackend, MixinBackend
+from occi.core_model import Resource
 from occi.extensions.infrastructure import COMPUTE, IPNETWORKINTERFACE, START
 from occi.protocol.html_rendering import HTMLRendering
 from occi.protocol.occi_rendering import TextOcciRendering, \
@@ -38,8 +39,9 @@ from occi.protocol.occi_rendering import TextOcciRendering, \
 from occi.registry import NonePersistentRegistry
 from occi.wsgi import Application
 
+import io
 import unittest
-import StringIO
+import zlib
 
 
 class MockResponse(object):
@@ -54,6 +56,23 @@ class MockResponse(object):
         pass
 
 
+class RecordingResponse(object):
+    '''
+    A mock which remembers the headers...
+    '''
+
+    def __init__(self):
+        self.status = None
+        self.headers = {}
+
+    def __call__(self, stat, heads):
+        '''
+        Makes the mock callable...
+        '''
+        self.status = stat
+        self.headers = dict(heads)
+
+
 class ApplicationTest(unittest.TestCase):
     '''
     Tests for the WSGI application.
@@ -141,8 +160,166 @@ class ApplicationTest(unittest.TestCase):
         environ['PATH_INFO'] = '/foo'
 
         # Check that a body can be set!
-        output = StringIO.StringIO()
-        output.write('First line.\n')
+        output = io.BytesIO()
+        output.write(b'First line.\n')
         environ['wsgi.input'] = output
 
         app.__call__(environ, response)
+
+    def test_streaming_for_sanity(self):
+        '''
+        Test that listings are streamed without a Content-Length - unless
+        the rendering does not stream.
+        '''
+        app = Application()
+        app.register_backend(COMPUTE, KindBackend())
+        for i in range(3):
+            key = '/compute/' + str(i)
+            app.registry.add_resource(key, Resource(key, COMPUTE, []), None)
+
+        response = RecordingResponse()
+        environ = {'SERVER_NAME': 'foo',
+                   'SERVER_PORT': '8888',
+                   'wsgi.url_scheme': 'http',
+                   'PATH_INFO': '/compute/',
+                   'REQUEST_METHOD': 'GET',
+                   'HTTP_ACCEPT': 'text/uri-list'}
+        body = app(environ, response)
+        self.assertFalse('Content-length' in response.headers)
+        self.assertEqual(b''.join(body).count(b'/compute/'), 4)
+
+        # text/occi renders the listing in one piece.
+        environ['HTTP_ACCEPT'] = 'text/occi'
+        body = app(environ, response)
+        self.assertEqual(response.headers['Content-length'],
+                         str(len(b''.join(body))))
+
+        environ['PATH_INFO'] = '/-/'
+        environ['HTTP_ACCEPT'] = 'text/plain'
+        body = app(environ, response)
+        self.assertEqual(response.headers['Content-length'],
+                         str(len(b''.join(body))))
+
+    def test_conditional_get_for_sanity(self):
+        '''
+        Test that the ETag is honored - 304s come without a body.
+        '''
+        app = Application()
+        app.register_backend(COMPUTE, KindBackend())
+        app.registry.add_resource('/compute/1',
+                                  Resource('/compute/1', COMPUTE, []), None)
+
+        response = RecordingResponse()
+        environ = {'SERVER_NAME': 'foo',
+                   'SERVER_PORT': '8888',
+                   'wsgi.url_scheme': 'http',
+                   'PATH_INFO': '/compute/1',
+                   'REQUEST_METHOD': 'GET',
+                   'HTTP_ACCEPT': 'text/plain'}
+        app(environ, response)
+        environ['HTTP_IF_NONE_MATCH'] = response.headers['ETag']
+        body = app(environ, response)
+        self.assertEqual(response.status, '304 Not Modified')
+        self.assertEqual(body, [b''])
+        self.assertFalse('Content-length' in response.headers)
+
+    def test_compression_for_sanity(self):
+        '''
+        Test that large bodies are compressed with the accepted coding -
+        buffered and streamed.
+        '''
+        app = Application(compression_threshold=512)
+        app.register_backend(COMPUTE, KindBackend())
+        for i in range(100):
+            key = '/compute/' + str(i)
+            app.registry.add_resource(key, Resource(key, COMPUTE, []), None)
+
+        response = RecordingResponse()
+        environ = {'SERVER_NAME': 'foo',
+                   'SERVER_PORT': '8888',
+                   'wsgi.url_scheme': 'http',
+                   'PATH_INFO': '/compute/',
+                   'REQUEST_METHOD': 'GET',
+                   'HTTP_ACCEPT': 'text/uri-list'}
+        plain = b''.join(app(environ, response))
+        self.assertFalse('Content-Encoding' in response.headers)
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+
+        # streamed
+        environ['HTTP_ACCEPT_ENCODING'] = 'deflate, gzip;q=0.5'
+        body = b''.join(app(environ, response))
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+        self.assertFalse('Content-length' in response.headers)
+        self.assertEqual(zlib.decompress(body), plain)
+
+        # buffered
+        environ['PATH_INFO'] = '/-/'
+        environ['HTTP_ACCEPT'] = 'text/plain'
+        environ['HTTP_ACCEPT_ENCODING'] = 'gzip'
+        body = b''.join(app(environ, response))
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Content-length'], str(len(body)))
+        self.assertTrue(b'Category' in
+                        zlib.decompress(body, 16 + zlib.MAX_WBITS))
+
+        self.assertEqual(app.compression.responses, 2)
+        self.assertTrue(app.compression.get_ratio() < 0.5)
+        self.assertTrue(app.compression.cpu_time >= 0)
+
+    def test_compression_for_failure(self):
+        '''
+        Test that small bodies and refused codings are not compressed.
+        '''
+        app = Application(compression_threshold=512)
+        app.register_backend(COMPUTE, KindBackend())
+        app.registry.add_resource('/compute/1',
+                                  Resource('/compute/1', COMPUTE, []), None)
+
+        response = RecordingResponse()
+        environ = {'SERVER_NAME': 'foo',
+                   'SERVER_PORT': '8888',
+                   'wsgi.url_scheme': 'http',
+                   'PATH_INFO': '/compute/',
+                   'REQUEST_METHOD': 'GET',
+                   'HTTP_ACCEPT': 'text/uri-list',
+                   'HTTP_ACCEPT_ENCODING': 'gzip'}
+        body = b''.join(app(environ, response))
+        self.assertFalse('Content-Encoding' in response.headers)
+        self.assertEqual(response.headers['Content-length'], str(len(body)))
+
+        environ['PATH_INFO'] = '/-/'
+        environ['HTTP_ACCEPT'] = 'text/plain'
+        for header in ['gzip;q=0, deflate;q=0', 'identity', '*;q=0',
+                       'identity, gzip;q=0.5']:
+            environ['HTTP_ACCEPT_ENCODING'] = header
+            app(environ, response)
+            self.assertFalse('Content-Encoding' in response.headers)
+        self.assertEqual(app.compression.responses, 0)
+
+        environ['HTTP_ACCEPT_ENCODING'] = 'gzip;q=0, *'
+        app(environ, response)
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+
+    def test_hostname_for_sanity(self):
+        '''
+        Test that the locations use the host of each request - without
+        touching the registry.
+        '''
+        app = Application()
+        app.register_backend(COMPUTE, KindBackend())
+        app.registry.add_resource('/compute/1',
+                                  Resource('/compute/1', COMPUTE, []), None)
+
+        response = RecordingResponse()
+        environ = {'SERVER_NAME': 'foo',
+                   'SERVER_PORT': '8888',
+                   'wsgi.url_scheme': 'http',
+                   'PATH_INFO': '/compute/',
+                   'REQUEST_METHOD': 'GET',
+                   'HTTP_ACCEPT': 'text/uri-list'}
+        for host in ['a.example.com', 'b.example.com']:
+            environ['HTTP_HOST'] = host
+            body = b''.join(app(environ, response))
+            self.assertTrue(('http://' + host + '/compute/1').encode('utf-8')
+                            in body)
+        self.assertEqual(app.registry.get_hostname(), '')